@@ -13,21 +13,60 @@ panels.
 """
 import logging
 import argparse
+import threading
 import time
 
 import yaml
-from picamera.exc import PiCameraMMALError
 
 # pylint: disable=import-self
 from dencam import __version__
+from dencam import metrics
+from dencam import fake_gpio
+from dencam import mppt
 from dencam.logs import setup_logger
-from dencam.buttons import ButtonHandler
-from dencam.recorder_picamera import PicameraRecorder
+from dencam.actions import ActionExecutor
+from dencam.buttons import (ButtonHandler, SCREEN_BUTTON, FUNCTION_BUTTON,
+                            RECORD_BUTTON, ZOOM_BUTTON)
 from dencam.gui import ErrorScreen, Controller, State
-from dencam.networking import AirplaneMode
+from dencam.networking import AirplaneMode, SimulatedAirplaneMode
+from dencam.recorder_simulated import SimulatedRecorder
+from dencam.solar_poller import SolarPoller
+from dencam.sunsaver_sim import SunSaverSimulator
+from dencam.governor import PowerGovernor
+from dencam.status_server import StatusServer
+from dencam.runtime import Runtime
 
 log = setup_logger(logging.INFO)
 
+# names usable for the buttons in a --button-script
+BUTTON_NAMES = {'SCREEN': SCREEN_BUTTON, 'FUNCTION': FUNCTION_BUTTON,
+                'RECORD': RECORD_BUTTON, 'ZOOM': ZOOM_BUTTON}
+
+
+def open_recorder(configs):
+    """Open the Pi camera, showing an error screen until it can be
+
+    """
+    # imported here so that simulated runs do not need picamera
+    # pylint: disable=import-outside-toplevel
+    from picamera.exc import PiCameraMMALError
+    from dencam.recorder_picamera import PicameraRecorder
+
+    error_screen = None
+    while True:
+        try:
+            recorder = PicameraRecorder(configs)
+            break
+        except PiCameraMMALError as cam_error:
+            log.warning(cam_error)
+            metrics.emit('camera_error', error=str(cam_error))
+            if error_screen is None:
+                error_screen = ErrorScreen()
+            time.sleep(.5)
+    if error_screen is not None:
+        error_screen.hide()
+    return recorder
+
 
 def main():
     """Run main DenCam program
@@ -41,10 +80,22 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('config_file',
                         help='DenCam configuration file (YAML)')
+    parser.add_argument('--simulate', action='store_true',
+                        help='run on simulated hardware (as SIMULATE: True)')
+    parser.add_argument('--button-script',
+                        help='with simulated hardware, file of button '
+                        'presses to replay (see fake_gpio.read_script)')
     args = parser.parse_args()
     with open(args.config_file, 'r', encoding='utf8') as config_file:
         configs = yaml.load(config_file, Loader=yaml.SafeLoader)
     log.info('Ingested configuration settings')
+    if args.simulate:
+        configs['SIMULATE'] = True
+    simulate = configs.get('SIMULATE', False)
+    if simulate:
+        log.info('Running on simulated camera, buttons and SunSaver')
+    metrics.start(configs)
+    metrics.emit('startup', version=__version__)
 
     flags = {'stop_buttons_flag': False}
     state_list = ['OffPage',
@@ -52,45 +103,76 @@ def main():
                   'RecordingPage',
                   "SolarPage",
                   "BlankPage"]
+    solar_poller = None
+    sunsaver = None
+    gpio = None
+    script_stop = threading.Event()
 
     try:
-        checking_camera = True
-        error_screen = None
-        while checking_camera:
-            try:
-                recorder = PicameraRecorder(configs)
-                checking_camera = False
-            except PiCameraMMALError as cam_error:
-                log.warning(cam_error)
-                if error_screen is None:
-                    error_screen = ErrorScreen()
-                time.sleep(.5)
-        if error_screen is not None:
-            error_screen.hide()
+        if simulate:
+            recorder = SimulatedRecorder(configs)
+            airplane_mode = SimulatedAirplaneMode(configs)
+            gpio = fake_gpio.FakeGPIO()
+        else:
+            recorder = open_recorder(configs)
+            airplane_mode = AirplaneMode(configs)
 
         number_of_states = len(state_list)
         state = State(number_of_states)
-        airplane_mode = AirplaneMode(configs)
+        executor = ActionExecutor()
+
+        if configs.get('SOLAR_POLL_INTERVAL'):
+            client = None
+            if simulate:
+                sunsaver = SunSaverSimulator().start()
+                client = mppt.SunSaverClient(sunsaver.port)
+            solar_poller = SolarPoller(configs, client=client)
+
         button_handler = ButtonHandler(recorder,
                                        state,
                                        state_list,
                                        airplane_mode,
-                                       lambda: flags['stop_buttons_flag'])
-        button_handler.daemon = True
-        button_handler.start()
+                                       lambda: flags['stop_buttons_flag'],
+                                       gpio=gpio,
+                                       executor=executor,
+                                       solar_poller=solar_poller)
+
+        if simulate and args.button_script:
+            with open(args.button_script, encoding='utf8') as script:
+                steps = fake_gpio.read_script(script, BUTTON_NAMES)
+            threading.Thread(target=fake_gpio.play_script,
+                             args=(gpio, steps, script_stop),
+                             name='ButtonScript', daemon=True).start()
+
+        governor = None
+        if configs.get('POWER_GOVERNOR'):
+            governor = PowerGovernor(configs)
 
         controller = Controller(configs, recorder, state_list,
-                                state, airplane_mode)
+                                state, airplane_mode, solar_poller,
+                                governor)
+        executor.add_listener(controller.action_completed)
         controller.daemon = True
-        controller.start()
 
-        while True:
-            time.sleep(.1)
+        status_server = None
+        if configs.get('STATUS_PORT'):
+            status_server = StatusServer(configs, recorder, controller,
+                                         solar_poller, button_handler)
+
+        # buttons, segment scheduling, solar polling and the status
+        # server run on the runtime's event loop until SIGINT or SIGTERM
+        runtime = Runtime(configs, recorder, controller, button_handler,
+                          solar_poller, status_server)
+        controller.start()
+        runtime.run()
 
     except KeyboardInterrupt:
         log.info('Keyboard interrupt received.')
-        flags['stop_buttons_flag'] = True
-        time.sleep(.1)
+    finally:
+        script_stop.set()
+        if sunsaver is not None:
+            sunsaver.stop()
+        metrics.stop()
 
 
 if __name__ == "__main__":
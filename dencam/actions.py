@@ -0,0 +1,156 @@
+"""Background execution of user-triggered actions.
+
+Some of the things a button press asks for are slow (reading the
+charge controller over Modbus, stepping the camera zoom, searching
+the drives before starting a recording).  This module provides a small
+executor that runs those actions on worker threads so that button
+input is never blocked waiting on them.
+
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+
+class ActionExecutor:
+    """Bounded pool of worker threads for named actions
+
+    Actions are submitted under a name, and actions of the same name
+    run one at a time in the order submitted, so that e.g. two quick
+    presses of "toggle recording" stop and then start the recording
+    rather than racing each other.  Idempotent actions can instead be
+    submitted with coalesce set: while one with that name is waiting
+    or running, further submissions with the name are dropped into it,
+    so that e.g. ten presses of "update solar" produce one read of the
+    charge controller.
+
+    When an action finishes, each registered listener is called with
+    the action's name, the exception it raised (or None) and its
+    latency in seconds measured from first submission to completion.
+    Listeners run on the worker thread.
+
+    Parameters
+    ----------
+    max_workers : int
+        Number of worker threads
+    max_pending : int
+        Maximum number of distinct actions waiting to run, and of
+        submissions waiting behind a running action of the same name.
+        Submissions beyond this are dropped.
+    history : int
+        Number of latency samples kept per action name
+
+    """
+
+    def __init__(self, max_workers=2, max_pending=8, history=50):
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._max_pending = max_pending
+        # name of each waiting or running action, mapped to the
+        # submissions of that name queued behind it
+        self._active = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._history = history
+        self.latencies = {}
+        self._workers = []
+        for index in range(max_workers):
+            worker = threading.Thread(target=self._work,
+                                      name=f'ActionWorker-{index}',
+                                      daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def add_listener(self, listener):
+        """Register callable invoked as listener(name, error, latency)"""
+        self._listeners.append(listener)
+
+    def submit(self, name, function, *args, coalesce=False, **kwargs):
+        """Schedule function to run on a worker under given name
+
+        If an action of the same name is waiting or running, function
+        runs after it, or with coalesce set (only for idempotent
+        actions), not at all.
+
+        Returns:
+            bool: True if the action was queued, False if it was
+            coalesced into an outstanding action of the same name or
+            dropped because the executor is saturated
+
+        """
+        item = (name, function, args, kwargs, time.monotonic())
+        with self._lock:
+            if name in self._active:
+                if coalesce:
+                    log.debug('Action %s already outstanding; coalesced',
+                              name)
+                    return False
+                waiting = self._active[name]
+                if len(waiting) >= self._max_pending:
+                    log.warning('Too many pending %s actions; dropped one',
+                                name)
+                    return False
+                waiting.append(item)
+                return True
+            try:
+                self._pending.put_nowait(item)
+            except queue.Full:
+                log.warning('Too many pending actions; dropped %s', name)
+                return False
+            self._active[name] = deque()
+        return True
+
+    def is_active(self, name):
+        """Whether an action of given name is waiting or running"""
+        with self._lock:
+            return name in self._active
+
+    def shutdown(self, wait=True):
+        """Stop the workers once already queued actions have run"""
+        for _ in self._workers:
+            self._pending.put(None)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def _work(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            # run the submissions queued behind this action here too,
+            # so actions of one name never run on two workers at once
+            while item is not None:
+                self._run(*item)
+                with self._lock:
+                    waiting = self._active[item[0]]
+                    if waiting:
+                        item = waiting.popleft()
+                    else:
+                        del self._active[item[0]]
+                        item = None
+
+    def _run(self, name, function, args, kwargs, submitted):
+        error = None
+        try:
+            function(*args, **kwargs)
+        except Exception as action_error:  # pylint: disable=broad-except
+            log.exception('Action %s failed', name)
+            error = action_error
+        latency = time.monotonic() - submitted
+        self._record_latency(name, latency)
+        log.debug('Action %s completed in %.3f s', name, latency)
+        for listener in self._listeners:
+            try:
+                listener(name, error, latency)
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Listener for action %s failed', name)
+
+    def _record_latency(self, name, latency):
+        with self._lock:
+            if name not in self.latencies:
+                self.latencies[name] = deque(maxlen=self._history)
+            self.latencies[name].append(latency)
@@ -0,0 +1,309 @@
+"""Activity timelines of recorded segments
+
+Decodes each segment with ffmpeg at low resolution (SAMPLE_SIZE) and a
+low frame rate (SAMPLE_FPS, grayscale), and measures motion as the
+mean absolute difference between consecutive sampled frames, ignoring
+differences below a noise floor so sensor noise and compression
+artefacts do not count as movement. The result is one motion energy
+value per second of video, saved per segment as
+<stem>.activity.npy (float16) next to a manifest
+(activity-manifest.jsonl) that also holds each segment's start time and
+summary scores. Segments are analysed in a process pool, one ffmpeg per
+core, and a rerun only analyses segments not yet in the manifest.
+
+Timelines are read back with load_timelines(), e.g. to draw the
+date by time-of-day heatmap in utilities/activity_heatmap.py, and the
+summary scores are what dencam-reclaim uses to find inactive footage.
+
+Usage:
+    dencam-activity /media/pi/A /media/pi/B --fps 25
+    dencam-activity /data/unit3/A --output-dir /data/unit3/review --fps 25
+
+"""
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import yaml
+
+from dencam.segments import group_by_output, Manifest
+
+MANIFEST_NAME = 'activity-manifest.jsonl'
+ACTIVITY_DIR = 'activity'
+SUFFIX = '.activity.npy'
+SAMPLE_FPS = 2
+SAMPLE_SIZE = (160, 120)
+# grey levels of frame to frame difference treated as noise
+NOISE_FLOOR = 8
+# energy above which a second counts as active in the summary scores
+ACTIVE_LEVEL = 0.5
+# sampled frames processed at a time
+BLOCK_FRAMES = 64
+
+
+def motion_energy(frames, previous=None, noise_floor=NOISE_FLOOR):
+    """Motion between consecutive grayscale frames
+
+    Args:
+        frames (numpy.ndarray): uint8 array of shape (n, height, width)
+        previous (numpy.ndarray): frame before frames[0], if any
+        noise_floor (int): differences up to this are ignored
+
+    Returns:
+        numpy.ndarray: float32 energy for each frame after the first
+        (or each frame, if previous is given)
+
+    """
+    if previous is not None:
+        frames = np.concatenate([previous[np.newaxis], frames])
+    if len(frames) < 2:
+        return np.zeros(0, np.float32)
+    difference = np.abs(np.diff(frames.astype(np.int16), axis=0))
+    np.subtract(difference, noise_floor, out=difference)
+    np.maximum(difference, 0, out=difference)
+    return difference.mean(axis=(1, 2), dtype=np.float32)
+
+
+def per_second(energy, sample_fps=SAMPLE_FPS):
+    """Average per-sample energy over each second"""
+    if not len(energy):
+        return np.zeros(0, np.float32)
+    seconds = (np.arange(1, len(energy) + 1) // sample_fps).astype(int)
+    totals = np.bincount(seconds, weights=energy)
+    counts = np.bincount(seconds)
+    return (totals / np.maximum(counts, 1)).astype(np.float32)
+
+
+def segment_activity(path, fps, sample_fps=SAMPLE_FPS, size=SAMPLE_SIZE,
+                     noise_floor=NOISE_FLOOR):
+    """Motion energy per second of one segment
+
+    Runs in a worker process. The frames are streamed from ffmpeg and
+    processed BLOCK_FRAMES at a time, so memory use does not depend on
+    the segment's length. ffmpeg's stderr goes to a temporary file
+    rather than a pipe, which ffmpeg could fill and then block on
+    while the frames are still being read.
+
+    Args:
+        path (str): .h264 file
+        fps (float): frame rate it was recorded at
+
+    Returns:
+        numpy.ndarray: float32 energy for each second
+
+    """
+    width, height = size
+    frame_bytes = width * height
+    command = ['ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error',
+               '-threads', '1', '-skip_loop_filter', 'all',
+               '-r', str(fps), '-i', path,
+               '-vf', f'fps={sample_fps},scale={width}:{height}:flags=area',
+               '-pix_fmt', 'gray', '-f', 'rawvideo', 'pipe:1']
+    energies = []
+    previous = None
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                   stderr=stderr)
+        try:
+            while True:
+                data = process.stdout.read(frame_bytes * BLOCK_FRAMES)
+                count = len(data) // frame_bytes
+                if not count:
+                    break
+                frames = np.frombuffer(data[:count * frame_bytes],
+                                       np.uint8).reshape(count, height,
+                                                         width)
+                energies.append(motion_energy(frames, previous,
+                                              noise_floor))
+                previous = frames[-1]
+        finally:
+            process.stdout.close()
+            process.wait()
+        stderr.seek(0)
+        error = stderr.read()
+    if process.returncode != 0:
+        message = error.decode(errors='replace').strip()
+        raise OSError(message.splitlines()[-1] if message
+                      else f'ffmpeg exited with {process.returncode}')
+    energy = np.concatenate(energies) if energies else np.zeros(0)
+    return per_second(energy, sample_fps)
+
+
+def scores(timeline):
+    """Summary scores of a timeline, stored in the manifest"""
+    if not len(timeline):
+        return {'seconds': 0, 'active': 0, 'mean': 0.0, 'p95': 0.0,
+                'max': 0.0}
+    return {'seconds': int(len(timeline)),
+            'active': int((timeline > ACTIVE_LEVEL).sum()),
+            'mean': round(float(timeline.mean()), 3),
+            'p95': round(float(np.percentile(timeline, 95)), 3),
+            'max': round(float(timeline.max()), 3)}
+
+
+def analyze(path, output, fps, sample_fps=SAMPLE_FPS):
+    """Compute a segment's timeline and save it; runs in a worker
+
+    Returns:
+        dict: scores of the timeline
+
+    """
+    timeline = segment_activity(path, fps, sample_fps)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    part = output + '.part'
+    with open(part, 'wb') as out:
+        np.save(out, timeline.astype(np.float16))
+    os.replace(part, output)
+    return scores(timeline)
+
+
+def build(roots, fps, output_dir=None, workers=None, min_age=60,
+          force=False, sample_fps=SAMPLE_FPS):
+    """Analyse all segments under roots not yet in their manifest
+
+    Returns:
+        tuple: (segments done, segments failed)
+
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    groups = group_by_output(roots, ACTIVITY_DIR, output_dir, min_age)
+    work = []
+    for top, items in groups.items():
+        os.makedirs(top, exist_ok=True)
+        manifest = Manifest(os.path.join(top, MANIFEST_NAME))
+        for segment, relpath in items:
+            key = os.path.join(relpath, segment.name)
+            if force or not manifest.done(key, segment.size, segment.mtime):
+                stem = os.path.splitext(segment.name)[0]
+                work.append((segment, manifest, key,
+                             os.path.join(relpath, stem + SUFFIX), top))
+    total = sum(item[0].size for item in work)
+    print(f'{len(work)} segments ({total / 1e9:.2f} GB) to analyse')
+
+    done = failed = 0
+    done_bytes = 0
+    started = time.monotonic()
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(analyze, segment.path,
+                               os.path.join(top, timeline), fps,
+                               sample_fps): (segment, manifest, key, timeline)
+                   for segment, manifest, key, timeline, top in work}
+        for future in as_completed(futures):
+            segment, manifest, key, timeline = futures[future]
+            done_bytes += segment.size
+            try:
+                summary = future.result()
+            except OSError as error:
+                failed += 1
+                print(f'FAILED {segment.path}: {error}')
+                continue
+            done += 1
+            manifest.add(key, segment.size, segment.mtime,
+                         timeline=timeline, path=segment.path,
+                         start=segment.start_time.isoformat(), **summary)
+            elapsed = time.monotonic() - started
+            rate = done_bytes / elapsed if elapsed else 0
+            eta = (total - done_bytes) / rate if rate else 0
+            print(f'[{done + failed}/{len(work)}] {segment.name} '
+                  f'{summary["active"]} s active | {rate / 1e6:.0f} MB/s, '
+                  f'ETA {eta / 60:.0f} min')
+    return done, failed
+
+
+def load_timelines(tops):
+    """Read back the timelines listed in manifests
+
+    Args:
+        tops (list): directories holding an activity-manifest.jsonl
+
+    Yields:
+        tuple: (start datetime, manifest entry, float32 timeline)
+
+    """
+    for top in tops:
+        manifest = Manifest(os.path.join(top, MANIFEST_NAME))
+        for entry in manifest.entries.values():
+            try:
+                timeline = np.load(os.path.join(top, entry['timeline']))
+            except (OSError, ValueError, KeyError):
+                continue
+            yield (datetime.fromisoformat(entry['start']), entry,
+                   timeline.astype(np.float32))
+
+
+def heatmap(tops, bin_minutes=10):
+    """Mean activity by date and time of day
+
+    Returns:
+        tuple: (list of dates, float array of shape (dates, bins) that
+        is NaN where there is no footage)
+
+    """
+    bins_per_day = 24 * 60 // bin_minutes
+    totals, counts = {}, {}
+    for start, _, timeline in load_timelines(tops):
+        day_start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        offsets = (start - day_start).total_seconds() \
+            + np.arange(len(timeline))
+        days = (offsets // 86400).astype(int)
+        bins = ((offsets % 86400) // (bin_minutes * 60)).astype(int)
+        for day in np.unique(days):
+            date = (day_start.toordinal() + int(day))
+            if date not in totals:
+                totals[date] = np.zeros(bins_per_day)
+                counts[date] = np.zeros(bins_per_day)
+            mask = days == day
+            np.add.at(totals[date], bins[mask], timeline[mask])
+            np.add.at(counts[date], bins[mask], 1)
+    dates = sorted(totals)
+    if not dates:
+        return [], np.zeros((0, bins_per_day))
+    with np.errstate(invalid='ignore'):
+        matrix = np.array([totals[date] / counts[date] for date in dates])
+    return [datetime.fromordinal(date).date() for date in dates], matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure motion in DenCam recordings, one value per '
+        'second of video.')
+    parser.add_argument('roots', nargs='+',
+                        help='drives or date directories')
+    parser.add_argument('--output-dir',
+                        help='write timelines here instead of in '
+                        f'{ACTIVITY_DIR}/ on each drive')
+    parser.add_argument('--fps', type=float,
+                        help='frame rate the videos were recorded at '
+                        '(default: FRAME_RATE from --config, else 25)')
+    parser.add_argument('--config', help='DenCam config file')
+    parser.add_argument('--sample-fps', type=float, default=SAMPLE_FPS,
+                        help='frames per second analysed '
+                        f'(default: {SAMPLE_FPS})')
+    parser.add_argument('--jobs', type=int,
+                        help='segments analysed at once '
+                        '(default: one per core)')
+    parser.add_argument('--min-age', type=float, default=60,
+                        help='skip segments modified in the last this many '
+                        'seconds (default: 60)')
+    parser.add_argument('--force', action='store_true',
+                        help='redo segments already in the manifest')
+    args = parser.parse_args()
+
+    fps = args.fps
+    if fps is None and args.config:
+        with open(args.config, encoding='utf8') as config_file:
+            fps = yaml.load(config_file,
+                            Loader=yaml.SafeLoader).get('FRAME_RATE')
+    _, failed = build(args.roots, fps or 25, args.output_dir, args.jobs,
+                      args.min_age, args.force, args.sample_fps)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
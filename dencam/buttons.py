@@ -5,12 +5,12 @@ four buttons that are part of the PiTFT screen PCB.
 
 """
 import logging
+import queue
 import time
 from threading import Thread
 
-import RPi.GPIO as GPIO
-
 from dencam import mppt
+from dencam.actions import ActionExecutor
 
 log = logging.getLogger(__name__)
 
@@ -20,6 +20,9 @@ FUNCTION_BUTTON = 22
 RECORD_BUTTON = 23
 ZOOM_BUTTON = 27
 
+# milliseconds during which further edges on a pin are ignored
+BOUNCE_TIME = 200
+
 
 class ButtonHandler(Thread):
     """Handles the GPIO pins on the pi that are being used.
@@ -28,47 +31,95 @@ class ButtonHandler(Thread):
     pins and the pin that control the brightness of the backlight
     on the screen.
 
+    Presses are detected on falling edges by the GPIO library (with
+    debouncing handled there) and the edge callbacks only place the
+    pin on a queue. This thread sleeps on that queue and runs the
+    associated action when a press arrives, so there is no polling of
+    the pins, and stop() wakes it with a sentinel rather than it
+    waking periodically to check stop_flag. The backlight follows the
+    UI state through a subscription, whichever thread changes it.
+    Actions that can take a while are handed to an ActionExecutor so
+    they do not hold up further presses.
+
     """
 
-    def __init__(self, recorder, state, state_list, airplane_mode, stop_flag):
+    def __init__(self, recorder, state, state_list, airplane_mode,
+                 stop_flag, gpio=None, executor=None, solar_poller=None):
         super().__init__()
 
+        if executor is None:
+            executor = ActionExecutor()
+        self.executor = executor
+
+        if gpio is None:
+            import RPi.GPIO as gpio  # pylint: disable=import-outside-toplevel
+        self.gpio = gpio
+
         self.recorder = recorder
         self.state = state
         self.stop_flag = stop_flag
         self.STATE_LIST = state_list
         self.airplane_mode = airplane_mode
-        self.latch_screen_button = False
-        self.latch_record_button = False
-        self.latch_preview_button = False
-        self.latch_zoom_button = False
+        self.solar_poller = solar_poller
+        self.presses = queue.Queue()
+        self.last_latency = None
 
-        GPIO.setmode(GPIO.BCM)
+        self.gpio.setmode(self.gpio.BCM)
 
         # button pins
-        GPIO.setup(SCREEN_BUTTON, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(RECORD_BUTTON, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(FUNCTION_BUTTON, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(ZOOM_BUTTON, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        for pin in (SCREEN_BUTTON, RECORD_BUTTON,
+                    FUNCTION_BUTTON, ZOOM_BUTTON):
+            self.gpio.setup(pin, self.gpio.IN,
+                            pull_up_down=self.gpio.PUD_UP)
+        for pin in (SCREEN_BUTTON, FUNCTION_BUTTON):
+            self.gpio.add_event_detect(pin, self.gpio.FALLING,
+                                       callback=self._on_press,
+                                       bouncetime=BOUNCE_TIME)
 
         # screen backlight control pin and related
-        GPIO.setup(18, GPIO.OUT)
-        self.backlight_pwm = GPIO.PWM(18, 1000)
+        self.gpio.setup(18, self.gpio.OUT)
+        self.backlight_pwm = self.gpio.PWM(18, 1000)
         self.backlight_pwm.start(0)
         self._set_screen_brightness()
+        self.state.subscribe(self._on_state_change)
 
         self.off_countdown = 0
 
     def run(self):
 
-        while True:
-            self._handle_buttons()
-            time.sleep(.05)
-            if self.stop_flag():
+        while not self.stop_flag():
+            pin, pressed_at = self.presses.get()
+            if pin is None:
                 break
+            self.handle(pin, pressed_at)
 
         log.debug('Button management cleaning up and shutting down.')
-        GPIO.cleanup()
+        self.gpio.cleanup()
+
+    def handle(self, pin, pressed_at):
+        """Respond to a press of pin detected at monotonic time pressed_at
+
+        Called by run(), or by the runtime (see runtime.py) when the
+        handler thread is not started; the runtime then replaces
+        presses with a queue of its own.
+
+        """
+        self._handle_button(pin)
+        self.last_latency = time.monotonic() - pressed_at
+        log.debug('Button %d handled %.1f ms after press',
+                  pin, 1000 * self.last_latency)
+
+    def stop(self):
+        """Wake the handler thread and have it shut down"""
+        self.presses.put((None, time.monotonic()))
+
+    def _on_press(self, pin):
+        """Edge callback, runs on the GPIO library's event thread"""
+        self.presses.put((pin, time.monotonic()))
+
+    def _on_state_change(self, _key, _old, _new):
+        """State subscriber, runs on the thread that changed state"""
+        self._set_screen_brightness()
 
     def _set_screen_brightness(self):
         if self.state.value > 0:
@@ -78,58 +129,30 @@ class ButtonHandler(Thread):
             self.backlight_pwm.ChangeDutyCycle(0)
             self.screen_on = False
 
-    def _handle_buttons(self):
-        """Handle button presses and the associated responses."""
-        if not GPIO.input(SCREEN_BUTTON):
-            if not self.latch_screen_button:
-                self.latch_screen_button = True
-                self.state.goto_next()
-                if self.state.value == self.STATE_LIST.index("BlankPage"):
-                    self.recorder.start_preview()
-                elif self.state.value == self.STATE_LIST.index("OffPage"):
-                    self.recorder.stop_preview()
-                self._set_screen_brightness()
-        else:
-            self.latch_screen_button = False
-
-        if not GPIO.input(FUNCTION_BUTTON):
-            if not self.latch_record_button:
-
-                if(self.recorder.initial_pause_complete
-                   and self.state.value ==
-                   self.STATE_LIST.index("RecordingPage")):
-                    self.recorder.toggle_recording()
-                elif self.state.value == self.STATE_LIST.index("BlankPage"):
-                    self.recorder.toggle_zoom()
-                elif self.state.value == self.STATE_LIST.index("NetworkPage"):
-                    self.airplane_mode.toggle()
-                elif self.state.value == self.STATE_LIST.index("SolarPage"):
-                    mppt.log_solar_info()
-                self.latch_record_button = True
-        else:
-            self.latch_record_button = False
-
-        # if not GPIO.input(RECORD_BUTTON):
-        #     if not self.latch_record_button:
-        #         if (self.recorder.initial_pause_complete
-        #             and self.state.value == 2):
-        #             self.recorder.toggle_recording()
-        #         self.latch_record_button = True
-        # else:
-        #     self.latch_record_button = False
-
-        # if not GPIO.input(ZOOM_BUTTON):
-        #     if not self.latch_zoom_button:
-        #         if self.recorder.preview_on:
-        #             self.recorder.toggle_zoom()
-        #         self.latch_zoom_button = True
-        # else:
-        #     self.latch_zoom_button = False
-
-        # if not GPIO.input(PREVIEW_BUTTON):
-        #     if not self.latch_preview_button:
-        #         if self.state != 0:
-        #             self.recorder.toggle_preview()
-        #         self.latch_preview_button = True
-        # else:
-        #     self.latch_preview_button = False
+    def _handle_button(self, pin):
+        """Run the response associated with a press of given pin."""
+        if pin == SCREEN_BUTTON:
+            self.state.goto_next()
+            if self.state.value == self.STATE_LIST.index("BlankPage"):
+                self.recorder.start_preview()
+            elif self.state.value == self.STATE_LIST.index("OffPage"):
+                self.recorder.stop_preview()
+
+        elif pin == FUNCTION_BUTTON:
+            if(self.recorder.initial_pause_complete
+               and self.state.value ==
+               self.STATE_LIST.index("RecordingPage")):
+                self.executor.submit('Toggle recording',
+                                     self.recorder.toggle_recording)
+            elif self.state.value == self.STATE_LIST.index("BlankPage"):
+                self.executor.submit('Toggle zoom',
+                                     self.recorder.toggle_zoom)
+            elif self.state.value == self.STATE_LIST.index("NetworkPage"):
+                self.executor.submit('Airplane mode',
+                                     self.airplane_mode.toggle)
+            elif self.state.value == self.STATE_LIST.index("SolarPage"):
+                if self.solar_poller is not None:
+                    self.solar_poller.poll_now()
+                else:
+                    self.executor.submit('Update solar', mppt.log_solar_info,
+                                         coalesce=True)
@@ -0,0 +1,461 @@
+"""Catalog of recorded segments across all drives
+
+An SQLite database (CATALOG_FILE) with a row per segment: start and
+end time, the UUID of the drive it is on, its path, size, frame count
+and BLAKE2b checksum. The recorder adds a row when a segment starts and
+completes it when the segment stops; size, frame count and checksum
+are filled in by a background thread that reads the finished file at a
+capped rate so it does not compete with recording. Finding all footage
+between two times is then an index lookup instead of a walk of every
+drive's directories.
+
+Catalogs can also be built offline from drives or card dumps, merged
+together, and queried:
+
+    python -m dencam.catalog index catalog.db /media/pi/A /media/pi/B
+    python -m dencam.catalog index catalog.db dumps/card7 --drive-id card7
+    python -m dencam.catalog merge catalog.db unit2/catalog.db
+    python -m dencam.catalog query catalog.db --start 2024-03-01 \
+        --end "2024-03-01 06:00"
+
+"""
+import argparse
+import hashlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from dencam import h264
+from dencam.segments import (DATE_DIR, find_segments, segment_end,
+                             segment_from_path)
+from dencam.throttle import Throttle
+
+log = logging.getLogger(__name__)
+
+# read rate of the background checksum thread in bytes per second
+CHECKSUM_RATE = 20e6
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS segments (
+    drive_uuid TEXT NOT NULL,
+    relpath TEXT NOT NULL,
+    path TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL,
+    size INTEGER,
+    frames INTEGER,
+    checksum TEXT,
+    status TEXT NOT NULL,
+    PRIMARY KEY (drive_uuid, relpath)
+);
+CREATE INDEX IF NOT EXISTS segments_start ON segments (start);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+'''
+
+FIELDS = ('drive_uuid', 'relpath', 'path', 'start', 'end', 'size',
+          'frames', 'checksum', 'status')
+
+# keeps the longest segment duration seen, which bounds how far before
+# a query's start time an overlapping segment can begin
+MAX_DURATION_UPSERT = '''
+INSERT INTO meta VALUES ('max_duration', ?)
+ON CONFLICT (key) DO UPDATE SET value = max(value, excluded.value)
+'''
+
+MERGE = '''
+INSERT INTO segments SELECT * FROM other.segments WHERE true
+ON CONFLICT (drive_uuid, relpath) DO UPDATE SET
+    path = excluded.path,
+    end = coalesce(end, excluded.end),
+    size = coalesce(size, excluded.size),
+    frames = coalesce(frames, excluded.frames),
+    checksum = coalesce(checksum, excluded.checksum),
+    status = CASE WHEN status = 'complete' THEN status
+             ELSE excluded.status END
+'''
+
+
+def _unescape_mount(field):
+    # /proc/mounts escapes spaces and the like as octal, e.g. \040
+    return field.encode().decode('unicode_escape')
+
+
+def drive_uuid(path):
+    """UUID of the filesystem holding path
+
+    Found by matching path's mount in /proc/mounts against the device
+    links in /dev/disk/by-uuid. Falls back to the device name, or the
+    mount point, if there is no UUID link.
+
+    """
+    path = os.path.realpath(path)
+    device, mount = None, ''
+    try:
+        with open('/proc/mounts', encoding='utf8') as mounts:
+            for line in mounts:
+                fields = line.split()
+                if len(fields) < 2:
+                    continue
+                point = _unescape_mount(fields[1])
+                inside = (path == point
+                          or path.startswith(point.rstrip('/') + '/'))
+                if inside and len(point) > len(mount):
+                    device, mount = _unescape_mount(fields[0]), point
+    except OSError:
+        pass
+    if device is None:
+        return path
+    by_uuid = '/dev/disk/by-uuid'
+    try:
+        real_device = os.path.realpath(device)
+        for name in os.listdir(by_uuid):
+            if os.path.realpath(os.path.join(by_uuid, name)) == real_device:
+                return name
+    except OSError:
+        pass
+    return device if device.startswith('/dev/') else mount
+
+
+def scan_file(path, throttle=None):
+    """Size, frame count and BLAKE2b checksum of a segment in one pass
+
+    Frames are counted up to the last complete one (see h264.scan()).
+
+    Returns:
+        tuple: (size, frames, hex checksum)
+
+    """
+    hasher = hashlib.blake2b()
+
+    def consume(chunk):
+        if throttle is not None:
+            throttle.consume(len(chunk))
+        hasher.update(chunk)
+
+    result = h264.scan(path, consume=consume)
+    return result.size, result.frames, hasher.hexdigest()
+
+
+class Catalog:
+    """SQLite catalog of segments, safe to use from several threads
+
+    Parameters
+    ----------
+    filename : str
+        Path of the database file
+    checksum_rate : float
+        Bytes per second read by the background checksum thread, None
+        for no limit
+
+    """
+
+    def __init__(self, filename, checksum_rate=CHECKSUM_RATE):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self._lock = threading.Lock()
+        self._scans = queue.Queue()
+        self._throttle = Throttle(checksum_rate)
+        self._worker = None
+
+    def close(self):
+        """Close the database"""
+        with self._lock:
+            self.conn.close()
+
+    def segment_started(self, path, start):
+        """Add a row for a segment that has just started recording"""
+        segment = segment_from_path(path)
+        with self._lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO segments (drive_uuid, relpath, '
+                'path, start, status) VALUES (?, ?, ?, ?, ?)',
+                (drive_uuid(segment.drive), segment.relpath, segment.path,
+                 start, 'recording'))
+
+    def segment_stopped(self, path, end):
+        """Complete a segment's row and queue it for checksumming"""
+        segment = segment_from_path(path)
+        uuid = drive_uuid(segment.drive)
+        with self._lock, self.conn:
+            self.conn.execute(
+                'UPDATE segments SET end = ?, size = ?, status = ? '
+                'WHERE drive_uuid = ? AND relpath = ?',
+                (end, segment.size, 'complete', uuid, segment.relpath))
+            started = self.conn.execute(
+                'SELECT start FROM segments '
+                'WHERE drive_uuid = ? AND relpath = ?',
+                (uuid, segment.relpath)).fetchone()
+            if started is not None:
+                self.conn.execute(MAX_DURATION_UPSERT, (end - started[0],))
+        self._queue_scan(uuid, segment.relpath, segment.path)
+
+    def recover(self):
+        """Finish rows left 'recording' by a power cut or crash
+
+        Their end time is taken from the file's modification time and
+        they are queued for checksumming.
+
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT drive_uuid, relpath, path FROM segments "
+                "WHERE status = 'recording'").fetchall()
+        for uuid, relpath, path in rows:
+            try:
+                end = os.path.getmtime(path)
+            except OSError:
+                end = None
+            with self._lock, self.conn:
+                self.conn.execute(
+                    "UPDATE segments SET end = ?, status = 'interrupted' "
+                    'WHERE drive_uuid = ? AND relpath = ?',
+                    (end, uuid, relpath))
+            if end is not None:
+                self._queue_scan(uuid, relpath, path)
+        return len(rows)
+
+    def _queue_scan(self, uuid, relpath, path):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._scan_worker,
+                                            name='CatalogChecksum',
+                                            daemon=True)
+            self._worker.start()
+        self._scans.put((uuid, relpath, path))
+
+    def _scan_worker(self):
+        while True:
+            uuid, relpath, path = self._scans.get()
+            try:
+                size, frames, checksum = scan_file(path, self._throttle)
+            except OSError as error:
+                log.warning('Could not checksum %s: %s', path, error)
+                continue
+            self.update_scan(uuid, relpath, size, frames, checksum)
+
+    def update_scan(self, uuid, relpath, size, frames, checksum):
+        """Record the result of scan_file() for a segment"""
+        with self._lock, self.conn:
+            self.conn.execute(
+                'UPDATE segments SET size = ?, frames = ?, checksum = ? '
+                'WHERE drive_uuid = ? AND relpath = ?',
+                (size, frames, checksum, uuid, relpath))
+
+    def add(self, rows):
+        """Insert or replace complete rows (dicts keyed by FIELDS)"""
+        marks = ', '.join('?' * len(FIELDS))
+        with self._lock, self.conn:
+            self.conn.executemany(
+                f'INSERT OR REPLACE INTO segments VALUES ({marks})',
+                [tuple(row[field] for field in FIELDS) for row in rows])
+            for row in rows:
+                if row['end'] is not None:
+                    self.conn.execute(MAX_DURATION_UPSERT,
+                                      (row['end'] - row['start'],))
+
+    def known(self, uuid):
+        """Map of relpath to (size, checksum) for a drive's segments"""
+        with self._lock:
+            return {relpath: (size, checksum) for relpath, size, checksum
+                    in self.conn.execute(
+                        'SELECT relpath, size, checksum FROM segments '
+                        'WHERE drive_uuid = ?', (uuid,))}
+
+    def merge(self, other_filename):
+        """Merge in another catalog, keeping the most complete rows
+
+        Returns:
+            int: number of rows in the other catalog
+
+        """
+        with self._lock:
+            self.conn.execute('ATTACH DATABASE ? AS other',
+                              (other_filename,))
+            try:
+                with self.conn:
+                    count = self.conn.execute(
+                        'SELECT count(*) FROM other.segments').fetchone()[0]
+                    self.conn.execute(MERGE)
+                    self.conn.execute(
+                        'INSERT INTO meta SELECT * FROM other.meta '
+                        "WHERE key = 'max_duration' "
+                        'ON CONFLICT (key) DO UPDATE SET '
+                        'value = max(value, excluded.value)')
+            finally:
+                self.conn.execute('DETACH DATABASE other')
+        return count
+
+    def between(self, start=None, end=None):
+        """Segments overlapping a time range, in order of start time
+
+        Args:
+            start (float): Unix time, or None for no lower bound
+            end (float): Unix time, or None for no upper bound
+
+        Returns:
+            list: dicts keyed by FIELDS
+
+        """
+        clauses, params = [], []
+        if end is not None:
+            clauses.append('start < ?')
+            params.append(end)
+        if start is not None:
+            with self._lock:
+                longest = self.conn.execute(
+                    "SELECT value FROM meta WHERE key = 'max_duration'"
+                ).fetchone()
+            # lets the start index narrow the scan; the second test
+            # does the exact overlap check, in which a segment with no
+            # end yet (e.g. the one recording) is taken to overlap
+            clauses.append('start >= ?')
+            params.append(start - (longest[0] if longest else 86400))
+            clauses.append('(end IS NULL OR end > ?)')
+            params.append(start)
+        where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT {", ".join(FIELDS)} FROM segments {where} '
+                'ORDER BY start', params).fetchall()
+        return [dict(zip(FIELDS, row)) for row in rows]
+
+
+def index(catalog, roots, drive_id=None, workers=None, rescan=False):
+    """Add segments found under roots to a catalog
+
+    Segments already catalogued with the same size are skipped unless
+    rescan is set. Files are scanned in a process pool.
+
+    Args:
+        catalog (Catalog): catalog to add to
+        roots (list): drives, card dumps or date directories
+        drive_id (str): identifier to use for the drive instead of the
+            filesystem UUID (e.g. for a card dump copied to a laptop)
+        workers (int): processes scanning files; default one per core
+        rescan (bool): scan and replace rows already catalogued
+
+    Returns:
+        int: number of segments added or updated
+
+    """
+    # pylint: disable=too-many-locals
+    added = 0
+    started = time.monotonic()
+    scanned_bytes = 0
+    with ProcessPoolExecutor(workers) as pool:
+        for root in roots:
+            drive = os.path.realpath(root)
+            if DATE_DIR.match(os.path.basename(drive)):
+                drive = os.path.dirname(drive)
+            if drive_id:
+                uuid = drive_id
+            elif os.path.ismount(drive):
+                uuid = drive_uuid(drive)
+            else:
+                uuid = os.path.basename(drive)
+            known = catalog.known(uuid)
+            found = list(find_segments([root], 0))
+            following = {segment.relpath: later.start_time.timestamp()
+                         for segment, later in zip(found, found[1:])}
+            segments = [segment for segment in found
+                        if rescan or segment.relpath not in known
+                        or known[segment.relpath][0] != segment.size
+                        or known[segment.relpath][1] is None]
+            rows = []
+            for segment, (size, frames, checksum) in zip(
+                    segments, pool.map(scan_file,
+                                       [s.path for s in segments],
+                                       chunksize=4)):
+                start = segment.start_time.timestamp()
+                rows.append({'drive_uuid': uuid, 'relpath': segment.relpath,
+                             'path': segment.path, 'start': start,
+                             'end': segment_end(segment, following.get(
+                                 segment.relpath)),
+                             'size': size,
+                             'frames': frames, 'checksum': checksum,
+                             'status': 'complete'})
+                scanned_bytes += size
+                if len(rows) >= 500:
+                    catalog.add(rows)
+                    added += len(rows)
+                    rows = []
+            catalog.add(rows)
+            added += len(rows)
+            print(f'{root} ({uuid}): {len(segments)} segments indexed, '
+                  f'{len(known)} already catalogued')
+    elapsed = time.monotonic() - started
+    if scanned_bytes:
+        print(f'Scanned {scanned_bytes / 1e9:.2f} GB in {elapsed:.1f} s '
+              f'({scanned_bytes / 1e6 / elapsed:.0f} MB/s)')
+    return added
+
+
+def _parse_time(text):
+    for form in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(text, form).timestamp()
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f'unrecognised date/time: {text}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Build and query the DenCam recording catalog.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    index_parser = subparsers.add_parser(
+        'index', help='add segments on drives or card dumps')
+    index_parser.add_argument('catalog')
+    index_parser.add_argument('roots', nargs='+',
+                              help='drives, card dumps or date directories')
+    index_parser.add_argument('--drive-id',
+                              help='drive identifier to record instead of '
+                              'the filesystem UUID')
+    index_parser.add_argument('--jobs', type=int,
+                              help='files scanned at once '
+                              '(default: one per core)')
+    index_parser.add_argument('--rescan', action='store_true',
+                              help='rescan segments already catalogued')
+
+    merge_parser = subparsers.add_parser('merge',
+                                         help='merge other catalogs in')
+    merge_parser.add_argument('catalog')
+    merge_parser.add_argument('others', nargs='+')
+
+    query_parser = subparsers.add_parser(
+        'query', help='list segments overlapping a time range')
+    query_parser.add_argument('catalog')
+    query_parser.add_argument('--start', type=_parse_time,
+                              help='e.g. "2024-03-01 06:00"')
+    query_parser.add_argument('--end', type=_parse_time)
+    args = parser.parse_args()
+
+    catalog = Catalog(args.catalog)
+    if args.command == 'index':
+        index(catalog, args.roots, args.drive_id, args.jobs, args.rescan)
+    elif args.command == 'merge':
+        for other in args.others:
+            print(f'{other}: {catalog.merge(other)} segments merged')
+    else:
+        for row in catalog.between(args.start, args.end):
+            start = datetime.fromtimestamp(row['start'])
+            frames = row['frames'] if row['frames'] is not None else '?'
+            print(f"{start:%Y-%m-%d %H:%M:%S}  {frames:>6} frames  "
+                  f"{row['drive_uuid']}  {row['path']}")
+    catalog.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Clocks that DenCam's recording and scheduling code tells time by
+
+The recorder, the UI controller's segment scheduling and the solar
+poller read the time from a clock object rather than from the time and
+datetime modules directly. In normal running that is SYSTEM_CLOCK; a
+SimulatedClock instead only moves when told to, so that months of
+segment rotation, midnight rollovers and drive switches can be run
+through in minutes (see utilities/simulate_deployment.py).
+
+"""
+import time
+from datetime import datetime
+
+
+class SystemClock:
+    """The real time of day"""
+
+    @staticmethod
+    def time():
+        """Seconds since the epoch, as time.time()"""
+        return time.time()
+
+    @staticmethod
+    def now():
+        """Local time as a naive datetime, as datetime.now()"""
+        return datetime.now()
+
+
+SYSTEM_CLOCK = SystemClock()
+
+
+class SimulatedClock:
+    """Clock that stands still until advanced
+
+    Parameters
+    ----------
+    start : float
+        Unix time to start at. Defaults to the current time.
+
+    """
+
+    def __init__(self, start=None):
+        self._time = time.time() if start is None else start
+
+    def time(self):
+        """Simulated seconds since the epoch"""
+        return self._time
+
+    def now(self):
+        """Simulated local time as a naive datetime"""
+        return datetime.fromtimestamp(self._time)
+
+    def advance(self, seconds):
+        """Move the clock forward by seconds"""
+        if seconds < 0:
+            raise ValueError('A clock cannot be moved backwards')
+        self._time += seconds
+
+    def advance_to(self, when):
+        """Move the clock forward to Unix time when, if not already past"""
+        self._time = max(self._time, when)
@@ -0,0 +1,244 @@
+"""Scriptable stand-in for the RPi.GPIO module.
+
+This module mimics the small part of the RPi.GPIO API that DenCam
+uses (pin setup, inputs, edge detection with a bounce time and PWM)
+so that button handling can be exercised and timed on a machine
+without a GPIO header.  Button presses are scripted with
+``press()``/``release()`` or ``tap()`` and the registered edge
+callbacks fire on the scripting thread, just as RPi.GPIO fires them
+on its own event thread.
+
+"""
+import threading
+import time
+
+BCM = 11
+BOARD = 10
+IN = 1
+OUT = 0
+HIGH = 1
+LOW = 0
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+
+class PWM:
+    """Record-keeping PWM channel (e.g. for the screen backlight)
+
+    """
+    def __init__(self, pin, frequency):
+        self.pin = pin
+        self.frequency = frequency
+        self.duty_cycle = 0
+        self.running = False
+
+    def start(self, duty_cycle):
+        """Start PWM output at given duty cycle"""
+        self.duty_cycle = duty_cycle
+        self.running = True
+
+    def ChangeDutyCycle(self, duty_cycle):
+        # pylint: disable=invalid-name
+        """Change duty cycle of running output"""
+        self.duty_cycle = duty_cycle
+
+    def stop(self):
+        """Stop PWM output"""
+        self.running = False
+
+
+class FakeGPIO:
+    """Simulated GPIO header
+
+    Instances can be passed anywhere the ``RPi.GPIO`` module is
+    expected.  Pins configured with a pull-up idle high and are
+    pulled low while "pressed", matching the PiTFT buttons.
+
+    """
+    # expose constants on instances so this quacks like the module
+    BCM = BCM
+    BOARD = BOARD
+    IN = IN
+    OUT = OUT
+    HIGH = HIGH
+    LOW = LOW
+    PUD_OFF = PUD_OFF
+    PUD_DOWN = PUD_DOWN
+    PUD_UP = PUD_UP
+    RISING = RISING
+    FALLING = FALLING
+    BOTH = BOTH
+
+    def __init__(self):
+        self.mode = None
+        self.levels = {}
+        self.directions = {}
+        self.pwms = {}
+        self._detectors = {}
+        self._last_event = {}
+        self._lock = threading.Lock()
+
+    def setmode(self, mode):
+        """Set pin numbering mode"""
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        """Accepted for API compatibility; does nothing"""
+
+    def setup(self, pin, direction, pull_up_down=PUD_OFF, initial=LOW):
+        """Configure a pin as input or output"""
+        self.directions[pin] = direction
+        if direction == IN:
+            self.levels[pin] = HIGH if pull_up_down == PUD_UP else LOW
+        else:
+            self.levels[pin] = initial
+
+    def input(self, pin):
+        """Read current level of a pin"""
+        return self.levels[pin]
+
+    def output(self, pin, level):
+        """Set level of an output pin"""
+        self.levels[pin] = level
+
+    def PWM(self, pin, frequency):
+        # pylint: disable=invalid-name
+        """Create a PWM channel on a pin"""
+        pwm = PWM(pin, frequency)
+        self.pwms[pin] = pwm
+        return pwm
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        """Register edge detection on a pin
+
+        As with RPi.GPIO, edges arriving within ``bouncetime``
+        milliseconds of the previous accepted edge are ignored.
+
+        """
+        if pin in self._detectors:
+            raise RuntimeError('Conflicting edge detection already '
+                               'enabled for this GPIO channel')
+        self._detectors[pin] = {'edge': edge,
+                                'callbacks': [],
+                                'bouncetime': (bouncetime or 0) / 1000}
+        if callback is not None:
+            self._detectors[pin]['callbacks'].append(callback)
+
+    def add_event_callback(self, pin, callback):
+        """Add a further callback to a pin with edge detection"""
+        self._detectors[pin]['callbacks'].append(callback)
+
+    def remove_event_detect(self, pin):
+        """Stop edge detection on a pin"""
+        self._detectors.pop(pin, None)
+        self._last_event.pop(pin, None)
+
+    def cleanup(self, pin=None):
+        """Reset pins to their unconfigured state"""
+        pins = [pin] if pin is not None else list(self.directions)
+        for item in pins:
+            self.remove_event_detect(item)
+            self.directions.pop(item, None)
+            self.levels.pop(item, None)
+
+    def set_level(self, pin, level):
+        """Drive an input pin to a level, firing any edge callbacks"""
+        with self._lock:
+            previous = self.levels.get(pin, HIGH)
+            self.levels[pin] = level
+            if previous == level or pin not in self._detectors:
+                return
+            detector = self._detectors[pin]
+            edge = FALLING if level == LOW else RISING
+            if detector['edge'] not in (edge, BOTH):
+                return
+            now = time.monotonic()
+            last = self._last_event.get(pin)
+            if last is not None and now - last < detector['bouncetime']:
+                return
+            self._last_event[pin] = now
+            callbacks = list(detector['callbacks'])
+        for callback in callbacks:
+            callback(pin)
+
+    def press(self, pin, chatter=0):
+        """Pull a button pin low
+
+        Args:
+            pin (int): BCM pin number of the button
+            chatter (int): number of extra open/close bounces to
+                simulate as the contacts settle
+
+        """
+        self.set_level(pin, LOW)
+        for _ in range(chatter):
+            self.set_level(pin, HIGH)
+            self.set_level(pin, LOW)
+
+    def release(self, pin):
+        """Let a button pin return high"""
+        self.set_level(pin, HIGH)
+
+    def tap(self, pin, hold=0.0, chatter=0):
+        """Press and release a button"""
+        self.press(pin, chatter=chatter)
+        if hold:
+            time.sleep(hold)
+        self.release(pin)
+
+
+def read_script(lines, names=None):
+    """Parse a button script
+
+    Each line is ``SECONDS BUTTON [HOLD]``: the time from the start of
+    the script to press the button, the button as a BCM pin number or a
+    key of ``names``, and optionally how many seconds to hold it down.
+    Blank lines and anything after a ``#`` are ignored.
+
+    Args:
+        lines (iterable of str): lines of the script, e.g. an open file
+        names (dict): button name to BCM pin number
+
+    Returns:
+        list: (seconds, pin, hold) tuples in order of time
+
+    Raises:
+        ValueError: if a line cannot be parsed
+
+    """
+    names = names or {}
+    steps = []
+    for number, line in enumerate(lines, 1):
+        fields = line.split('#', 1)[0].split()
+        if not fields:
+            continue
+        try:
+            seconds = float(fields[0])
+            button = fields[1]
+            pin = names[button] if button in names else int(button)
+            hold = float(fields[2]) if len(fields) > 2 else 0.0
+        except (IndexError, KeyError, ValueError) as error:
+            raise ValueError(f'Bad button script line {number}: '
+                             f'{line.strip()!r}') from error
+        steps.append((seconds, pin, hold))
+    steps.sort(key=lambda step: step[0])
+    return steps
+
+
+def play_script(gpio, steps, stop=None):
+    """Tap buttons on gpio at the times of a parsed script
+
+    Runs on the calling thread until the script ends or ``stop`` (a
+    threading.Event) is set.
+
+    """
+    stop = stop or threading.Event()
+    started = time.monotonic()
+    for seconds, pin, hold in steps:
+        if stop.wait(max(0, started + seconds - time.monotonic())):
+            return
+        gpio.tap(pin, hold=hold)
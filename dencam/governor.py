@@ -0,0 +1,151 @@
+"""Power-aware selection of recording settings
+
+This module contains the governor that picks how DenCam records
+(resolution, frame rate and what fraction of the time it records at
+all) from the battery voltage reported by the SunSaver, so that a
+unit on a run of dark days degrades gracefully rather than running
+its battery flat.
+
+"""
+import logging
+
+log = logging.getLogger(__name__)
+
+# Profiles ordered from most to least power hungry (see default_profiles
+# for how they are fitted to the camera settings). A profile is
+# allowed while the (resting) battery voltage is at or above its
+# min_voltage. duty_cycle is the fraction of the time spent recording.
+DEFAULT_PROFILES = [
+    {'name': 'full', 'min_voltage': 12.4,
+     'resolution': [1920, 1080], 'frame_rate': 25, 'duty_cycle': 1.0},
+    {'name': 'reduced frame rate', 'min_voltage': 12.2,
+     'resolution': [1920, 1080], 'frame_rate': 15, 'duty_cycle': 1.0},
+    {'name': 'reduced resolution', 'min_voltage': 12.0,
+     'resolution': [1280, 720], 'frame_rate': 15, 'duty_cycle': 1.0},
+    {'name': 'duty cycled', 'min_voltage': 0,
+     'resolution': [1280, 720], 'frame_rate': 15, 'duty_cycle': 0.25},
+]
+
+
+def default_profiles(resolution=None, frame_rate=None):
+    """DEFAULT_PROFILES fitted to the configured camera settings
+
+    The first profile records at the configured resolution and frame
+    rate, and no later one records at more of either than that.
+
+    Args:
+        resolution (list): CAMERA_RESOLUTION, or None to keep the
+            defaults' resolutions
+        frame_rate (float): FRAME_RATE, or None to keep the defaults'
+            frame rates
+
+    Returns:
+        list: profiles, most power hungry first
+
+    """
+    profiles = []
+    for index, profile in enumerate(DEFAULT_PROFILES):
+        profile = dict(profile)
+        if resolution is not None and (
+                index == 0 or (profile['resolution'][0]
+                               * profile['resolution'][1]
+                               > resolution[0] * resolution[1])):
+            profile['resolution'] = list(resolution)
+        if frame_rate is not None and (
+                index == 0 or profile['frame_rate'] > frame_rate):
+            profile['frame_rate'] = frame_rate
+        profiles.append(profile)
+    return profiles
+
+
+# SunSaver charge states (register 17) in which the charger is pushing
+# current into the battery and the measured voltage reads high
+CHARGING_STATES = (5, 6, 7, 8)
+
+
+class PowerGovernor:
+    """Chooses a recording profile from battery telemetry
+
+    The governor only decides; callers ask it for a profile at each
+    segment boundary (see Controller) so settings never change in the
+    middle of a recording.
+
+    To stop the profile flapping when the voltage sits near a
+    threshold, the governor steps down a level as soon as the voltage
+    falls below the current profile's minimum but only steps back up
+    once the voltage is ``hysteresis`` volts above the better
+    profile's minimum. While charging, ``charging_offset`` is taken
+    off the measured voltage to estimate the resting voltage.
+
+    Parameters
+    ----------
+    configs : dict
+        DenCam configuration. Uses the optional keys POWER_PROFILES,
+        POWER_HYSTERESIS and POWER_CHARGING_OFFSET, and without
+        POWER_PROFILES, CAMERA_RESOLUTION and FRAME_RATE (see
+        default_profiles).
+
+    Attributes
+    ----------
+    profile : dict
+        Currently selected profile
+
+    """
+
+    def __init__(self, configs):
+        self.profiles = configs.get('POWER_PROFILES') or default_profiles(
+            configs.get('CAMERA_RESOLUTION'), configs.get('FRAME_RATE'))
+        self.hysteresis = configs.get('POWER_HYSTERESIS', 0.2)
+        self.charging_offset = configs.get('POWER_CHARGING_OFFSET', 0.3)
+        self.level = 0
+
+    @property
+    def profile(self):
+        """Currently selected profile"""
+        return self.profiles[self.level]
+
+    def select(self, battery_voltage, charge_state=None):
+        """Pick the profile to use for the next segment
+
+        Args:
+            battery_voltage (float): latest battery voltage, or None if
+                unknown in which case the current profile is kept
+            charge_state (int): latest SunSaver charge state, if known
+
+        Returns:
+            dict: the selected profile
+
+        """
+        if battery_voltage is None:
+            return self.profile
+
+        voltage = battery_voltage
+        if charge_state in CHARGING_STATES:
+            voltage -= self.charging_offset
+
+        level = self.level
+        while (level < len(self.profiles) - 1
+               and voltage < self.profiles[level]['min_voltage']):
+            level += 1
+        while (level > 0 and voltage >= (self.profiles[level - 1]
+                                         ['min_voltage'] + self.hysteresis)):
+            level -= 1
+
+        if level != self.level:
+            log.info('Battery at %.2f V: switching recording profile '
+                     'from %s to %s', battery_voltage, self.profile['name'],
+                     self.profiles[level]['name'])
+            self.level = level
+        return self.profile
+
+    def select_from_reading(self, reading):
+        """Pick the profile for the next segment from a SunSaver reading
+
+        Args:
+            reading (dict): as returned by mppt.take_reading(), or None
+
+        """
+        if reading is None:
+            return self.select(None)
+        return self.select(reading['Battery_Voltage'],
+                           reading['Charge_State'])
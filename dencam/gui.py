@@ -6,6 +6,7 @@ GPIO header.
 
 """
 import logging
+import os
 import time
 import tkinter as tk
 import tkinter.font as tkFont
@@ -15,21 +16,60 @@ from dencam.gui_pixel import BusterConfig, BookwormConfig
 from dencam import __version__
 from dencam import networking
 from dencam import mppt
+from dencam import metrics
+from dencam.clock import SYSTEM_CLOCK
+from dencam.state import StateStore, stored
 
 log = logging.getLogger(__name__)
 
+# seconds that the result of a button action stays on screen
+ACTION_STATUS_DURATION = 5
+
+# period of the UI update loop in milliseconds
+UPDATE_PERIOD = 100
+# period of the UI update loop when the runtime does the scheduling;
+# changes of state are then drawn as they happen (see request_redraw)
+REDRAW_PERIOD = 1000
+
 
 class BaseController(Thread):
-    """DenCam UI controller base class."""
+    """DenCam UI controller base class.
+
+    Until told otherwise the controller does all periodic work in its
+    Tk update loop, every UPDATE_PERIOD. When the asyncio runtime (see
+    runtime.py) takes over segment scheduling it clears standalone, and
+    the loop then only draws the UI, once a second for the clock.
+    Changes of UI or recorder state and finished actions are drawn
+    straight away in either case: request_redraw() writes to a pipe
+    that Tk's event loop watches.
 
-    def __init__(self, configs, recorder, state_list, state, airplane_mode):
+    """
+
+    def __init__(self, configs, recorder, state_list, state, airplane_mode,
+                 solar_poller=None, clock=None):
         super().__init__()
         self.recorder = recorder
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.solar_poller = solar_poller
         self.state = state
         self.state_list = state_list
         self.pause_before_record = configs['PAUSE_BEFORE_RECORD']
         self.airplane_mode = airplane_mode
+        self.action_status = None
+        self.metrics_interval = configs.get('METRICS_INTERVAL', 60)
+        self.last_tick = None
+        self.last_metrics = time.monotonic()
+        self.lateness = []
+        self.loop_stats = None
+        self.standalone = True
+        self.elapsed_time = 0
+        self._expected_delay = UPDATE_PERIOD
+        self._redraw_requests, self._redraw_pipe = os.pipe()
+        os.set_blocking(self._redraw_pipe, False)
+        state.subscribe(self.request_redraw)
+        recorder.store.subscribe(self.request_redraw)
         self.fonts = {}
+        os_version = ''
         try:
             with open("/etc/os-release") as f:
                 for line in f:
@@ -41,14 +81,48 @@ class BaseController(Thread):
             self.placement_config = BusterConfig()
         elif "bookworm" in os_version.lower():
             self.placement_config = BookwormConfig()
+        elif configs.get('SIMULATE'):
+            # simulated hardware runs on any Linux; lay out as on bookworm
+            self.placement_config = BookwormConfig()
         else:
             raise Exception("Unsupported OS version")
 
     def run(self):
         self._setup()
-        self.window.after(100, self._update)
+        self.window.tk.createfilehandler(self._redraw_requests,
+                                         tk.READABLE,
+                                         self._on_redraw_request)
+        self.window.after(self._next_delay(), self._update)
         self.window.mainloop()
 
+    def request_redraw(self, *_):
+        """Have the UI redrawn soon; safe to call from any thread.
+
+        Takes and ignores any arguments so it can subscribe to a
+        StateStore.
+
+        """
+        try:
+            os.write(self._redraw_pipe, b'\0')
+        except BlockingIOError:
+            pass  # plenty of requests are pending already
+
+    def _on_redraw_request(self, fd, _mask):
+        os.read(fd, 4096)
+        self._redraw()
+
+    def _next_delay(self):
+        """Milliseconds until the next run of the update loop."""
+        if self.standalone:
+            delay = UPDATE_PERIOD
+        else:
+            # just after the turn of the second, so the clock and the
+            # camera's timestamp advance a second at a time
+            delay = (REDRAW_PERIOD
+                     - int(time.time() * 1000) % REDRAW_PERIOD + 5)
+        self._expected_delay = delay
+        return delay
+
     def _setup(self):
         """Set up the Tkinter GUI."""
         self.window = tk.Tk()
@@ -130,21 +204,48 @@ class BaseController(Thread):
     def _update(self):
         """Execute core loop activities.
 
-        Runs at 10 Hz (every 100 milliseconds)
+        Runs at 10 Hz (every 100 milliseconds), or once a second when
+        not standalone.
 
         """
-        self.elapsed_time = time.time() - self.recorder.record_start_time
-
+        self._track_latency()
         self.recorder.update_timestamp()
+        self._redraw()
+        self.window.after(self._next_delay(), self._update)
+
+    def _redraw(self):
+        """Show the page for the current state and refresh its text."""
+        self.elapsed_time = (self.clock.time()
+                             - self.recorder.record_start_time)
 
         networkp_index = self.state_list.index('NetworkPage')
         blankp_index = self.state_list.index('BlankPage')
 
-        if (self.state.value >= networkp_index
-                and self.state.value <= blankp_index):
-            self.show_frame(self.state_list[self.state.value])
+        # read once: the button thread may change it meanwhile
+        value = self.state.value
+        if networkp_index <= value <= blankp_index:
+            self.show_frame(self.state_list[value])
         self._update_strings()
-        self.window.after(100, self._update)
+
+    def _track_latency(self):
+        """Emit UI loop lateness and free space metrics periodically."""
+        now = time.monotonic()
+        if self.last_tick is not None:
+            self.lateness.append(max(0.0, now - self.last_tick
+                                     - self._expected_delay / 1000))
+        self.last_tick = now
+        if now - self.last_metrics < self.metrics_interval:
+            return
+        self.last_metrics = now
+        if self.lateness:
+            self.loop_stats = {'mean': round(sum(self.lateness)
+                                             / len(self.lateness), 4),
+                               'max': round(max(self.lateness), 4),
+                               'ticks': len(self.lateness)}
+            metrics.emit('loop_latency', **self.loop_stats)
+            self.lateness = []
+        metrics.emit('free_space', drive=self.recorder.video_path,
+                     gb=round(self.recorder.get_free_space(), 3))
 
     def _update_strings(self):
         """Update all the strings used in the UI readout."""
@@ -181,10 +282,37 @@ class BaseController(Thread):
             airplane_text += "Off"
         self.ip_text.set(network_info + airplane_text)
 
+        # show outcome of last background action for a few seconds
+        if self.action_status is not None:
+            message, completed_at = self.action_status
+            if time.time() - completed_at < ACTION_STATUS_DURATION:
+                self.error_text.set(message)
+            else:
+                self.error_text.set(' ')
+                self.action_status = None
+
         # prep solar text
-        solar_info = mppt.get_solardisplay_info()
+        if self.solar_poller is not None:
+            solar_info = self.solar_poller.display_text()
+        else:
+            solar_info = mppt.get_solardisplay_info()
         self.solar_text.set(solar_info)
 
+    def action_completed(self, name, error, latency):
+        """Note completion of a background action for display.
+
+        Used as an ActionExecutor listener so it is called from a
+        worker thread; a redraw is requested rather than touching Tk
+        here.
+
+        """
+        if error is None:
+            message = f"{name}: done ({latency:.1f} s)"
+        else:
+            message = f"{name}: failed"
+        self.action_status = (message, time.time())
+        self.request_redraw()
+
     def _prep_fonts(self):
         """Populate the dict of fonts used in UI."""
         scrn_height = self.window.winfo_screenheight()
@@ -211,23 +339,104 @@ class Controller(BaseController):
     re-initializing recording after each duration has elapsed) and b)
     starting first recording after a user-configured wait period.
 
+    If given a PowerGovernor, the controller also asks it for a
+    recording profile at each segment boundary, applies any change of
+    camera settings there, and when the profile is duty cycled leaves
+    a gap after each segment so that only the profile's fraction of
+    time is spent recording.
+
+    Segments are timed by clock (see clock.py), the real time unless a
+    SimulatedClock is given, as when simulating a deployment.
+
     """
 
-    def __init__(self, configs, recorder, state_list, state, airplane_mode):
-        super().__init__(configs, recorder, state_list, state, airplane_mode)
+    def __init__(self, configs, recorder, state_list, state, airplane_mode,
+                 solar_poller=None, governor=None, clock=None):
+        super().__init__(configs, recorder, state_list, state, airplane_mode,
+                         solar_poller, clock)
 
         self.record_length = configs['RECORD_LENGTH']
+        self.governor = governor
+        self.profile = None
+        self.resume_time = None
 
     def _update(self):
         super()._update()
-        if ((self.elapsed_time > self.pause_before_record
+        if self.standalone:
+            # a toggle holds the lock while the camera starts or
+            # stops; the UI must not freeze meanwhile
+            self.schedule_segments(blocking=False)
+
+    def schedule_segments(self, blocking=True):
+        """Start, rotate or resume recordings as they fall due.
+
+        Called from the UI loop, or by the runtime when it does the
+        scheduling.
+
+        Args:
+            blocking (bool): wait for the recorder lock if held, e.g.
+                by a button press toggling recording; if False, do
+                nothing this time instead
+
+        """
+        # the recording state must not change between checking it and
+        # acting on it, e.g. by a button press toggling recording
+        if not self.recorder.lock.acquire(blocking):
+            return
+        try:
+            self._schedule_segments(self.clock.time()
+                                    - self.recorder.record_start_time)
+        finally:
+            self.recorder.lock.release()
+
+    def _schedule_segments(self, elapsed_time):
+        if ((elapsed_time > self.pause_before_record
              and not self.recorder.initial_pause_complete)):
             self.recorder.initial_pause_complete = True
-            self.recorder.start_recording()
-        elif (self.elapsed_time > self.record_length
+            self._start_segment()
+        elif (elapsed_time > self.record_length
               and self.recorder.recording):
             self.recorder.stop_recording()
-            self.recorder.start_recording()
+            self._start_segment(after_segment=True)
+        elif (self.resume_time is not None
+              and self.clock.time() >= self.resume_time):
+            self.resume_time = None
+            if not self.recorder.recording:
+                self._start_segment()
+
+    def next_deadline(self):
+        """Time at which schedule_segments() next has something to do
+
+        Returns:
+            float: Unix time, or None if nothing will fall due until the
+            recording state changes (e.g. recording stopped by a button)
+
+        """
+        with self.recorder.lock:
+            if not self.recorder.initial_pause_complete:
+                return (self.recorder.record_start_time
+                        + self.pause_before_record)
+            if self.recorder.recording:
+                return self.recorder.record_start_time + self.record_length
+            return self.resume_time
+
+    def _start_segment(self, after_segment=False):
+        """Start the next recording, applying power governor policy."""
+        if self.governor is not None:
+            reading = None
+            if self.solar_poller is not None:
+                reading = self.solar_poller.latest
+            profile = self.governor.select_from_reading(reading)
+            if profile is not self.profile:
+                self.recorder.apply_profile(profile)
+                self.profile = profile
+            duty_cycle = profile['duty_cycle']
+            if after_segment and duty_cycle < 1:
+                gap = self.record_length * (1 / duty_cycle - 1)
+                log.info('Duty cycled: next recording in %.0f s', gap)
+                self.resume_time = self.clock.time() + gap
+                return
+        self.recorder.start_recording()
 
 
 class State():
@@ -241,6 +450,10 @@ class State():
     order and returning to the first state/page once the end is
     reached.
 
+    The state is changed by the button thread and read by the UI
+    thread, so it is kept in a StateStore (see state.py); code that
+    needs to react to changes subscribes rather than polling value.
+
     Parameters
     ----------
     num_states : int
@@ -255,18 +468,30 @@ class State():
     -------
     goto_next()
         Increment to next state
+    subscribe(callback)
+        Call callback(key, old, new) on each change of state
 
     """
 
+    value = stored('value')
+
     def __init__(self, num_states):
-        self.value = 0
+        self.store = StateStore(value=0)
         self.num_states = num_states
 
     def goto_next(self):
         """Increment to next state."""
-        self.value += 1
-        if self.value >= self.num_states:
-            self.value = 0
+        self.store.update('value',
+                          lambda value: (value + 1) % self.num_states)
+
+    def subscribe(self, callback):
+        """Call callback(key, old, new) on each change of state.
+
+        Returns:
+            callable: cancels the subscription
+
+        """
+        return self.store.subscribe(callback, 'value')
 
 
 class RecordingPage(tk.Frame):
@@ -501,10 +726,11 @@ class BlankPage(tk.Frame):
 class SolarPage(tk.Frame):
     """UI Page that displays the solar data from charge controller.
 
-    On this page, UI action button refreshes solar data (mechanics of
-    the refresh might bear some more detail added here or in a
-    docstring associated with place where those mechanics are
-    implemented)
+    On this page, UI action button refreshes solar data. When a
+    SolarPoller is running the refresh asks it for an immediate
+    reading and the page shows the poller's in-memory copy of the
+    latest reading; otherwise the refresh logs a reading directly and
+    the page shows the last row of the solar log.
 
     """
 
@@ -0,0 +1,436 @@
+"""Integrity checking and repair of raw H.264 segments
+
+DenCam's segments are H.264 Annex B byte streams: NAL units each
+preceded by a 00 00 01 start code. The parser here walks those start
+codes without decoding anything, so it runs at close to disk speed, and
+groups NAL units into access units (one per coded frame). After a power
+cut the segment being recorded usually ends part way through a frame,
+often followed by zero-filled blocks the filesystem had allocated but
+never written; decoders either give up there or quietly produce a short
+video. scan() finds the end of the last complete access unit and
+repair() truncates a file to it.
+
+Usage:
+    dencam-check /media/pi/A /media/pi/B --jobs 4
+    dencam-check /media/pi/A/2024-03-01 --repair
+
+"""
+import argparse
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from dencam.segments import find_segments, segment_from_path
+
+CHUNK_SIZE = 1 << 20
+START_CODE = b'\x00\x00\x01'
+TAIL_SUFFIX = '.tail'
+# bytes read at a time, and at most, when seeking to a keyframe
+SEEK_CHUNK = 1 << 18
+SEEK_LIMIT = 64 << 20
+# bytes before an offset searched for the last keyframe before it
+SEEK_BACK = 8 << 20
+
+NAL_SLICE = 1
+NAL_IDR = 5
+# NAL unit types that can only come before the first slice of an
+# access unit, so start a new one (H.264 section 7.4.1.2.3)
+AU_PREFIX_TYPES = frozenset((6, 7, 8, 9, 14, 15, 16, 17, 18))
+
+
+class AccessUnit(namedtuple('AccessUnit', 'offset end idr valid')):
+    """A coded frame with the parameter sets and SEI before it
+
+    Attributes
+    ----------
+    offset : int
+        Position of its first start code in the file
+    end : int
+        Position just after it
+    idr : bool
+        Whether it is a keyframe (IDR picture)
+    valid : bool
+        False if it holds no slice or a NAL header with the forbidden
+        bit set, as with data before the first start code or a
+        truncated frame
+
+    """
+    __slots__ = ()
+
+
+class ScanResult(namedtuple('ScanResult',
+                            'path size frames idr clean_end errors')):
+    """Result of scan() for one file
+
+    Attributes
+    ----------
+    path : str
+        File scanned
+    size : int
+        Size in bytes
+    frames : int
+        Complete frames before clean_end
+    idr : int
+        Keyframes among them
+    clean_end : int
+        Offset just after the last complete frame
+    errors : int
+        Invalid access units before clean_end
+
+    """
+    __slots__ = ()
+
+    @property
+    def truncated(self):
+        """Whether the file has an incomplete frame or junk at its end"""
+        return self.clean_end < self.size
+
+
+def nal_units(video, chunk_size=CHUNK_SIZE, consume=None):
+    """Find the NAL units in an Annex B stream
+
+    Args:
+        video: binary file object to read from
+        chunk_size (int): bytes read at a time
+        consume (callable): called with each chunk read, e.g. to hash
+            the file in the same pass
+
+    Yields:
+        tuple: (offset of the start code, counting the leading zero of
+        a four byte start code, NAL header byte, first payload byte);
+        the header and payload are None if the data ends first
+
+    """
+    base = 0  # file offset of data[0]
+    data = b''
+    search_from = 0
+    for chunk in iter(lambda: video.read(chunk_size), b''):
+        if consume is not None:
+            consume(chunk)
+        data += chunk
+        position = data.find(START_CODE, search_from)
+        while position != -1 and position + 4 < len(data):
+            yield (base + _start(data, position), data[position + 3],
+                   data[position + 4])
+            position = data.find(START_CODE, position + 3)
+        # carry over an unread start code, or bytes that may be the
+        # beginning of one, and the byte before for four byte codes
+        search_from = position if position != -1 else max(len(data) - 2, 0)
+        keep = max(search_from - 1, 0)
+        base += keep
+        data = data[keep:]
+        search_from -= keep
+    position = data.find(START_CODE, search_from)
+    if position != -1:
+        header = data[position + 3] if position + 3 < len(data) else None
+        yield base + _start(data, position), header, None
+
+
+def _start(data, position):
+    return position - 1 if position and data[position - 1] == 0 \
+        else position
+
+
+def access_units(video, chunk_size=CHUNK_SIZE, consume=None):
+    """Group the NAL units of an Annex B stream into access units
+
+    The last access unit ends at the end of the data, so may be
+    incomplete; see scan().
+
+    Yields:
+        AccessUnit
+
+    """
+    size = 0
+
+    def count(chunk):
+        nonlocal size
+        size += len(chunk)
+        if consume is not None:
+            consume(chunk)
+
+    start = None
+    has_slice = idr = False
+    valid = True
+    for offset, header, payload in nal_units(video, chunk_size, count):
+        if start is None:
+            if offset > 0:
+                yield AccessUnit(0, offset, False, False)
+            start = offset
+        if header is None:
+            # start code cut off before its header
+            yield AccessUnit(start, offset, idr, valid and has_slice)
+            start, has_slice, idr, valid = offset, False, False, False
+            continue
+        nal_type = header & 0x1F
+        is_slice = nal_type in (NAL_SLICE, NAL_IDR)
+        # first_mb_in_slice of 0, the first slice of a picture, is
+        # coded as a single 1 bit
+        first_slice = is_slice and (payload is None or payload & 0x80)
+        if has_slice and (nal_type in AU_PREFIX_TYPES or first_slice):
+            yield AccessUnit(start, offset, idr, valid)
+            start, has_slice, idr, valid = offset, False, False, True
+        if header & 0x80:
+            valid = False
+        if is_slice:
+            has_slice = True
+            idr = idr or nal_type == NAL_IDR
+    if start is None:
+        if size:
+            yield AccessUnit(0, size, False, False)
+    elif size > start:
+        yield AccessUnit(start, size, idr, valid and has_slice)
+
+
+def parameter_sets(video):
+    """Bytes before the first slice of a stream: its SPS, PPS and SEI
+
+    Prepended to keyframes read with keyframe_after() so that they can
+    be decoded on their own even if the encoder only wrote parameter
+    sets at the start of the stream.
+
+    """
+    video.seek(0)
+    for offset, header, _ in nal_units(video, SEEK_CHUNK):
+        if header is not None and header & 0x1F in (NAL_SLICE, NAL_IDR):
+            video.seek(0)
+            return video.read(offset)
+    return b''
+
+
+def keyframe_after(video, offset, limit=SEEK_LIMIT):
+    """Find the first complete keyframe after a byte offset
+
+    Only the bytes from offset to the end of that keyframe are read,
+    so a few keyframes can be taken from a large file quickly.
+
+    Args:
+        video: binary file object, seekable
+        offset (int): where to start looking
+        limit (int): give up after reading this many bytes
+
+    Returns:
+        tuple: (offset of the keyframe's access unit, its bytes), or
+        None if there is none in range
+
+    """
+    video.seek(offset)
+    read = 0
+
+    def count(chunk):
+        nonlocal read
+        read += len(chunk)
+
+    # after a seek the first frame may be partial, and may come after
+    # some bytes that are not a frame, so skip two access units
+    skip = 2 if offset else 0
+    previous = None
+    for unit in access_units(video, SEEK_CHUNK, count):
+        if previous is not None and previous.idr and previous.valid:
+            video.seek(offset + previous.offset)
+            return (offset + previous.offset,
+                    video.read(previous.end - previous.offset))
+        if read > limit:
+            break
+        if skip:
+            skip -= 1
+        else:
+            previous = unit
+    return None
+
+
+def keyframe_before(video, offset, window=SEEK_BACK):
+    """Find the last complete keyframe before a byte offset
+
+    Reads the keyframes in the window bytes before offset one after
+    another with keyframe_after(), so it reads about window bytes.
+
+    Args:
+        video: binary file object, seekable
+        offset (int): where to look back from
+        window (int): how far back to look
+
+    Returns:
+        tuple: (offset of the keyframe's access unit, its bytes), or
+        None if there is none in range
+
+    """
+    last = None
+    start = max(0, offset - window)
+    while start < offset:
+        found = keyframe_after(video, start)
+        if found is None or found[0] >= offset:
+            break
+        last = found
+        start = found[0] + len(found[1])
+    return last
+
+
+def scan(path, drop_last=False, chunk_size=CHUNK_SIZE, consume=None):
+    """Count the frames of a segment and find where it can be cut
+
+    The last frame of a file counts as complete unless the file ends
+    in a zero byte. A NAL unit always ends with a nonzero byte (its stop
+    bit), so a zero there means zero-filled blocks after a power cut.
+    A frame cut off at any other byte cannot be told from a whole one
+    without decoding it; drop_last discards the last frame regardless,
+    for files known to have been cut short.
+
+    Args:
+        path (str): .h264 file
+        drop_last (bool): treat the last frame as incomplete
+        chunk_size (int): bytes read at a time
+        consume (callable): called with each chunk read
+
+    Returns:
+        ScanResult
+
+    """
+    frames = idr = errors = 0
+    clean_end = size = 0
+    last_byte = 0
+
+    def track(chunk):
+        nonlocal last_byte
+        last_byte = chunk[-1]
+        if consume is not None:
+            consume(chunk)
+
+    previous = None
+    pending_errors = 0
+    with open(path, 'rb') as video:
+        for unit in access_units(video, chunk_size, track):
+            if previous is not None:
+                if previous.valid:
+                    frames += 1
+                    idr += previous.idr
+                    clean_end = previous.end
+                    errors += pending_errors
+                    pending_errors = 0
+                else:
+                    pending_errors += 1
+            previous = unit
+        size = previous.end if previous is not None else 0
+    if previous is not None and previous.valid and last_byte != 0 \
+            and not drop_last:
+        frames += 1
+        idr += previous.idr
+        clean_end = previous.end
+        errors += pending_errors
+    return ScanResult(path, size, frames, idr, clean_end, errors)
+
+
+def repair(result, keep_tail=True):
+    """Truncate a scanned file to its last complete frame
+
+    Args:
+        result (ScanResult): from scan(); the file must not have
+            changed since
+        keep_tail (bool): save the bytes cut off to <file>.tail
+
+    Returns:
+        int: bytes removed
+
+    """
+    if os.path.getsize(result.path) != result.size:
+        raise OSError(f'{result.path} changed since it was scanned')
+    removed = result.size - result.clean_end
+    if not removed:
+        return 0
+    if keep_tail:
+        with open(result.path, 'rb') as video, \
+                open(result.path + TAIL_SUFFIX, 'wb') as tail:
+            video.seek(result.clean_end)
+            for chunk in iter(lambda: video.read(CHUNK_SIZE), b''):
+                tail.write(chunk)
+            tail.flush()
+            os.fsync(tail.fileno())
+    with open(result.path, 'r+b') as video:
+        video.truncate(result.clean_end)
+        os.fsync(video.fileno())
+    return removed
+
+
+def check(paths, jobs=None, drop_last=False, fix=False, keep_tail=True,
+          verbose=False):
+    """Scan segments in a process pool, printing problems and throughput
+
+    Args:
+        paths (list): .h264 files
+        jobs (int): files scanned at once; default one per core
+        drop_last (bool): see scan()
+        fix (bool): truncate damaged files with repair()
+        keep_tail (bool): see repair()
+        verbose (bool): print every file, not only damaged ones
+
+    Returns:
+        list: ScanResult for each damaged file
+
+    """
+    damaged = []
+    total = 0
+    started = time.monotonic()
+    with ProcessPoolExecutor(jobs) as pool:
+        results = pool.map(scan, paths, [drop_last] * len(paths),
+                           chunksize=4)
+        for result in results:
+            total += result.size
+            ok = not result.truncated and not result.errors
+            if verbose or not ok:
+                status = 'ok' if ok else (
+                    f'{result.size - result.clean_end} bytes after the '
+                    f'last complete frame, {result.errors} bad frames')
+                print(f'{result.path}: {result.frames} frames, '
+                      f'{result.idr} keyframes, {status}')
+            if not ok:
+                damaged.append(result)
+    elapsed = time.monotonic() - started
+    print(f'Scanned {len(paths)} files ({total / 1e9:.2f} GB) in '
+          f'{elapsed:.1f} s, {total / 1e9 / elapsed if elapsed else 0:.2f} '
+          f'GB/s; {len(damaged)} damaged')
+    if fix:
+        for result in damaged:
+            if result.truncated:
+                removed = repair(result, keep_tail)
+                print(f'Truncated {result.path} by {removed} bytes')
+    return damaged
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check DenCam .h264 segments for truncated or '
+        'damaged frames.')
+    parser.add_argument('paths', nargs='+',
+                        help='drives, date directories or .h264 files')
+    parser.add_argument('--jobs', type=int,
+                        help='files scanned at once (default: one per core)')
+    parser.add_argument('--repair', action='store_true',
+                        help='truncate damaged files to their last '
+                        'complete frame; the bytes removed are saved to '
+                        f'<file>{TAIL_SUFFIX}')
+    parser.add_argument('--no-tail', action='store_true',
+                        help='with --repair, do not save removed bytes')
+    parser.add_argument('--drop-last', action='store_true',
+                        help='treat the last frame of each file as '
+                        'incomplete, for segments cut short by a power cut')
+    parser.add_argument('--min-age', type=float, default=60,
+                        help='skip segments modified in the last this many '
+                        'seconds (default: 60)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='list every file, not only damaged ones')
+    args = parser.parse_args()
+
+    files = [path for path in args.paths if path.endswith('.h264')]
+    roots = [path for path in args.paths if not path.endswith('.h264')]
+    paths = [segment.path for segment in find_segments(roots, args.min_age)]
+    paths += [segment.path for segment in map(segment_from_path, files)
+              if segment is not None]
+    damaged = check(paths, args.jobs, args.drop_last, args.repair,
+                    not args.no_tail, args.verbose)
+    if damaged and not args.repair:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Live preview over HTTP for aiming the camera
+
+Serves the camera's small ``lores`` stream as JPEG snapshots and as an
+MJPEG stream from the status server (see status_server.py), so the
+camera can be aimed from a laptop or phone rather than the PiTFT:
+
+    http://<dencam>:<STATUS_PORT>/preview.mjpg
+    http://<dencam>:<STATUS_PORT>/snapshot.jpg
+
+Frames are only captured and JPEG-encoded while at least one client is
+connected, at no more than LIVE_PREVIEW_FPS and at LIVE_PREVIEW_QUALITY,
+and encoding happens on a worker thread off the camera's own threads,
+so the preview costs nothing when unused and cannot hold up the H.264
+encoder. Any number of clients share the one encoded frame.
+
+"""
+import asyncio
+import io
+import logging
+import time
+
+from PIL import Image
+
+from dencam.status_server import StatusServer
+
+log = logging.getLogger(__name__)
+
+BOUNDARY = 'dencamframe'
+DEFAULT_SIZE = (320, 240)
+DEFAULT_FPS = 5
+DEFAULT_QUALITY = 60
+
+
+def yuv420_to_jpeg(array, size, quality):
+    """Encode a YUV420 frame as JPEG without converting to RGB
+
+    Args:
+        array (numpy.ndarray): planar YUV420 frame as returned by
+            Picamera2.capture_array('lores'); shape (height * 3 / 2,
+            stride)
+        size (tuple): (width, height) of the image
+        quality (int): JPEG quality, 1 to 95
+
+    Returns:
+        bytes: JPEG image
+
+    """
+    width, height = size
+    stride = array.shape[1]
+    luma = array[:height, :width]
+    chroma_rows = height // 4
+    u_plane = array[height:height + chroma_rows] \
+        .reshape(height // 2, stride // 2)[:, :width // 2]
+    v_plane = array[height + chroma_rows:height + 2 * chroma_rows] \
+        .reshape(height // 2, stride // 2)[:, :width // 2]
+    image = Image.merge('YCbCr', (
+        Image.fromarray(luma),
+        Image.fromarray(u_plane).resize(size),
+        Image.fromarray(v_plane).resize(size)))
+    jpeg = io.BytesIO()
+    image.save(jpeg, format='JPEG', quality=quality)
+    return jpeg.getvalue()
+
+
+class LivePreview:
+    """Capture-on-demand JPEG preview shared by HTTP clients
+
+    Parameters
+    ----------
+    configs : dict
+        DenCam configuration. Uses the optional keys LIVE_PREVIEW_SIZE,
+        LIVE_PREVIEW_FPS and LIVE_PREVIEW_QUALITY.
+    grab : callable
+        Returns the next lores frame as a YUV420 array; blocking.
+        Typically ``lambda: picam2.capture_array('lores')``.
+
+    Attributes
+    ----------
+    clients : int
+        Number of connected clients
+    frames_encoded : int
+        Number of JPEG frames encoded so far
+
+    """
+
+    def __init__(self, configs, grab):
+        self.grab = grab
+        self.size = tuple(configs.get('LIVE_PREVIEW_SIZE', DEFAULT_SIZE))
+        self.interval = 1 / configs.get('LIVE_PREVIEW_FPS', DEFAULT_FPS)
+        self.quality = configs.get('LIVE_PREVIEW_QUALITY', DEFAULT_QUALITY)
+        self.clients = 0
+        self.frames_encoded = 0
+        self._frame = None
+        self._frame_number = 0
+        self._new_frame = None
+        self._producer = None
+
+    def register(self, server):
+        """Add the preview endpoints to a StatusServer"""
+        server.add_route('/preview.mjpg', self.handle_stream)
+        server.add_route('/snapshot.jpg', self.handle_snapshot)
+
+    def encode(self):
+        """Grab and encode one frame; runs on a worker thread"""
+        jpeg = yuv420_to_jpeg(self.grab(), self.size, self.quality)
+        self.frames_encoded += 1
+        return jpeg
+
+    async def _produce(self):
+        """Encode frames at the capped rate while clients are connected"""
+        loop = asyncio.get_running_loop()
+        try:
+            while self.clients:
+                started = time.monotonic()
+                try:
+                    frame = await loop.run_in_executor(None, self.encode)
+                except Exception:  # pylint: disable=broad-except
+                    log.exception('Live preview capture failed')
+                    frame = None
+                async with self._new_frame:
+                    self._frame = frame
+                    self._frame_number += 1
+                    self._new_frame.notify_all()
+                if frame is None:
+                    break
+                elapsed = time.monotonic() - started
+                await asyncio.sleep(max(0.0, self.interval - elapsed))
+        finally:
+            # wake any client that arrived as this producer finished so
+            # it can start a new one
+            async with self._new_frame:
+                self._new_frame.notify_all()
+
+    async def _next_frame(self, after):
+        """Wait for a frame newer than frame number after
+
+        Returns:
+            tuple: (JPEG bytes or None if capture failed, frame number)
+
+        """
+        if self._new_frame is None:
+            self._new_frame = asyncio.Condition()
+        async with self._new_frame:
+            while self._frame_number <= after:
+                if self._producer is None or self._producer.done():
+                    self._producer = asyncio.ensure_future(self._produce())
+                await self._new_frame.wait()
+            return self._frame, self._frame_number
+
+    async def handle_snapshot(self, reader, writer):
+        """Respond with a single JPEG frame"""
+        # pylint: disable=unused-argument
+        self.clients += 1
+        try:
+            frame, _ = await self._next_frame(self._frame_number)
+        finally:
+            self.clients -= 1
+        if frame is None:
+            await StatusServer.respond(writer, 503,
+                                       {'error': 'preview unavailable'})
+        else:
+            await StatusServer.respond(writer, 200, frame, 'image/jpeg')
+
+    async def handle_stream(self, reader, writer):
+        """Stream JPEG frames as multipart MJPEG until the client leaves"""
+        # pylint: disable=unused-argument
+        self.clients += 1
+        log.info('Live preview client connected (%d total)', self.clients)
+        try:
+            writer.write(('HTTP/1.1 200 OK\r\n'
+                          'Content-Type: multipart/x-mixed-replace; '
+                          f'boundary={BOUNDARY}\r\n'
+                          'Cache-Control: no-store\r\n'
+                          'Connection: close\r\n\r\n').encode())
+            number = self._frame_number
+            while True:
+                frame, number = await self._next_frame(number)
+                if frame is None:
+                    break
+                writer.write(f'--{BOUNDARY}\r\n'
+                             'Content-Type: image/jpeg\r\n'
+                             f'Content-Length: {len(frame)}\r\n\r\n'
+                             .encode() + frame + b'\r\n')
+                # a slow client only holds up itself: frames encoded
+                # while it drains are skipped, not queued
+                await writer.drain()
+        finally:
+            self.clients -= 1
+            log.info('Live preview client left (%d remaining)', self.clients)
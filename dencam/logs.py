@@ -1,11 +1,59 @@
-import os
+"""Logging setup for DenCam.
+
+Log records are handed to a queue by the code that logs them and
+written out by a background listener thread, so a slow SD card never
+holds up the UI or the buttons. The log file is rotated when it gets
+too big or too old, rotated files are gzipped, and the oldest logs are
+deleted once the log directory exceeds a size cap so months-long
+deployments cannot fill the card with logs. Bursts of an identical
+message are collapsed into a single "repeated N times" line.
+
+"""
+import atexit
+import glob
+import gzip
 import logging
+import logging.handlers
+import os
 import getpass
+import queue
+import shutil
+import threading
+import time
 
 from datetime import datetime
 
+MAX_BYTES = 5 * 1000 * 1000
+BACKUP_COUNT = 20
+MAX_AGE = 24 * 60 * 60  # seconds
+MAX_TOTAL_BYTES = 200 * 1000 * 1000
+QUEUE_SIZE = 10000
+REPEAT_WINDOW = 60  # seconds
+
+_listener = None
+
+
+def setup_logger(level, filename=None, max_bytes=MAX_BYTES,
+                 backup_count=BACKUP_COUNT, max_age=MAX_AGE,
+                 max_total_bytes=MAX_TOTAL_BYTES):
+    """Configure the root logger to log to console and file
+
+    Args:
+        level: logging level of the root logger
+        filename (str): log file. Defaults to a new timestamped file in
+            ~/logs
+        max_bytes (int): size at which the log file is rotated
+        backup_count (int): rotated files kept for this log file
+        max_age (int): seconds after which the log file is rotated
+            regardless of size
+        max_total_bytes (int): size of all logs in the log directory
+            beyond which the oldest are deleted
+
+    Returns:
+        logging.Logger: the root logger
 
-def setup_logger(level, filename=None):
+    """
+    global _listener  # pylint: disable=global-statement
     logger = logging.getLogger()
     logger.setLevel(level)
 
@@ -13,7 +61,6 @@ def setup_logger(level, filename=None):
     strg = '[%(levelname)s] %(message)s (%(name)s)'
     formatter = logging.Formatter(strg)
     s_handler.setFormatter(formatter)
-    logger.addHandler(s_handler)
     s_handler.setLevel(logging.DEBUG)
 
     if not filename:
@@ -25,13 +72,172 @@ def setup_logger(level, filename=None):
             os.makedirs(path)
         filename = os.path.join(path, date_time_string + '_dencam.log')
 
-    f_handler = logging.FileHandler(filename)
+    f_handler = CompressingRotatingFileHandler(filename,
+                                               max_bytes=max_bytes,
+                                               backup_count=backup_count,
+                                               max_age=max_age,
+                                               max_total_bytes=max_total_bytes)
 
     strg = '%(asctime)s | %(levelname)8s | %(name)18s | %(message)s'
     f_formatter = logging.Formatter(strg,
                                     datefmt='%F %H:%M:%S')
     f_handler.setFormatter(f_formatter)
-    logger.addHandler(f_handler)
     f_handler.setLevel(logging.DEBUG)
 
+    if _listener is not None:
+        _listener.stop()
+    q_handler = DroppingQueueHandler(queue.Queue(QUEUE_SIZE))
+    q_handler.addFilter(RepeatFilter(REPEAT_WINDOW))
+    logger.addHandler(q_handler)
+    _listener = logging.handlers.QueueListener(q_handler.queue,
+                                               s_handler, f_handler,
+                                               respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
     return logger
+
+
+def stop_logging():
+    """Write out queued log records and stop the writer thread"""
+    global _listener  # pylint: disable=global-statement
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records rather than block when full
+
+    The number of dropped records is reported with the next record
+    that fits on the queue.
+
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if self.dropped:
+            note = logging.makeLogRecord(
+                {'name': __name__, 'levelno': logging.WARNING,
+                 'levelname': 'WARNING',
+                 'msg': f'{self.dropped} log records dropped '
+                        '(log writer falling behind)'})
+            try:
+                self.queue.put_nowait(note)
+                self.dropped = 0
+            except queue.Full:
+                pass
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RepeatFilter(logging.Filter):
+    """Collapse bursts of identical log messages
+
+    After a message has been let through, identical messages (same
+    logger, level and text) are suppressed for ``window`` seconds. The
+    first identical message after that is let through with a note of
+    how many were suppressed in between.
+
+    """
+
+    def __init__(self, window):
+        super().__init__()
+        self.window = window
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            last, suppressed = self._seen.get(key, (None, 0))
+            if last is not None and now - last < self.window:
+                self._seen[key] = (last, suppressed + 1)
+                return False
+            self._seen[key] = (now, 0)
+            if len(self._seen) > 1000:
+                self._forget(now)
+        if suppressed:
+            record.msg = (f'{record.getMessage()} '
+                          f'[repeated {suppressed} more times]')
+            record.args = None
+        return True
+
+    def _forget(self, now):
+        self._seen = {key: value for key, value in self._seen.items()
+                      if now - value[0] < self.window}
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotating file handler that also rotates on age and gzips backups
+
+    Parameters
+    ----------
+    filename : str
+        Log file to write
+    max_bytes : int
+        Size at which to rotate
+    backup_count : int
+        Number of rotated (compressed) files to keep
+    max_age : float
+        Seconds after which to rotate even if max_bytes not reached
+    max_total_bytes : int
+        Cap on the size of all ``*_dencam.log*`` files in the log's
+        directory, enforced by deleting the oldest files at startup
+        and after each rotation
+
+    """
+
+    def __init__(self, filename, max_bytes, backup_count, max_age,
+                 max_total_bytes):
+        super().__init__(filename, maxBytes=max_bytes,
+                         backupCount=backup_count, delay=True)
+        self.max_age = max_age
+        self.max_total_bytes = max_total_bytes
+        self.opened_at = time.time()
+        self.namer = lambda name: name + '.gz'
+        self.rotator = _gzip_rotator
+        self._prune()
+
+    def shouldRollover(self, record):
+        if time.time() - self.opened_at >= self.max_age:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.opened_at = time.time()
+        self._prune()
+
+    def _prune(self):
+        directory = os.path.dirname(os.path.abspath(self.baseFilename))
+        logs = []
+        for path in glob.glob(os.path.join(directory, '*_dencam.log*')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            logs.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in logs)
+        for _, size, path in sorted(logs):
+            if total <= self.max_total_bytes:
+                break
+            if path == self.baseFilename:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+def _gzip_rotator(source, dest):
+    with open(source, 'rb') as plain, gzip.open(dest, 'wb') as packed:
+        shutil.copyfileobj(plain, packed)
+    os.remove(source)
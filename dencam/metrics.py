@@ -0,0 +1,311 @@
+"""Machine-readable health metrics for DenCam
+
+Alongside the human-readable log, DenCam can write a stream of events
+as JSON lines: one object per line with at least an ``event`` name and
+a ``t`` (Unix time) field. Events are queued by the code that emits
+them and written in batches by a background thread, one file per day
+(``metrics-YYYY-MM-DD.jsonl``) in the METRICS_DIR directory.
+
+Events written:
+
+    startup          version
+    segment_start    path, drive
+    segment_stop     path, bytes, duration
+    drive_switch     from, to
+    camera_error     error
+    free_space       drive, gb
+    loop_latency     mean, max, ticks (UI loop lateness in seconds)
+    solar            the fields of a SunSaver reading
+    shutdown
+
+The ``summary`` command aggregates any number of these files in one
+streaming pass into an uptime and coverage report:
+
+    python -m dencam.metrics summary /home/pi/metrics/*.jsonl
+
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from datetime import datetime
+from threading import Thread
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 10  # seconds
+QUEUE_SIZE = 10000
+
+# gap between consecutive events beyond which DenCam is taken to have
+# been down (the UI loop emits loop_latency every METRICS_INTERVAL)
+DOWNTIME_GAP = 600  # seconds
+
+_writer = None
+
+
+class MetricsWriter(Thread):
+    """Background writer of JSON-lines metrics
+
+    Parameters
+    ----------
+    directory : str
+        Directory to write daily metrics files in
+    batch_size : int
+        Number of events written per batch
+    flush_interval : float
+        Longest time in seconds an event waits before being written
+
+    Attributes
+    ----------
+    dropped : int
+        Number of events dropped because the queue was full
+
+    """
+
+    def __init__(self, directory, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL):
+        super().__init__(name='MetricsWriter', daemon=True)
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.events = queue.Queue(QUEUE_SIZE)
+        self.dropped = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def emit(self, event, **fields):
+        """Queue an event for writing; never blocks"""
+        fields['event'] = event
+        fields.setdefault('t', round(time.time(), 3))
+        try:
+            self.events.put_nowait(fields)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        """Write out queued events and stop the thread"""
+        self.events.put(None)
+        self.join(timeout=5)
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    event = self.events.get(
+                        timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if event is None:
+                    stopping = True
+                    break
+                batch.append(event)
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        if self.dropped:
+            batch.append({'event': 'metrics_dropped', 't': time.time(),
+                          'count': self.dropped})
+            self.dropped = 0
+        by_file = {}
+        for event in batch:
+            day = datetime.fromtimestamp(event['t']).strftime('%Y-%m-%d')
+            line = json.dumps(event, default=str, separators=(',', ':'))
+            by_file.setdefault(day, []).append(line)
+        for day, lines in by_file.items():
+            path = os.path.join(self.directory, f'metrics-{day}.jsonl')
+            try:
+                with open(path, 'a', encoding='utf8') as metrics_file:
+                    metrics_file.write('\n'.join(lines) + '\n')
+            except OSError as error:
+                log.warning('Could not write metrics to %s: %s',
+                            path, error)
+
+
+def start(configs):
+    """Start writing metrics if METRICS_DIR is configured"""
+    global _writer  # pylint: disable=global-statement
+    directory = configs.get('METRICS_DIR')
+    if not directory or _writer is not None:
+        return
+    try:
+        _writer = MetricsWriter(os.path.expanduser(directory))
+    except OSError as error:
+        log.warning('Metrics disabled, cannot use %s: %s', directory, error)
+        return
+    _writer.start()
+    log.info('Writing metrics to %s', directory)
+
+
+def stop():
+    """Write out queued metrics and stop the writer"""
+    global _writer  # pylint: disable=global-statement
+    if _writer is not None:
+        _writer.emit('shutdown')
+        _writer.stop()
+        _writer = None
+
+
+def emit(event, **fields):
+    """Record a metrics event; does nothing if metrics are off"""
+    if _writer is not None:
+        _writer.emit(event, **fields)
+
+
+def read_events(paths):
+    """Yield events from metrics files in order, skipping bad lines"""
+    for path in paths:
+        with open(path, encoding='utf8', errors='replace') as metrics_file:
+            for line in metrics_file:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(event, dict) and 't' in event:
+                    yield event
+
+
+def summarize(events, downtime_gap=DOWNTIME_GAP):
+    """Aggregate a stream of metrics events in a single pass
+
+    Args:
+        events: iterable of event dicts in time order
+        downtime_gap (float): silence in seconds counted as downtime
+
+    Returns:
+        dict: report figures, see print_summary()
+
+    """
+    # pylint: disable=too-many-branches
+    report = {'first': None, 'last': None, 'up_seconds': 0.0,
+              'recorded_seconds': 0.0, 'segments': 0, 'bytes': 0,
+              'empty_segments': 0, 'drive_switches': 0,
+              'camera_errors': 0, 'startups': 0, 'min_free_gb': None,
+              'latency_ticks': 0, 'latency_sum': 0.0, 'latency_max': 0.0,
+              'solar_readings': 0, 'battery_min': None,
+              'battery_max': None, 'drives': {}}
+    for event in events:
+        # events from different threads can be slightly out of order,
+        # so time only advances with the latest timestamp seen
+        stamp = event['t']
+        if report['first'] is None:
+            report['first'] = report['last'] = stamp
+        report['first'] = min(report['first'], stamp)
+        if stamp > report['last']:
+            if stamp - report['last'] <= downtime_gap:
+                report['up_seconds'] += stamp - report['last']
+            report['last'] = stamp
+
+        name = event.get('event')
+        if name == 'startup':
+            report['startups'] += 1
+        elif name == 'segment_stop':
+            report['segments'] += 1
+            report['recorded_seconds'] += event.get('duration') or 0
+            size = event.get('bytes') or 0
+            report['bytes'] += size
+            if not size:
+                report['empty_segments'] += 1
+        elif name == 'segment_start':
+            drive = event.get('drive')
+            report['drives'][drive] = report['drives'].get(drive, 0) + 1
+        elif name == 'drive_switch':
+            report['drive_switches'] += 1
+        elif name == 'camera_error':
+            report['camera_errors'] += 1
+        elif name == 'free_space':
+            free = event.get('gb')
+            if free is not None and (report['min_free_gb'] is None
+                                     or free < report['min_free_gb']):
+                report['min_free_gb'] = free
+        elif name == 'loop_latency':
+            ticks = event.get('ticks', 0)
+            report['latency_ticks'] += ticks
+            report['latency_sum'] += event.get('mean', 0) * ticks
+            report['latency_max'] = max(report['latency_max'],
+                                        event.get('max', 0))
+        elif name == 'solar':
+            report['solar_readings'] += 1
+            voltage = event.get('Battery_Voltage')
+            if voltage is not None:
+                if report['battery_min'] is None:
+                    report['battery_min'] = report['battery_max'] = voltage
+                report['battery_min'] = min(report['battery_min'], voltage)
+                report['battery_max'] = max(report['battery_max'], voltage)
+    return report
+
+
+def print_summary(report, out=sys.stdout):
+    """Print a report from summarize() as text"""
+    if report['first'] is None:
+        print('No metrics found.', file=out)
+        return
+    span = report['last'] - report['first']
+
+    def percent(part):
+        return 100 * part / span if span else 0.0
+
+    def when(stamp):
+        return datetime.fromtimestamp(stamp).strftime('%Y-%m-%d %H:%M')
+
+    print(f"Period:          {when(report['first'])} to "
+          f"{when(report['last'])} ({span / 86400:.1f} days)", file=out)
+    print(f"Uptime:          {report['up_seconds'] / 3600:.1f} h "
+          f"({percent(report['up_seconds']):.1f}%), "
+          f"{report['startups']} startups", file=out)
+    print(f"Coverage:        {report['recorded_seconds'] / 3600:.1f} h "
+          f"recorded ({percent(report['recorded_seconds']):.1f}%)",
+          file=out)
+    print(f"Segments:        {report['segments']} "
+          f"({report['bytes'] / 1e9:.1f} GB, "
+          f"{report['empty_segments']} empty)", file=out)
+    for drive, count in sorted(report['drives'].items(),
+                               key=lambda item: str(item[0])):
+        print(f"    {drive}: {count} segments", file=out)
+    print(f"Drive switches:  {report['drive_switches']}", file=out)
+    print(f"Camera errors:   {report['camera_errors']}", file=out)
+    if report['min_free_gb'] is not None:
+        print(f"Min free space:  {report['min_free_gb']:.2f} GB", file=out)
+    if report['latency_ticks']:
+        mean = report['latency_sum'] / report['latency_ticks']
+        print(f"UI loop latency: mean {1000 * mean:.0f} ms, "
+              f"max {1000 * report['latency_max']:.0f} ms", file=out)
+    if report['battery_min'] is not None:
+        print(f"Battery:         {report['battery_min']:.2f} to "
+              f"{report['battery_max']:.2f} V over "
+              f"{report['solar_readings']} readings", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Summarize DenCam metrics files.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    summary = subparsers.add_parser('summary',
+                                    help='uptime and coverage report')
+    summary.add_argument('files', nargs='+',
+                         help='metrics .jsonl files or directories')
+    summary.add_argument('--downtime-gap', type=float, default=DOWNTIME_GAP,
+                         help='seconds without events counted as downtime '
+                         f'(default: {DOWNTIME_GAP})')
+    args = parser.parse_args()
+
+    paths = []
+    for name in args.files:
+        if os.path.isdir(name):
+            paths.extend(glob.glob(os.path.join(name, 'metrics-*.jsonl')))
+        else:
+            paths.append(name)
+    # daily file names sort into time order
+    paths.sort(key=os.path.basename)
+    print_summary(summarize(read_events(paths), args.downtime_gap))
+
+
+if __name__ == '__main__':
+    main()
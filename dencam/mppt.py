@@ -2,15 +2,24 @@
 
 """
 import csv
-import os
-from datetime import datetime
-from io import StringIO
+import logging
 import argparse
 import yaml
 
 import minimalmodbus
 from serial import SerialException
 
+from dencam import solar_store
+from dencam.clock import SYSTEM_CLOCK
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PORT = '/dev/ttyUSB0'
+
+# (first register, count) for the contiguous register ranges logged:
+# 8-17 are the live voltages, currents, temperatures and charge
+# state; 45-50 cover the daily amp-hours through the alarm register
+REGISTER_BLOCKS = ((8, 10), (45, 6))
 
 alarm_list = ["RTS open", "RTS shorted", "RTS disconnected",
               "Ths open", "Ths shorted", "SSMPTT hot",
@@ -26,32 +35,39 @@ field_names = ['Date', 'Time', 'Battery_Voltage', 'Array_Voltage',
                'Ambient_Temp', 'RTS_Temp', 'Charge_State',
                'Ah_Charge', 'Ah_Load', 'Alarm', 'MPPT_Error']
 
+_client = None
+
 
 def get_solardisplay_info():
-    """Read the solar data from CSV file and format it for display"""
-    path = get_file_path()
-    solar_log = os.path.join(path, "solar.csv")
-    if not os.path.exists(solar_log):
+    """Read the latest solar data from the solar log and format it"""
+    reading = solar_store.read_latest(get_file_path())
+    if reading is None:
+        return format_solar_info(None)
+    return format_solar_info(reading_to_row(reading))
+
+
+def format_solar_info(row):
+    """Format a solar log row for display
+
+    Args:
+        row (dict): solar log row keyed by field name, or None if no
+            reading is available
+
+    """
+    if row is None:
         error_msg = "Solar information\nnot found.\nPress " + \
                     "second\nbutton and refer to \nset-up" + \
                     " instructions"
         return error_msg
-    with open(solar_log, newline='',
-              encoding='utf8') as solar:
-        parsed_csvfile = solar.read()
-        parsed_csvfile = parsed_csvfile.replace('\x00', '')
-        reader = csv.DictReader(StringIO(parsed_csvfile))
-        for row in reader:
-            last_row = row
-    solar_text = last_row['Date'] + '\n' + last_row['Time']
-    solar_text += '\nBattery Voltage: ' + last_row['Battery_Voltage']
-    solar_text += '\nArray Voltage: ' + last_row['Array_Voltage']
-    solar_text += '\nCharge Current: ' + last_row['Charge_Current']
-    solar_text += '\nLoad Current: ' + last_row['Load_Current']
-    solar_text += '\nAh Charge: ' + last_row['Ah_Charge']
-    solar_text += '\nAh Load: ' + last_row['Ah_Load']
-    solar_text += '\nAlarm: ' + last_row['Alarm']
-    usb_error = last_row['MPPT_Error']
+    solar_text = row['Date'] + '\n' + row['Time']
+    solar_text += '\nBattery Voltage: ' + row['Battery_Voltage']
+    solar_text += '\nArray Voltage: ' + row['Array_Voltage']
+    solar_text += '\nCharge Current: ' + row['Charge_Current']
+    solar_text += '\nLoad Current: ' + row['Load_Current']
+    solar_text += '\nAh Charge: ' + row['Ah_Charge']
+    solar_text += '\nAh Load: ' + row['Ah_Load']
+    solar_text += '\nAlarm: ' + row['Alarm']
+    usb_error = row['MPPT_Error']
     if usb_error == "USB PORT ERROR":
         solar_text = "Check USB connection\nfrom solar charge\n" + \
                      "controller to Pi\nand press second\nbutton"
@@ -63,83 +79,184 @@ def float_to_string(value):
     return f"{value:.1f}"
 
 
-def log_solar_info():
-    """Read solar data from the SunSaver and write it to a CSV file"""
-    usb_error = False
-    solar_list = ['init']
-    now = datetime.now()
-    date_string = now.strftime("%Y-%m-%d")
-    time_string = now.strftime('%Hh%Mm%Ss')
+class SunSaverClient:
+    """Persistent Modbus connection to a SunSaver charge controller
+
+    Keeps the serial port open between readings and fetches the
+    registers DenCam logs in two block reads (one per contiguous
+    range) rather than one transaction per register. If the serial
+    port goes away (e.g. USB cable unplugged and replugged) the
+    connection is reopened and the read retried once.
+
+    Parameters
+    ----------
+    port : str
+        Serial device the SunSaver is attached to
+    slave_address : int
+        Modbus address of the SunSaver
+
+    """
+
+    def __init__(self, port=DEFAULT_PORT, slave_address=1):
+        self.port = port
+        self.slave_address = slave_address
+        self.instrument = None
+
+    def connect(self):
+        """Open the serial port to the SunSaver
+
+        Raises:
+            SerialException: if the port cannot be opened
+
+        """
+        self.close()
+        instrument = minimalmodbus.Instrument(self.port, self.slave_address)
+        instrument.serial.baudrate = 9600
+        instrument.serial.stopbits = 2
+        instrument.serial.timeout = 0.5
+        self.instrument = instrument
+
+    def close(self):
+        """Close the serial port if open"""
+        if self.instrument is not None:
+            try:
+                self.instrument.serial.close()
+            except SerialException:
+                pass
+            self.instrument = None
+
+    def read(self):
+        """Read and scale the logged SunSaver registers
+
+        Returns:
+            dict: Battery, array and load voltages, currents,
+            temperatures, charge state, daily amp-hours and the raw
+            alarm register value
+
+        Raises:
+            SerialException: if the port cannot be (re)opened
+            minimalmodbus.NoResponseError: if SunSaver does not answer
+            minimalmodbus.InvalidResponseError: on a corrupt reply
+
+        """
+        try:
+            blocks = self._read_blocks()
+        except SerialException:
+            log.warning('Serial error talking to SunSaver; reconnecting')
+            self.close()
+            blocks = self._read_blocks()
+
+        values = {}
+        for (first, _), registers in zip(REGISTER_BLOCKS, blocks):
+            for offset, raw in enumerate(registers):
+                values[first + offset] = raw
+
+        return {'Battery_Voltage': values[8] * 100 * 2**-(15),
+                'Array_Voltage': values[9] * 100 * 2**-(15),
+                'Load_Voltage': values[10] * 100 * 2**-(15),
+                'Charge_Current': values[11] * 79.16 * 2**-(15),
+                'Load_Current': values[12] * 79.16 * 2**-(15),
+                'Ambient_Temp': values[15],
+                'RTS_Temp': values[16],
+                'Charge_State': values[17],
+                'Ah_Charge': values[45] * 0.1,
+                'Ah_Load': values[46] * 0.1,
+                'Alarm': values[50]}
+
+    def _read_blocks(self):
+        if self.instrument is None:
+            self.connect()
+        return [self.instrument.read_registers(first, count)
+                for first, count in REGISTER_BLOCKS]
+
+
+def take_reading(client=None, clock=SYSTEM_CLOCK):
+    """Take a reading from the SunSaver
+
+    Args:
+        client (SunSaverClient): connection to use. Defaults to a
+            module-wide connection that stays open between calls.
+        clock (SystemClock): what to time the reading by (see
+            clock.py)
+
+    Returns:
+        dict: 'Time' of the reading as a datetime plus the values of
+        SunSaverClient.read() keyed the same way. If the SunSaver
+        could not be read, the values are None and 'MPPT_Error'
+        describes the problem; otherwise 'MPPT_Error' is 'N/A'.
+
+    """
+    global _client  # pylint: disable=global-statement
+    if client is None:
+        if _client is None:
+            _client = SunSaverClient()
+        client = _client
+
+    reading = dict.fromkeys(field_names[2:13])
+    reading['Time'] = clock.now()
     try:
-        sunsaver = minimalmodbus.Instrument('/dev/ttyUSB0', 1)
+        reading.update(client.read())
     except SerialException:
-        usb_error = True
-        solar_list = [date_string, time_string,
-                      'N/A', 'N/A', 'N/A', 'N/A',
-                      'N/A', 'N/A', 'N/A', 'N/A',
-                      'N/A', 'N/A', 'N/A',
-                      'USB PORT ERROR']
-    if not usb_error:
-        sunsaver.serial.baudrate = 9600
-        sunsaver.serial.stopbits = 2
-        try:
-            volt_batt = sunsaver.read_register(8) * 100 * 2**-(15)
-            volt_arr = sunsaver.read_register(9) * 100 * 2**-(15)
-            volt_ld = sunsaver.read_register(10) * 100 * 2**-(15)
-            curr_chrg = sunsaver.read_register(11) * 79.16 * 2**-(15)
-            curr_ld = sunsaver.read_register(12) * 79.16 * 2**-(15)
-            temp_amb = sunsaver.read_register(15)
-            temp_rts = sunsaver.read_register(16)
-            charge_state = sunsaver.read_register(17)
-            ah_charge = sunsaver.read_register(45) * 0.1
-            ah_load = sunsaver.read_register(46) * 0.1
-            alarm = sunsaver.read_register(50)
-            solar_list = [date_string,
-                          time_string,
-                          float_to_string(volt_batt),
-                          float_to_string(volt_arr),
-                          float_to_string(volt_ld),
-                          float_to_string(curr_chrg),
-                          float_to_string(curr_ld),
-                          float_to_string(temp_amb),
-                          float_to_string(temp_rts),
-                          float_to_string(charge_state),
-                          float_to_string(ah_charge),
-                          float_to_string(ah_load),
-                          alarm_list[alarm],
-                          'N/A']
-        except (minimalmodbus.NoResponseError,
-                minimalmodbus.InvalidResponseError,
-                SerialException):
-            solar_list = [date_string, time_string, 'N/A',
-                          'N/A', 'N/A', 'N/A', 'N/A', 'N/A',
-                          'N/A', 'N/A', 'N/A', 'N/A', 'N/A',
-                          'NO CONNECTION TO  SUNSAVER']
-        sunsaver.serial.close()
-    path = get_file_path()
-    solar_log = os.path.join(path, "solar.csv")
-    if not os.path.exists(solar_log):
-        with open(solar_log, 'w', newline='',
-                  encoding='utf8') as csvfile:
-            csvwriter = csv.DictWriter(csvfile, fieldnames=field_names)
-            csvwriter.writeheader()
-    with open(solar_log, 'a', newline='',
-              encoding='utf8') as csv_file:
-        csvwriter = csv.DictWriter(csv_file, fieldnames=field_names)
-        csvwriter.writerow({'Date': solar_list[0],
-                            'Time': solar_list[1],
-                            'Battery_Voltage': solar_list[2],
-                            'Array_Voltage': solar_list[3],
-                            'Load_Voltage': solar_list[4],
-                            'Charge_Current': solar_list[5],
-                            'Load_Current': solar_list[6],
-                            'Ambient_Temp': solar_list[7],
-                            'RTS_Temp': solar_list[8],
-                            'Charge_State': solar_list[9],
-                            'Ah_Charge': solar_list[10],
-                            'Ah_Load': solar_list[11],
-                            'Alarm': solar_list[12],
-                            'MPPT_Error': solar_list[13]})
+        client.close()
+        reading['MPPT_Error'] = 'USB PORT ERROR'
+    except (minimalmodbus.NoResponseError,
+            minimalmodbus.InvalidResponseError):
+        reading['MPPT_Error'] = 'NO CONNECTION TO  SUNSAVER'
+    else:
+        reading['MPPT_Error'] = 'N/A'
+    return reading
+
+
+def reading_to_row(reading):
+    """Convert a reading to a solar log (CSV) row of strings"""
+    row = {'Date': reading['Time'].strftime("%Y-%m-%d"),
+           'Time': reading['Time'].strftime('%Hh%Mm%Ss')}
+    for name in field_names[2:12]:
+        value = reading[name]
+        row[name] = 'N/A' if value is None else float_to_string(value)
+    alarm = reading['Alarm']
+    row['Alarm'] = 'N/A' if alarm is None else alarm_list[alarm]
+    row['MPPT_Error'] = reading['MPPT_Error']
+    return row
+
+
+def sample_solar_info(client=None):
+    """Take a reading from the SunSaver as a solar log row"""
+    return reading_to_row(take_reading(client))
+
+
+def append_solar_rows(rows, csv_file, header=True):
+    """Write solar log rows as CSV
+
+    Args:
+        rows (iterable): rows as returned by reading_to_row()
+        csv_file: text file object opened for writing with newline=''
+        header (bool): whether to write the header row first
+
+    """
+    csvwriter = csv.DictWriter(csv_file, fieldnames=field_names)
+    if header:
+        csvwriter.writeheader()
+    csvwriter.writerows(rows)
+
+
+def log_solar_info(client=None, path=None):
+    """Read solar data from the SunSaver and add it to the solar log
+
+    Args:
+        client (SunSaverClient): connection to use
+        path (str): directory holding the solar log. Defaults to the
+            SOLAR_DIR of the config file given on the command line.
+
+    """
+    reading = take_reading(client)
+    if path is None:
+        path = get_file_path()
+    store = solar_store.open_store(path)
+    try:
+        store.append([reading])
+    finally:
+        store.close()
 
 
 def get_file_path():
@@ -8,11 +8,14 @@ information.
 
 """
 
+import logging
 import socket
 import subprocess
 
 import netifaces as ni
 
+log = logging.getLogger(__name__)
+
 
 def get_network_info():
     """Function to acquire networking information
@@ -69,3 +72,18 @@ class AirplaneMode:
         elif self.enabled is False:
             self.ap_mode_on()
             self.enabled = True
+
+
+class SimulatedAirplaneMode(AirplaneMode):
+    """Airplane mode that only logs, for running on simulated hardware
+
+    Keeps track of the mode like AirplaneMode but leaves the radios of
+    the machine DenCam runs on alone.
+
+    """
+
+    def ap_mode_off(self):
+        log.info('Simulated airplane mode off')
+
+    def ap_mode_on(self):
+        log.info('Simulated airplane mode on')
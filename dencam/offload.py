@@ -0,0 +1,319 @@
+"""Offload recorded segments to a field laptop
+
+Copies finished segments (and their .pts files) from every drive to a
+destination directory, or over the network to a receiver started on
+the laptop with ``dencam-offload receive``. Files are copied several at
+a time and hashed with BLAKE2b as they stream. Each file lands under a
+temporary name and is renamed into place only once complete, and is
+then recorded in a manifest. Rerunning after an interruption therefore
+skips what already arrived, and a local copy resumes a partly copied
+file from where it stopped. The copy rate can be capped so offloading
+from a unit that is still recording does not starve the recording.
+
+Usage:
+    dencam-offload send /mnt/laptop/unit3 --jobs 4 --limit 20
+    dencam-offload receive /data/unit3 --port 8000     (on the laptop)
+    dencam-offload send http://laptop.local:8000/ --limit 10
+
+"""
+import argparse
+import hashlib
+import http.client
+import http.server
+import logging
+import os
+import socket
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dencam.segments import find_segments, Manifest, MIN_AGE
+from dencam.throttle import Throttle
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+MANIFEST_NAME = 'offload-manifest.jsonl'
+PART_SUFFIX = '.part'
+
+
+def copy_local(source, dest, throttle):
+    """Copy source to dest via dest.part, resuming a partial copy
+
+    Returns:
+        str: BLAKE2b hex digest of the file
+
+    """
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    part = dest + PART_SUFFIX
+    hasher = hashlib.blake2b()
+    offset = 0
+    if os.path.exists(part):
+        # hash what is already there and carry on from the end of it
+        with open(part, 'rb') as partial:
+            for block in iter(lambda: partial.read(CHUNK_SIZE), b''):
+                hasher.update(block)
+                offset += len(block)
+        if offset > os.path.getsize(source):
+            hasher, offset = hashlib.blake2b(), 0
+    with open(source, 'rb') as src, \
+            open(part, 'r+b' if offset else 'wb') as out:
+        src.seek(offset)
+        out.seek(offset)
+        out.truncate()
+        for block in iter(lambda: src.read(CHUNK_SIZE), b''):
+            throttle.consume(len(block))
+            hasher.update(block)
+            out.write(block)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(part, dest)
+    return hasher.hexdigest()
+
+
+def hash_file(path):
+    """BLAKE2b hex digest of a file"""
+    hasher = hashlib.blake2b()
+    with open(path, 'rb') as data:
+        for block in iter(lambda: data.read(CHUNK_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def copy_http(source, url, relpath, throttle):
+    """PUT source to a receiver, which checks the digest sent after it
+
+    Returns:
+        str: BLAKE2b hex digest of the file
+
+    """
+    parsed = urllib.parse.urlsplit(url)
+    target = parsed.path.rstrip('/') + '/' + urllib.parse.quote(relpath)
+    size = os.path.getsize(source)
+    hasher = hashlib.blake2b()
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80,
+                                      timeout=60)
+    try:
+        # send the data, then commit it with the digest computed on
+        # the way so the file is only read once
+        conn.putrequest('PUT', target)
+        conn.putheader('Content-Length', str(size))
+        conn.endheaders()
+        with open(source, 'rb') as src:
+            for block in iter(lambda: src.read(CHUNK_SIZE), b''):
+                throttle.consume(len(block))
+                hasher.update(block)
+                conn.send(block)
+        response = conn.getresponse()
+        response.read()
+        if response.status != 201:
+            raise OSError(f'receiver refused {relpath}: {response.status}')
+        digest = hasher.hexdigest()
+        conn.request('POST', target, headers={'X-Blake2b': digest})
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise OSError(f'receiver digest mismatch for {relpath}')
+    finally:
+        conn.close()
+    return digest
+
+
+def offload(dest, roots=None, jobs=4, limit=None, min_age=MIN_AGE,
+            manifest_path=None, verify=False):
+    """Copy all finished segments not yet in the manifest to dest
+
+    Args:
+        dest (str): directory or http://host:port/ of a receiver
+        roots (list): drives to offload from; default all media
+        jobs (int): files copied at once
+        limit (float): total bandwidth cap in megabytes per second
+        min_age (float): skip segments modified this recently
+        manifest_path (str): manifest file; defaults to one in dest,
+            or in the working directory for a receiver
+        verify (bool): re-read local copies and compare hashes
+
+    Returns:
+        tuple: (files copied, bytes copied, files failed)
+
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    remote = dest.startswith('http://')
+    if manifest_path is None:
+        if remote:
+            host = urllib.parse.urlsplit(dest).netloc.replace(':', '_')
+            manifest_path = f'offload-manifest-{host}.jsonl'
+        else:
+            os.makedirs(dest, exist_ok=True)
+            manifest_path = os.path.join(dest, MANIFEST_NAME)
+    manifest = Manifest(manifest_path)
+    throttle = Throttle(limit * 1e6 if limit else None)
+
+    work = []
+    for segment in find_segments(roots, min_age):
+        drive = os.path.basename(segment.drive.rstrip('/'))
+        for path in [segment.path] + segment.sidecars():
+            relpath = os.path.join(drive, segment.date,
+                                   os.path.basename(path))
+            stat = os.stat(path)
+            if not manifest.done(relpath, stat.st_size, stat.st_mtime):
+                work.append((path, relpath, stat.st_size, stat.st_mtime))
+    total = sum(item[2] for item in work)
+    print(f'{len(work)} files ({total / 1e9:.2f} GB) to offload, '
+          f'{len(manifest.entries)} already done')
+
+    def copy(item):
+        path, relpath, size, mtime = item
+        if remote:
+            digest = copy_http(path, dest, relpath, throttle)
+        else:
+            target = os.path.join(dest, relpath)
+            digest = copy_local(path, target, throttle)
+            if verify and hash_file(target) != digest:
+                os.remove(target)
+                raise OSError(f'verification failed for {relpath}')
+        manifest.add(relpath, size, mtime, blake2b=digest)
+        return size
+
+    copied = failed = 0
+    done_bytes = 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(jobs) as pool:
+        futures = {pool.submit(copy, item): item for item in work}
+        for future in as_completed(futures):
+            relpath = futures[future][1]
+            try:
+                done_bytes += future.result()
+                copied += 1
+            except (OSError, socket.error) as error:
+                failed += 1
+                print(f'FAILED {relpath}: {error}')
+                continue
+            elapsed = time.monotonic() - started
+            rate = done_bytes / elapsed if elapsed else 0
+            eta = (total - done_bytes) / rate if rate else 0
+            print(f'[{copied + failed}/{len(work)}] {relpath} '
+                  f'{rate / 1e6:.1f} MB/s, ETA {eta / 60:.0f} min')
+    return copied, done_bytes, failed
+
+
+class ReceiveHandler(http.server.BaseHTTPRequestHandler):
+    """Receives files PUT by copy_http() into the server's directory"""
+
+    def _target(self):
+        relpath = urllib.parse.unquote(urllib.parse.urlsplit(self.path)
+                                       .path).lstrip('/')
+        target = os.path.realpath(os.path.join(self.server.directory,
+                                               relpath))
+        if not target.startswith(self.server.directory + os.sep):
+            return None
+        return target
+
+    def do_PUT(self):  # pylint: disable=invalid-name
+        """Write the request body to target.part, hashing as it arrives"""
+        target = self._target()
+        if target is None:
+            self.send_error(403)
+            return
+        length = int(self.headers['Content-Length'])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        hasher = hashlib.blake2b()
+        with open(target + PART_SUFFIX, 'wb') as out:
+            while length:
+                block = self.rfile.read(min(CHUNK_SIZE, length))
+                if not block:
+                    break
+                hasher.update(block)
+                out.write(block)
+                length -= len(block)
+            out.flush()
+            os.fsync(out.fileno())
+        if length:
+            self.send_error(400, 'short upload')
+            return
+        with self.server.lock:
+            self.server.pending[target] = hasher.hexdigest()
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Commit an upload if its digest matches what the sender hashed"""
+        target = self._target()
+        with self.server.lock:
+            digest = self.server.pending.pop(target, None)
+        if digest is None or digest != self.headers.get('X-Blake2b'):
+            if target is not None and os.path.exists(target + PART_SUFFIX):
+                os.remove(target + PART_SUFFIX)
+            self.send_error(409, 'digest mismatch')
+            return
+        os.replace(target + PART_SUFFIX, target)
+        log.info('Received %s', target)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        log.debug(format, *args)
+
+
+def receive(directory, port, host=''):
+    """Serve as an offload destination until interrupted"""
+    os.makedirs(directory, exist_ok=True)
+    server = http.server.ThreadingHTTPServer((host, port), ReceiveHandler)
+    server.directory = os.path.realpath(directory)
+    server.pending = {}
+    server.lock = threading.Lock()
+    print(f'Receiving into {server.directory} on port {port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(
+        description='Offload DenCam recordings to a laptop.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    send = subparsers.add_parser('send', help='copy segments to a '
+                                 'directory or receiver')
+    send.add_argument('dest', help='directory, or http://host:port/ of '
+                      'a receiver')
+    send.add_argument('--source', nargs='+', metavar='DIR',
+                      help='drives to offload (default: all drives in '
+                      '/media/<user> and home)')
+    send.add_argument('--jobs', type=int, default=4,
+                      help='files copied at once (default: 4)')
+    send.add_argument('--limit', type=float,
+                      help='bandwidth cap in MB/s (default: none)')
+    send.add_argument('--min-age', type=float, default=MIN_AGE,
+                      help='skip segments modified in the last this many '
+                      f'seconds (default: {MIN_AGE})')
+    send.add_argument('--manifest', help='manifest file to resume from')
+    send.add_argument('--verify', action='store_true',
+                      help='re-read local copies and check their hashes')
+
+    recv = subparsers.add_parser('receive', help='accept segments over '
+                                 'the network')
+    recv.add_argument('directory')
+    recv.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    if args.command == 'receive':
+        receive(args.directory, args.port)
+        return
+    copied, size, failed = offload(args.dest, args.source, args.jobs,
+                                   args.limit, args.min_age, args.manifest,
+                                   args.verify)
+    print(f'Copied {copied} files ({size / 1e9:.2f} GB), {failed} failed')
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
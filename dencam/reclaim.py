@@ -0,0 +1,261 @@
+"""Reclaim storage from segments in which nothing happens
+
+Scores each finished segment for activity and acts on those below a
+threshold: moves them to a cold storage directory, replaces them with a
+small low-bitrate MP4 proxy, or deletes them. Scores come from the
+segment's activity timeline (see activity.py) where there is one, and
+otherwise from frame sizes: the encoder spends few bits on P-frames of
+a still scene, so the 95th percentile P-frame size as a fraction of the
+median keyframe size is low for static footage and jumps when something
+moves. Frame sizes are read with the H.264 parser in h264.py without
+decoding, so they are cheap enough to compute on the unit itself.
+
+Nothing is changed unless --apply is given; without it the tool
+reports what it would do and how much space that would free. Every
+action taken is recorded in reclaim-log.jsonl at the top of the
+segment's drive. --idle lowers the tool's CPU and disk priority so it
+can run on a recording unit.
+
+Usage:
+    dencam-reclaim /media/pi/A --action delete
+    dencam-reclaim /media/pi/A --action move --cold /media/pi/B/cold --apply
+    dencam-reclaim /data/unit3/A --action proxy --activity-dir /data/unit3/review --apply
+
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+from dencam import h264
+from dencam.activity import ACTIVITY_DIR, MANIFEST_NAME as ACTIVITY_MANIFEST
+from dencam.segments import find_segments, group_by_output, Manifest
+from dencam.transcode import PART_SUFFIX, run_job
+
+LOG_NAME = 'reclaim-log.jsonl'
+ACTIONS = ('move', 'proxy', 'delete')
+# segments with fewer active seconds than this in their activity
+# timeline are inactive
+MIN_ACTIVE = 1
+# segments whose P-frame size ratio (see frame_size_score) is below
+# this are inactive
+MIN_RATIO = 0.1
+PROXY_WIDTH = 640
+PROXY_CRF = 35
+
+
+def frame_size_score(path):
+    """95th percentile P-frame size over median keyframe size
+
+    Returns:
+        float: the ratio, or None if the segment has no keyframe or
+        too few frames to judge
+
+    """
+    keyframes, others = [], []
+    with open(path, 'rb') as video:
+        for unit in h264.access_units(video):
+            if not unit.valid:
+                continue
+            size = unit.end - unit.offset
+            (keyframes if unit.idr else others).append(size)
+    if not keyframes or len(others) < 20:
+        return None
+    others.sort()
+    return others[int(0.95 * (len(others) - 1))] / \
+        statistics.median(keyframes)
+
+
+def activity_entries(roots, activity_dir=None):
+    """Activity manifest entries by segment path"""
+    entries = {}
+    for top, items in group_by_output(roots, ACTIVITY_DIR, activity_dir,
+                                      0).items():
+        manifest = Manifest(os.path.join(top, ACTIVITY_MANIFEST))
+        for segment, relpath in items:
+            entry = manifest.entries.get(os.path.join(relpath, segment.name))
+            if entry is not None and entry['size'] == segment.size \
+                    and 'active' in entry:
+                entries[segment.path] = entry
+    return entries
+
+
+def score_segments(segments, activity, source='auto', workers=1,
+                   min_active=MIN_ACTIVE, min_ratio=MIN_RATIO):
+    """Decide which segments are inactive
+
+    Args:
+        segments (list): Segments to score
+        activity (dict): activity manifest entries by path
+        source (str): 'activity', 'frames' or 'auto' (activity where
+            there is a timeline, else frames)
+        workers (int): processes computing frame size scores
+        min_active (int): inactive below this many active seconds
+        min_ratio (float): inactive below this frame size score
+
+    Returns:
+        list: (segment, score description, inactive) for each segment
+        that could be scored
+
+    """
+    results = []
+    by_frames = []
+    for segment in segments:
+        entry = activity.get(segment.path)
+        if entry is not None and source != 'frames':
+            results.append((segment, f"{entry['active']} s active",
+                            entry['active'] < min_active))
+        elif source != 'activity':
+            by_frames.append(segment)
+    with ProcessPoolExecutor(workers) as pool:
+        ratios = pool.map(frame_size_score,
+                          [segment.path for segment in by_frames])
+        for segment, ratio in zip(by_frames, ratios):
+            if ratio is not None:
+                results.append((segment, f'P/I size {ratio:.3f}',
+                                ratio < min_ratio))
+    results.sort(key=lambda result: result[0].path)
+    return results
+
+
+def proxy_command(segment, output, fps):
+    """ffmpeg command writing a small, low quality MP4 of a segment"""
+    return ['ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error',
+            '-y', '-r', str(fps), '-i', segment.path,
+            '-vf', f'scale={PROXY_WIDTH}:-2', '-c:v', 'libx264',
+            '-preset', 'veryfast', '-crf', str(PROXY_CRF), '-an',
+            '-movflags', '+faststart', '-f', 'mp4', output]
+
+
+def reclaim(segment, action, cold=None, fps=25):
+    """Apply an action to a segment and its sidecar files
+
+    Returns:
+        tuple: (bytes freed on the segment's drive, new path or None)
+
+    """
+    files = [segment.path] + segment.sidecars()
+    size = sum(os.path.getsize(path) for path in files)
+    if action == 'move':
+        drive_name = os.path.basename(segment.drive.rstrip(os.sep))
+        directory = os.path.join(cold, drive_name, segment.date)
+        os.makedirs(directory, exist_ok=True)
+        for path in files:
+            target = os.path.join(directory, os.path.basename(path))
+            shutil.copy2(path, target + PART_SUFFIX)
+            os.replace(target + PART_SUFFIX, target)
+            os.remove(path)
+        return size, os.path.join(directory, segment.name)
+    if action == 'proxy':
+        output = os.path.splitext(segment.path)[0] + '.proxy.mp4'
+        error, _ = run_job(segment.path, output,
+                           [proxy_command(segment, output + PART_SUFFIX,
+                                          fps)])
+        if error is not None:
+            raise OSError(error)
+        size -= os.path.getsize(output)
+    for path in files:
+        os.remove(path)
+    return size, output if action == 'proxy' else None
+
+
+def lower_priority():
+    """Run at idle CPU and disk priority so recording is not disturbed"""
+    os.nice(19)
+    try:
+        subprocess.run(['ionice', '-c', '3', '-p', str(os.getpid())],
+                       stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=False)
+    except OSError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Move, shrink or delete DenCam segments with no '
+        'activity.')
+    parser.add_argument('roots', nargs='+',
+                        help='drives or date directories')
+    parser.add_argument('--action', choices=ACTIONS, required=True,
+                        help='move: to --cold; proxy: replace with a small '
+                        'MP4; delete')
+    parser.add_argument('--cold', help='directory to move segments to')
+    parser.add_argument('--apply', action='store_true',
+                        help='make the changes (default: only report)')
+    parser.add_argument('--score', choices=('auto', 'activity', 'frames'),
+                        default='auto',
+                        help='activity timelines, frame sizes, or auto: '
+                        'timelines where there are any (default: auto)')
+    parser.add_argument('--activity-dir',
+                        help='where dencam-activity wrote timelines, if '
+                        'not on each drive')
+    parser.add_argument('--min-active', type=int, default=MIN_ACTIVE,
+                        help='inactive below this many active seconds '
+                        f'(default: {MIN_ACTIVE})')
+    parser.add_argument('--min-ratio', type=float, default=MIN_RATIO,
+                        help='inactive below this P-frame to keyframe size '
+                        f'ratio (default: {MIN_RATIO})')
+    parser.add_argument('--fps', type=float, default=25,
+                        help='recorded frame rate, for --action proxy '
+                        '(default: 25)')
+    parser.add_argument('--min-age', type=float, default=3600,
+                        help='skip segments modified in the last this many '
+                        'seconds (default: 3600)')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='segments scored at once (default: 1)')
+    parser.add_argument('--idle', action='store_true',
+                        help='run at lowest CPU and disk priority')
+    args = parser.parse_args()
+    if args.action == 'move' and not args.cold:
+        parser.error('--action move needs --cold')
+
+    if args.idle:
+        lower_priority()
+
+    segments = list(find_segments(args.roots, args.min_age))
+    activity = (activity_entries(args.roots, args.activity_dir)
+                if args.score != 'frames' else {})
+    results = score_segments(segments, activity, args.score, args.jobs,
+                             args.min_active, args.min_ratio)
+
+    inactive = [(segment, score) for segment, score, idle in results
+                if idle]
+    total = sum(segment.size for segment, _ in inactive)
+    print(f'{len(segments)} segments, {len(results)} scored, '
+          f'{len(inactive)} inactive ({total / 1e9:.2f} GB)')
+    logs = {}
+    freed = failed = 0
+    for segment, score in inactive:
+        if not args.apply:
+            print(f'would {args.action} {segment.path} ({score}, '
+                  f'{segment.size / 1e6:.0f} MB)')
+            continue
+        try:
+            size, new_path = reclaim(segment, args.action, args.cold,
+                                     args.fps)
+        except OSError as error:
+            failed += 1
+            print(f'FAILED {segment.path}: {error}')
+            continue
+        freed += size
+        if segment.drive not in logs:
+            logs[segment.drive] = Manifest(os.path.join(segment.drive,
+                                                        LOG_NAME))
+        logs[segment.drive].add(segment.relpath, segment.size,
+                                segment.mtime, action=args.action,
+                                score=score, freed=size, new_path=new_path)
+        print(f'{args.action} {segment.path} ({score}): '
+              f'{size / 1e6:.0f} MB freed')
+    if args.apply:
+        print(f'Freed {freed / 1e9:.2f} GB, {failed} failed')
+    else:
+        print(f'Dry run: would free up to {total / 1e9:.2f} GB; '
+              'rerun with --apply to do it')
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
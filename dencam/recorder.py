@@ -7,12 +7,17 @@ video captured from the picamera.
 import logging
 import os
 import getpass
-import time
+import sqlite3
+import threading
 import subprocess
 import sys
-from datetime import datetime
 from abc import ABC, abstractmethod
 
+from dencam import metrics
+from dencam.catalog import Catalog
+from dencam.clock import SYSTEM_CLOCK
+from dencam.state import StateStore, stored
+
 log = logging.getLogger(__name__)
 
 
@@ -24,25 +29,51 @@ class BaseRecorder(ABC):
     would do what a child recorder needs to when starting and stopping
     recordings.
 
+    Parameters
+    ----------
+    configs : dict
+        DenCam configuration
+    clock : SystemClock or SimulatedClock
+        What to tell the time by (see clock.py). Defaults to the real
+        time.
+
     """
     # pylint: disable=too-many-instance-attributes
 
-    def __init__(self, configs):
+    # state read and changed by the UI, button and status threads,
+    # kept in self.store so changes can be waited on or subscribed to
+    preview_on = stored('preview_on')
+    initial_pause_complete = stored('initial_pause_complete')
+    zoom_on = stored('zoom_on')
+    recording = stored('recording')
+
+    def __init__(self, configs, clock=None):
         self.configs = configs
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
 
-        # state: could be combined into a dict but accesses directly
-        # by other code so would have to update in those places
-        self.preview_on = False
-        self.initial_pause_complete = False
-        self.zoom_on = False
-        self.recording = False
+        self.store = StateStore(preview_on=False,
+                                initial_pause_complete=False,
+                                zoom_on=False,
+                                recording=False)
+        # held while starting or stopping a recording, and by callers
+        # deciding whether to, so that the UI controller and a button
+        # press cannot both start (or stop) the same recording
+        self.lock = threading.RLock()
 
-        self.record_start_time = time.time()  # also used in initial countdown
+        # also used in initial countdown
+        self.record_start_time = self.clock.time()
 
         # self.camera should be initialized in derived classes
         self.camera = None
 
         # storage setup
+        user = getpass.getuser()
+        log.debug("User is '%s'", user)
+        # drives are mounted in media_dir; home_dir is used once all
+        # are full
+        self.media_dir = (configs.get('MEDIA_DIR')
+                          or os.path.join('/media', user))
+        self.home_dir = configs.get('HOME_DIR') or os.path.join('/home', user)
         self.reserved_storage = (configs['PI_RESERVED_STORAGE']
                                  / 1000)  # in gigabytes
         file_size = configs['AVG_VIDEO_FILE_SIZE']/1000  # in gigabytes
@@ -62,20 +93,47 @@ class BaseRecorder(ABC):
         self.camera.rotation = self.configs['CAMERA_ROTATION']
         self.camera.resolution = self.configs['CAMERA_RESOLUTION']
 
-    @abstractmethod
     def stop_recording(self):
+        """Stop recording, if recording
+
+        """
+        with self.lock:
+            if self.recording:
+                self._stop_recording()
+
+    def start_recording(self):
+        """Start recording, unless already recording
+
+        """
+        with self.lock:
+            if not self.recording:
+                self._start_recording()
+
+    @abstractmethod
+    def _stop_recording(self):
         """Abstract method: used by derived class for recording stop logic
 
         """
         return
 
     @abstractmethod
-    def start_recording(self):
+    def _start_recording(self):
         """Abstract method: used by derived class for recording start logic
 
         """
         return
 
+    def apply_profile(self, profile):
+        """Apply the camera settings of a recording profile
+
+        Used by the power governor (see governor.py) to change frame
+        rate and resolution. Only call between recordings.
+
+        """
+        log.info('Applying recording profile: %s', profile['name'])
+        self.camera.framerate = profile['frame_rate']
+        self.camera.resolution = tuple(profile['resolution'])
+
     def toggle_zoom(self):
         """Toggle whether display is digitally zoomed
 
@@ -98,10 +156,11 @@ class BaseRecorder(ABC):
         """Toggle whether system is recording
 
         """
-        if self.recording:
-            self.stop_recording()
-        else:
-            self.start_recording()
+        with self.lock:
+            if self.recording:
+                self.stop_recording()
+            else:
+                self.start_recording()
 
     def toggle_preview(self):
         """Toggle whether displaying video or not
@@ -128,9 +187,7 @@ class BaseRecorder(ABC):
         self.preview_on = False
 
     def _video_path_selector(self):
-        user = getpass.getuser()
-        log.debug("User is '%s'", user)
-        media_dir = os.path.join('/media', user)
+        media_dir = self.media_dir
 
         # this try block protects against the user not even having a folder in
         # /media which can happen if no media has ever been attached under
@@ -140,11 +197,11 @@ class BaseRecorder(ABC):
         except FileNotFoundError:
             media_devices = []
 
-        default_path = os.path.join('/home', user)
+        default_path = self.home_dir
         if media_devices:
             media_devices.sort()
             strg = ', '.join(media_devices)
-            log.info("Found media in /media: %s", strg)
+            log.info("Found media in %s: %s", media_dir, strg)
             for media_device in media_devices:
                 media_path = os.path.join(media_dir, media_device)
                 free_space = self.get_free_space(media_path)
@@ -179,8 +236,7 @@ class BaseRecorder(ABC):
 
     def _clear_ghost_drives(self):
         log.info('Clearing ghost drives, if any are present.')
-        user = getpass.getuser()
-        media_dir = os.path.join('/media', user)
+        media_dir = self.media_dir
         usb_drive_list = os.listdir(media_dir)
         if len(usb_drive_list) > 0:
             for usb_drive in usb_drive_list:
@@ -223,7 +279,7 @@ class BaseRecorder(ABC):
         """Update timestamp string on camera capture
 
         """
-        date_string = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        date_string = self.clock.now().strftime('%Y-%m-%d %H:%M:%S')
         self.camera.annotate_text = date_string
 
 
@@ -234,12 +290,27 @@ class Recorder(BaseRecorder):
 
     """
 
-    def __init__(self, configs):
-        super().__init__(configs)
+    def __init__(self, configs, clock=None):
+        super().__init__(configs, clock)
 
         self.vid_count = 0
-
-    def start_recording(self):
+        self.filename = None
+        self.last_drive = None
+
+        self.catalog = None
+        if configs.get('CATALOG_FILE'):
+            try:
+                self.catalog = Catalog(configs['CATALOG_FILE'])
+                recovered = self.catalog.recover()
+                if recovered:
+                    log.info('Closed %d interrupted segment(s) in catalog',
+                             recovered)
+            except sqlite3.Error as error:
+                log.error('Could not open catalog %s: %s',
+                          configs['CATALOG_FILE'], error)
+                self.catalog = None
+
+    def _start_recording(self):
         """Prepares for and starts a new recording
 
         """
@@ -251,7 +322,7 @@ class Recorder(BaseRecorder):
             self.recording = True
             self.vid_count += 1
 
-            now = datetime.now()
+            now = self.clock.now()
             date_string = now.strftime("%Y-%m-%d")
 
             # if not os.path.exists(self.video_path):
@@ -270,12 +341,44 @@ class Recorder(BaseRecorder):
             filename = os.path.join(todays_dir, date_time_string + '.h264')
             self.camera.start_recording(filename,
                                         quality=self.configs['VIDEO_QUALITY'])
-            self.record_start_time = time.time()
+            self.record_start_time = self.clock.time()
+            self.filename = filename
+
+            if self.video_path != self.last_drive:
+                if self.last_drive is not None:
+                    metrics.emit('drive_switch', **{'from': self.last_drive,
+                                                    'to': self.video_path})
+                self.last_drive = self.video_path
+            metrics.emit('segment_start', path=filename,
+                         drive=self.video_path)
+            if self.catalog is not None:
+                try:
+                    self.catalog.segment_started(filename,
+                                                 self.record_start_time)
+                except (sqlite3.Error, OSError) as error:
+                    log.warning('Could not catalog %s: %s', filename, error)
 
-    def stop_recording(self):
+    def _stop_recording(self):
         """Stops currently ongoing recording
 
         """
         log.info('Ending current recording')
         self.recording = False
         self.camera.stop_recording()
+
+        if self.filename is not None:
+            try:
+                size = os.path.getsize(self.filename)
+            except OSError:
+                size = None
+            metrics.emit('segment_stop', path=self.filename, bytes=size,
+                         duration=round(self.clock.time()
+                                        - self.record_start_time, 1))
+            if self.catalog is not None:
+                try:
+                    self.catalog.segment_stopped(self.filename,
+                                                 self.clock.time())
+                except (sqlite3.Error, OSError) as error:
+                    log.warning('Could not catalog %s: %s', self.filename,
+                                error)
+            self.filename = None
@@ -2,6 +2,7 @@
 
 """
 import logging
+import os
 import time
 from picamera2.encoders import H264Encoder
 from picamera2 import Picamera2, Preview, MappedArray
@@ -22,7 +23,15 @@ class Picam2:
         self.encoder = H264Encoder()
 
         self.camera = Picamera2()
-        self.camera.configure("preview")
+        # a small lores stream is only needed for the live preview
+        self.lores = None
+        if configs.get('LIVE_PREVIEW'):
+            self.lores = {"size": tuple(configs.get('LIVE_PREVIEW_SIZE',
+                                                    (320, 240)))}
+            self.camera.configure(self.camera.create_preview_configuration(
+                lores=self.lores))
+        else:
+            self.camera.configure("preview")
         self.camera.start_preview(Preview.NULL)
         self.camera.start()
 
@@ -46,12 +55,37 @@ class Picam2:
         self.camera.start_preview(Preview.NULL)
         log.info('Stopped Preview')
 
+    def reconfigure(self, size, frame_rate):
+        """Restart camera with a video configuration of given size/rate
+
+        """
+        config = self.camera.create_video_configuration(
+            main={"size": tuple(size)},
+            lores=self.lores,
+            controls={"FrameRate": frame_rate})
+        self.camera.stop()
+        self.camera.configure(config)
+        self.camera.start()
+        log.info('Reconfigured camera to %s at %s fps', size, frame_rate)
+
+    def capture_lores(self):
+        """Return the next frame of the lores stream (YUV420 array)
+
+        """
+        return self.camera.capture_array("lores")
+
     def start_recording(self, filename, quality=None):
         """Start recording and log
 
+        If WRITE_PTS is set, frame timestamps are written alongside the
+        video in a .pts file with the same name.
+
         """
         # pylint: disable=unused-argument
-        self.camera.start_recording(self.encoder, filename)
+        pts = None
+        if self.configs.get('WRITE_PTS'):
+            pts = os.path.splitext(filename)[0] + '.pts'
+        self.camera.start_recording(self.encoder, filename, pts=pts)
         log_message = 'Started Recording: ' + str(filename)
         log.info(log_message)
 
@@ -77,6 +111,10 @@ class Picamera2Recorder(Recorder):
     def update_timestamp(self):
         self.camera.camera.pre_callback = self.timestamp
 
+    def apply_profile(self, profile):
+        log.info('Applying recording profile: %s', profile['name'])
+        self.camera.reconfigure(profile['resolution'], profile['frame_rate'])
+
     def timestamp(self, request):
         """Update timestamp on video and preview
 
@@ -0,0 +1,257 @@
+"""Simulated camera and recorder for running DenCam without a Pi
+
+SimulatedRecorder records with SimulatedCamera, which stands in for
+PiCamera: instead of video it writes a synthetic H.264 Annex B stream
+(parameter sets, a keyframe every KEYFRAME_INTERVAL frames and P-frames
+in between, with payloads that are random bytes) at the frame rate and
+bitrate DenCam is configured for, from a thread of its own as the
+camera library would. The streams parse as H.264 (see h264.py), so
+dencam-check, the catalog and the storage and rotation logic work on
+them, but they cannot be decoded into pictures.
+
+The bitrate is SIMULATED_BITRATE (bits per second) if set, otherwise
+that giving AVG_VIDEO_FILE_SIZE megabytes per RECORD_LENGTH.
+
+Given a clock (see clock.py) the camera instead records in the clock's
+time: no writer thread runs, and when a recording stops its file is
+sized for the frames that would have been written since it started.
+Only the first keyframe is written; the rest of the file is left a
+hole, so simulated months of video take next to no disk space.
+
+"""
+import logging
+import os
+import threading
+import time
+
+from dencam.recorder import Recorder
+
+log = logging.getLogger(__name__)
+
+START_CODE = b'\x00\x00\x00\x01'
+# sequence and picture parameter sets of a 1080p High profile stream
+SPS = START_CODE + b'\x67\x64\x00\x28\xac\x2b\x40\x3c\x01\x13\xf2\xa0'
+PPS = START_CODE + b'\x68\xee\x3c\x80'
+IDR_HEADER = START_CODE + b'\x65'
+P_HEADER = START_CODE + b'\x41'
+KEYFRAME_INTERVAL = 60
+# size of a keyframe relative to a P-frame
+KEYFRAME_WEIGHT = 4
+PAYLOAD_POOL = 1 << 20
+
+
+def configured_bitrate(configs):
+    """Bits per second the simulated camera records at"""
+    if configs.get('SIMULATED_BITRATE'):
+        return configs['SIMULATED_BITRATE']
+    return configs['AVG_VIDEO_FILE_SIZE'] * 8e6 / configs['RECORD_LENGTH']
+
+
+class SyntheticStream:
+    """Generates the frames of a synthetic H.264 stream
+
+    Parameters
+    ----------
+    bitrate : float
+        Average bits per second
+    framerate : float
+        Frames per second
+
+    """
+
+    def __init__(self, bitrate, framerate):
+        self.bitrate = bitrate
+        self.framerate = framerate
+        frame_bytes = bitrate / 8 / framerate
+        # average over a GOP comes to frame_bytes
+        self.p_size = max(16, int(frame_bytes * KEYFRAME_INTERVAL
+                                  / (KEYFRAME_INTERVAL - 1
+                                     + KEYFRAME_WEIGHT)))
+        self.idr_size = self.p_size * KEYFRAME_WEIGHT
+        # no zero bytes, so no start codes or emulation prevention in
+        # the payloads, and the top bit of the first byte set, which
+        # makes each slice the first of a new frame
+        self.pool = os.urandom(PAYLOAD_POOL).replace(b'\x00', b'\x01')
+        self.position = 0
+
+    def _payload(self, size):
+        parts = []
+        while size:
+            if self.position >= len(self.pool):
+                self.position = 0
+            part = self.pool[self.position:self.position + size]
+            self.position += len(part)
+            size -= len(part)
+            parts.append(part)
+        parts[0] = b'\x88' + parts[0][1:]
+        return parts
+
+    def frame(self, number):
+        """Bytes of frame number, counted from the start of the stream"""
+        if number % KEYFRAME_INTERVAL == 0:
+            return b''.join([SPS, PPS, IDR_HEADER]
+                            + self._payload(self.idr_size))
+        return b''.join([P_HEADER] + self._payload(self.p_size))
+
+    def size(self, frames):
+        """Bytes taken by the first frames of the stream"""
+        keyframes = -(-frames // KEYFRAME_INTERVAL)
+        return (keyframes * (len(SPS + PPS + IDR_HEADER) + self.idr_size)
+                + (frames - keyframes) * (len(P_HEADER) + self.p_size))
+
+
+class SimulatedCamera:
+    """Stand-in for PiCamera that records synthetic H.264
+
+    Parameters
+    ----------
+    configs : dict
+        DenCam configuration. Uses FRAME_RATE, CAMERA_RESOLUTION and
+        the bitrate configs (see configured_bitrate).
+    clock : SimulatedClock
+        Clock to record in the time of. Records in real time if not
+        given.
+
+    Attributes
+    ----------
+    frames : int
+        Frames written to the current or last recording
+    bytes_written : int
+        Bytes written over all recordings
+    write_errors : int
+        Recordings cut short by a failed write, e.g. on a full drive
+
+    """
+
+    def __init__(self, configs, clock=None):
+        self.clock = clock
+        self.framerate = configs['FRAME_RATE']
+        self.resolution = tuple(configs['CAMERA_RESOLUTION'])
+        self.rotation = 0
+        self.zoom = (0, 0, 1.0, 1.0)
+        self.annotate_text = ''
+        self.bitrate = configured_bitrate(configs)
+        self.previewing = False
+        self.frames = 0
+        self.bytes_written = 0
+        self.write_errors = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._clocked = None
+        self._stream = None
+
+    def start_preview(self):
+        """Note that the preview is shown"""
+        self.previewing = True
+
+    def stop_preview(self):
+        """Note that the preview is hidden"""
+        self.previewing = False
+
+    def start_recording(self, filename, quality=None):
+        """Start writing a synthetic stream to filename
+
+        Raises:
+            OSError: if filename cannot be created
+            RuntimeError: if already recording
+
+        """
+        # pylint: disable=unused-argument
+        if self._thread is not None or self._clocked is not None:
+            raise RuntimeError('Recording is currently running')
+        output = open(filename, 'wb')  # pylint: disable=consider-using-with
+        self.frames = 0
+        if self.clock is not None:
+            self._clocked = (output, filename, self.clock.time())
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._record,
+                                        args=(output, filename),
+                                        name='SimulatedCamera', daemon=True)
+        self._thread.start()
+        log.info('Simulated recording to %s at %.1f Mbit/s', filename,
+                 self.bitrate / 1e6)
+
+    def stop_recording(self):
+        """Stop writing and close the file"""
+        if self._clocked is not None:
+            self._finish_clocked()
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _finish_clocked(self):
+        output, filename, started = self._clocked
+        self._clocked = None
+        stream = self._synthetic_stream()
+        frames = int((self.clock.time() - started) * self.framerate)
+        try:
+            if frames:
+                output.write(stream.frame(0))
+                output.truncate(stream.size(frames))
+                self.frames = frames
+                self.bytes_written += stream.size(frames)
+        except OSError as error:
+            self.write_errors += 1
+            log.error('Simulated camera could not write %s: %s',
+                      filename, error)
+        finally:
+            self._close(output, filename)
+
+    def _synthetic_stream(self):
+        """Stream for the current settings, reused while they last"""
+        stream = self._stream
+        if (stream is None or stream.bitrate != self.bitrate
+                or stream.framerate != self.framerate):
+            stream = self._stream = SyntheticStream(self.bitrate,
+                                                    self.framerate)
+        return stream
+
+    def _record(self, output, filename):
+        stream = self._synthetic_stream()
+        interval = 1 / self.framerate
+        due = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                data = stream.frame(self.frames)
+                output.write(data)
+                self.frames += 1
+                self.bytes_written += len(data)
+                due += interval
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._stop.wait(delay)
+        except OSError as error:
+            self.write_errors += 1
+            log.error('Simulated camera could not write %s: %s',
+                      filename, error)
+        finally:
+            self._close(output, filename)
+
+    @staticmethod
+    def _close(output, filename):
+        try:
+            output.close()
+        except OSError as error:
+            log.error('Simulated camera could not close %s: %s',
+                      filename, error)
+
+
+class SimulatedRecorder(Recorder):
+    """Recorder that uses a SimulatedCamera
+
+    Ghost drive clearing (sudo rmdir of stale mount points) is skipped:
+    the drives are ordinary directories in MEDIA_DIR. Given a clock,
+    the camera records in its time (see SimulatedCamera).
+
+    """
+    def __init__(self, configs, clock=None):
+        super().__init__(configs, clock)
+        log.info('Set up simulated camera')
+        self.camera = SimulatedCamera(configs, clock)
+        super().finish_setup()
+
+    def _clear_ghost_drives(self):
+        pass
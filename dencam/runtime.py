@@ -0,0 +1,258 @@
+"""Asyncio runtime for DenCam's background work
+
+Runs button handling, segment scheduling, SunSaver polling and the
+status server as coroutines on one event loop on the main thread. Only
+Tk (the Controller thread), the action executor's workers and the
+camera library keep threads of their own.
+
+Each coroutine sleeps until it has something to do, and wakes for
+nothing else: button presses arrive on a queue fed by the GPIO edge
+callbacks, and segment scheduling sleeps until the controller's next
+deadline, or without a timeout when nothing is due, until the
+recording state changes. Anything that can block (handling a press,
+which may start the camera preview; scheduling, which waits on the
+recorder lock and starts and stops the camera; reading the SunSaver)
+is run in the loop's executor, so the loop itself never blocks, but
+only when there is work to do: the loop checks deadlines itself.
+Free space on the drives, for the status server, is measured in the
+same executor call whenever a segment starts or stops, as statvfs can
+hang on a dead drive. SIGINT and SIGTERM cancel every task, which
+closes the current segment, writes out buffered solar readings and
+stops the status server before run() returns.
+
+If the wall clock is stepped back (e.g. by NTP or the RTC) while a
+segment records, the segment is lengthened by the step: its deadline
+is slept to on the event loop's monotonic clock, then checked against
+the wall clock.
+
+"""
+import asyncio
+import logging
+import selectors
+import signal
+import threading
+import time
+
+from dencam.segments import media_drives
+from dencam.status_server import free_space
+
+log = logging.getLogger(__name__)
+
+# seconds after a deadline to wake, so the deadline has surely passed
+SCHEDULE_SLACK = 0.05
+
+
+class CountingSelector(selectors.DefaultSelector):
+    """Selector that counts how often the event loop wakes up"""
+
+    def __init__(self):
+        super().__init__()
+        self.wakeups = 0
+
+    def select(self, timeout=None):
+        events = super().select(timeout)
+        self.wakeups += 1
+        return events
+
+
+class LoopQueue:
+    """Puts items on an asyncio.Queue from any thread
+
+    Stands in for ButtonHandler.presses so that the GPIO edge
+    callbacks wake the event loop.
+
+    """
+
+    def __init__(self, loop, target):
+        self.loop = loop
+        self.target = target
+
+    def put(self, item):
+        """Queue item on the event loop"""
+        self.loop.call_soon_threadsafe(self.target.put_nowait, item)
+
+
+class Runtime:
+    """Event loop running DenCam's background work
+
+    Parameters
+    ----------
+    configs : dict
+        DenCam configuration
+    recorder : Recorder
+        Recorder to schedule segments on
+    controller : Controller
+        UI controller; its scheduling is taken over by the runtime
+    button_handler : ButtonHandler
+        Optional; created but not started
+    solar_poller : SolarPoller
+        Optional; created but not started
+    status_server : StatusServer
+        Optional; created but not started
+
+    Attributes
+    ----------
+    wakeups : int
+        Number of times the event loop has woken up
+
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, configs, recorder, controller, button_handler=None,
+                 solar_poller=None, status_server=None):
+        # pylint: disable=too-many-arguments
+        self.recorder = recorder
+        self.controller = controller
+        self.button_handler = button_handler
+        self.solar_poller = solar_poller
+        self.status_server = status_server
+        self.selector = CountingSelector()
+        self.loop = None
+        self._stopping = None
+        # thread running _schedule, and whether it started or stopped
+        # a segment
+        self._scheduler = None
+        self._rotated = False
+        controller.standalone = False
+
+    @property
+    def wakeups(self):
+        """Number of times the event loop has woken up"""
+        return self.selector.wakeups
+
+    def run(self):
+        """Run until SIGINT or SIGTERM (or stop()), then shut down"""
+        loop = asyncio.SelectorEventLoop(self.selector)
+        try:
+            loop.run_until_complete(self._main())
+            loop.run_until_complete(loop.shutdown_default_executor())
+        finally:
+            loop.close()
+
+    def stop(self):
+        """Have run() shut down; safe to call from any thread"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._stopping.set)
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signum, self._stopping.set)
+
+        coroutines = {'segments': self._segments()}
+        if self.button_handler is not None:
+            coroutines['buttons'] = self._buttons()
+        if self.solar_poller is not None:
+            coroutines['solar'] = self.solar_poller.poll()
+        if self.status_server is not None:
+            coroutines['status'] = self.status_server.serve(
+                refresh_drives=False)
+        tasks = [asyncio.ensure_future(self._supervise(name, coroutine))
+                 for name, coroutine in coroutines.items()]
+
+        await self._stopping.wait()
+        log.info('Shutting down')
+        started = time.monotonic()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.loop.run_in_executor(None, self.recorder.stop_recording)
+        log.info('Shut down in %.2f s after %d event loop wakeups',
+                 time.monotonic() - started, self.wakeups)
+
+    @staticmethod
+    async def _supervise(name, coroutine):
+        """Run a task's coroutine, logging rather than losing a crash"""
+        try:
+            await coroutine
+        except asyncio.CancelledError:
+            raise
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Runtime task %s failed', name)
+
+    async def _buttons(self):
+        handler = self.button_handler
+        presses = asyncio.Queue()
+        early, handler.presses = (handler.presses,
+                                  LoopQueue(self.loop, presses))
+        while not early.empty():
+            presses.put_nowait(early.get_nowait())
+        try:
+            while True:
+                pin, pressed_at = await presses.get()
+                if pin is None:
+                    continue
+                try:
+                    # may start or stop the preview on the camera
+                    await self.loop.run_in_executor(None, handler.handle,
+                                                    pin, pressed_at)
+                except Exception:  # pylint: disable=broad-except
+                    log.exception('Handling press of button %d failed', pin)
+        finally:
+            handler.gpio.cleanup()
+
+    async def _segments(self):
+        changed = asyncio.Event()
+
+        def on_change(*_):
+            # the scheduler's own changes are dealt with in _schedule
+            if threading.get_ident() == self._scheduler:
+                self._rotated = True
+            else:
+                self.loop.call_soon_threadsafe(changed.set)
+
+        unsubscribe = self.recorder.store.subscribe(on_change)
+        changed.set()
+        deadline = None
+        try:
+            while True:
+                # only the deadline check is done on the loop: the
+                # scheduling can wait on the recorder lock or the
+                # camera, so it is run in the executor, and only when
+                # a deadline has passed or the recording state changed
+                if changed.is_set() or (deadline is not None
+                                        and time.time() >= deadline):
+                    measure = changed.is_set()
+                    changed.clear()
+                    deadline = await self.loop.run_in_executor(
+                        None, self._schedule, measure)
+                    continue
+                timeout = None
+                if deadline is not None:
+                    timeout = max(0, deadline - time.time()) + SCHEDULE_SLACK
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            unsubscribe()
+
+    def _schedule(self, measure):
+        """One round of segment scheduling, run in the executor
+
+        Args:
+            measure (bool): measure free space even if no segment is
+                started or stopped in this round
+
+        Returns:
+            float: the controller's next deadline
+
+        """
+        self._scheduler = threading.get_ident()
+        self._rotated = False
+        try:
+            self.controller.schedule_segments()
+        finally:
+            self._scheduler = None
+        if measure or self._rotated:
+            self._measure_storage()
+        return self.controller.next_deadline()
+
+    def _measure_storage(self):
+        """Update the status server's free space on each drive"""
+        if self.status_server is None:
+            return
+        self.status_server.drives = free_space(
+            media_drives(self.recorder.media_dir, self.recorder.home_dir))
+        self.status_server.drives_updated = time.time()
@@ -0,0 +1,225 @@
+"""Discovery of recorded video segments
+
+DenCam records to ``<drive>/<YYYY-MM-DD>/<YYYY-MM-DD_HHhMMmSSs>.h264``
+on each drive in /media/<user>, falling back to the home directory.
+The functions here find those segments for the tools that work on a
+deployment's footage after the fact (offload, transcoding, cataloguing
+and so on).
+
+"""
+import getpass
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime
+
+DATE_DIR = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+SEGMENT_NAME = re.compile(r'^(\d{4}-\d{2}-\d{2}_\d{2}h\d{2}m\d{2}s)\.h264$')
+SIDECAR_EXTENSIONS = ('.pts',)
+
+# segments modified more recently than this may still be being written
+MIN_AGE = 60  # seconds
+
+
+class Segment(namedtuple('Segment', 'path drive date name size mtime')):
+    """A recorded segment
+
+    Attributes
+    ----------
+    path : str
+        Full path of the .h264 file
+    drive : str
+        Root the segment was found under, e.g. /media/pi/A
+    date : str
+        Name of the date directory
+    name : str
+        File name
+    size : int
+        Size in bytes
+    mtime : float
+        Modification time
+
+    """
+    __slots__ = ()
+
+    @property
+    def relpath(self):
+        """Path relative to the drive, e.g. 2024-03-01/x.h264"""
+        return os.path.join(self.date, self.name)
+
+    @property
+    def start_time(self):
+        """Recording start time taken from the file name"""
+        stem = SEGMENT_NAME.match(self.name).group(1)
+        return datetime.strptime(stem, '%Y-%m-%d_%Hh%Mm%Ss')
+
+    def sidecars(self):
+        """Paths of files that belong with the segment (e.g. .pts)"""
+        stem = os.path.splitext(self.path)[0]
+        return [stem + extension for extension in SIDECAR_EXTENSIONS
+                if os.path.exists(stem + extension)]
+
+
+def segment_from_path(path):
+    """Segment for a single .h264 file in a date directory, or None"""
+    path = os.path.abspath(path)
+    directory, name = os.path.split(path)
+    drive, date = os.path.split(directory)
+    if not SEGMENT_NAME.match(name):
+        return None
+    stat = os.stat(path)
+    return Segment(path, drive, date, name, stat.st_size, stat.st_mtime)
+
+
+class Manifest:
+    """Append-only record of work done on segment files
+
+    Used by tools that process a deployment's files one at a time
+    (offload, transcode) to skip work already done when rerun. One JSON
+    object per line holding at least relpath, size and mtime of the
+    source file. Later lines win, and a line cut short by power loss is
+    ignored.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding='utf8') as manifest_file:
+                for line in manifest_file:
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry['relpath']] = entry
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+
+    def done(self, relpath, size, mtime):
+        """Whether this version of the file was already done"""
+        entry = self.entries.get(relpath)
+        return (entry is not None and entry['size'] == size
+                and entry['mtime'] == mtime)
+
+    def add(self, relpath, size, mtime, **fields):
+        """Record a completed file, with any extra fields given"""
+        entry = dict(fields, relpath=relpath, size=size, mtime=mtime)
+        with self._lock:
+            self.entries[relpath] = entry
+            with open(self.path, 'a', encoding='utf8') as manifest_file:
+                manifest_file.write(json.dumps(entry) + '\n')
+                manifest_file.flush()
+                os.fsync(manifest_file.fileno())
+
+
+def segment_end(segment, following=None):
+    """Estimated end time of a segment as a Unix time, or None
+
+    The last write to a segment is its end, but a copy made without
+    keeping file times has a later mtime. Recordings to a drive never
+    overlap, so the start of the next segment on the drive, following,
+    bounds it.
+
+    """
+    start = segment.start_time.timestamp()
+    if segment.mtime < start:
+        return following
+    if following is not None:
+        return min(segment.mtime, following)
+    return segment.mtime if segment.mtime - start < 86400 else None
+
+
+def media_drives(media_dir=None, home_dir=None):
+    """Paths DenCam may record to: each drive in /media/<user> and home
+
+    media_dir and home_dir replace /media/<user> and /home/<user>, as
+    set by the MEDIA_DIR and HOME_DIR configs.
+
+    """
+    user = getpass.getuser()
+    media_dir = media_dir or os.path.join('/media', user)
+    try:
+        drives = sorted(os.path.join(media_dir, name)
+                        for name in os.listdir(media_dir))
+    except OSError:
+        drives = []
+    return drives + [home_dir or os.path.join('/home', user)]
+
+
+def find_segments(roots=None, min_age=MIN_AGE, now=None):
+    """Find finished segments under the date directories of each root
+
+    Args:
+        roots (list): drives to search, or individual date directories;
+            defaults to media_drives()
+        min_age (float): skip segments modified less than this many
+            seconds ago, as they may still be being recorded
+        now (float): current time, for testing
+
+    Yields:
+        Segment: in order of drive, then date, then start time
+
+    """
+    if roots is None:
+        roots = media_drives()
+    if now is None:
+        now = time.time()
+    for root in roots:
+        root = root.rstrip(os.sep) or os.sep
+        if DATE_DIR.match(os.path.basename(root)):
+            root, dates = os.path.split(root)
+            dates = [dates]
+        else:
+            try:
+                dates = sorted(entry.name for entry in os.scandir(root)
+                               if entry.is_dir()
+                               and DATE_DIR.match(entry.name))
+            except OSError:
+                continue
+        for date in dates:
+            try:
+                entries = sorted(os.scandir(os.path.join(root, date)),
+                                 key=lambda entry: entry.name)
+            except OSError:
+                continue
+            for entry in entries:
+                if not SEGMENT_NAME.match(entry.name):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if now - stat.st_mtime < min_age:
+                    continue
+                yield Segment(entry.path, root, date, entry.name,
+                              stat.st_size, stat.st_mtime)
+
+
+def group_by_output(roots, subdir, output_dir=None, min_age=MIN_AGE):
+    """Group segments by where a tool's results for them go
+
+    Results go in <drive>/<subdir>/<date>/, or with output_dir in
+    <output_dir>/<drive name>/<date>/. Each group's top directory is
+    where the tool keeps its manifest.
+
+    Returns:
+        dict: {top directory: list of (segment, directory of its
+        results relative to top)}
+
+    """
+    tops = defaultdict(list)
+    for segment in find_segments(roots, min_age):
+        if output_dir:
+            drive_name = os.path.basename(segment.drive.rstrip(os.sep))
+            top = output_dir
+            relpath = os.path.join(drive_name, segment.date)
+        else:
+            top = os.path.join(segment.drive, subdir)
+            relpath = segment.date
+        tops[top].append((segment, relpath))
+    return tops
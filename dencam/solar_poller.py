@@ -0,0 +1,212 @@
+"""Background polling of the SunSaver charge controller
+
+This module contains the thread that samples the charge controller on
+a fixed interval while DenCam runs, keeps the most recent reading in
+memory for the UI and writes readings to the solar log store in
+batches.
+
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+from datetime import timedelta
+
+from dencam import metrics
+from dencam import mppt
+from dencam import solar_store
+from dencam.clock import SYSTEM_CLOCK
+
+log = logging.getLogger(__name__)
+
+
+class SolarPoller(threading.Thread):
+    """Thread that periodically samples the SunSaver
+
+    Readings are held in memory until ``SOLAR_BATCH_SIZE`` of them
+    have accumulated and are then appended to the solar log in one
+    transaction, so the SD card sees one small write per batch rather
+    than one per sample. While the SunSaver cannot be read (e.g. USB cable
+    unplugged) the wait between attempts doubles on each failure, up
+    to ``SOLAR_MAX_BACKOFF`` seconds, and resets on the next good
+    reading.
+
+    The poller runs as this thread when started, or as the poll()
+    coroutine on the asyncio runtime's event loop (see runtime.py). A
+    caller that drives it itself, such as a simulated deployment,
+    calls open(), then sample() as it pleases, then close().
+
+    Parameters
+    ----------
+    configs : dict
+        DenCam configuration. Uses SOLAR_DIR, SOLAR_POLL_INTERVAL and
+        optionally SOLAR_BATCH_SIZE and SOLAR_MAX_BACKOFF.
+    client : mppt.SunSaverClient
+        Connection to the charge controller. A new one on the default
+        port is created if not given.
+    clock : SystemClock or SimulatedClock
+        What to time readings by (see clock.py). Defaults to the real
+        time.
+
+    """
+
+    def __init__(self, configs, client=None, clock=None):
+        super().__init__(name='SolarPoller', daemon=True)
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.path = configs['SOLAR_DIR']
+        self.interval = configs['SOLAR_POLL_INTERVAL']
+        self.batch_size = configs.get('SOLAR_BATCH_SIZE', 10)
+        self.max_backoff = configs.get('SOLAR_MAX_BACKOFF', 3600)
+        self.client = client if client is not None else mppt.SunSaverClient()
+
+        self.failures = 0
+        self.store = None
+        self._latest = None
+        self._stored_range = (None, None)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._loop = None
+        self._poll_requested = None
+
+    @property
+    def latest(self):
+        """Most recent reading (see mppt.take_reading), or None"""
+        with self._lock:
+            return self._latest
+
+    def battery_range(self):
+        """Lowest and highest battery voltage over the last 24 hours
+
+        Combines the store's hourly rollups (cached at each flush) with
+        readings not yet flushed, so no database access is needed.
+
+        """
+        with self._lock:
+            voltages = [reading['Battery_Voltage']
+                        for reading in self._pending
+                        if reading['Battery_Voltage'] is not None]
+            voltages += [value for value in self._stored_range
+                         if value is not None]
+        if not voltages:
+            return None, None
+        return min(voltages), max(voltages)
+
+    def display_text(self):
+        """Latest reading formatted for the SolarPage"""
+        reading = self.latest
+        if reading is None:
+            return mppt.format_solar_info(None)
+        text = mppt.format_solar_info(mppt.reading_to_row(reading))
+        lowest, _ = self.battery_range()
+        if lowest is not None and reading['MPPT_Error'] != 'USB PORT ERROR':
+            text += f"\nBatt Min 24h: {lowest:.1f}"
+        return text
+
+    def poll_now(self):
+        """Take a reading as soon as possible instead of waiting"""
+        self._wake.set()
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._poll_requested.set)
+
+    def stop(self):
+        """Stop polling and write out any buffered readings"""
+        self._stopping.set()
+        self._wake.set()
+        self.join()
+
+    def run(self):
+        self.open()
+        while not self._stopping.is_set():
+            self.sample()
+            self._wake.wait(self._next_delay())
+            self._wake.clear()
+        self.close()
+
+    async def poll(self):
+        """Poll on the running event loop until cancelled
+
+        Used instead of starting the thread. Reads of the SunSaver and
+        writes to the solar log are run in the loop's executor.
+
+        """
+        loop = asyncio.get_running_loop()
+        self._poll_requested = asyncio.Event()
+        self._loop = loop
+        await loop.run_in_executor(None, self.open)
+        try:
+            while True:
+                await loop.run_in_executor(None, self.sample)
+                try:
+                    await asyncio.wait_for(self._poll_requested.wait(),
+                                           self._next_delay())
+                except asyncio.TimeoutError:
+                    pass
+                self._poll_requested.clear()
+        finally:
+            self._loop = None
+            await loop.run_in_executor(None, self.close)
+
+    def open(self):
+        """Open the solar log; done by run() and poll() themselves"""
+        self.store = solar_store.open_store(self.path)
+        self._update_stored_range()
+
+    def close(self):
+        """Write out buffered readings and close the log and SunSaver"""
+        self.flush()
+        self.store.close()
+        self.client.close()
+
+    def sample(self):
+        """Take one reading and buffer it for the solar log"""
+        reading = mppt.take_reading(self.client, self.clock)
+        if reading['MPPT_Error'] == 'N/A':
+            if self.failures:
+                log.info('SunSaver readable again after %d failures',
+                         self.failures)
+            self.failures = 0
+        else:
+            self.failures += 1
+            log.warning('SunSaver read failed (%s)',
+                        reading['MPPT_Error'])
+
+        metrics.emit('solar', **{key: value for key, value in reading.items()
+                                 if key != 'Time'})
+
+        with self._lock:
+            self._latest = reading
+            self._pending.append(reading)
+            batch_full = len(self._pending) >= self.batch_size
+        if batch_full:
+            self.flush()
+        return reading
+
+    def flush(self):
+        """Append buffered readings to the solar log"""
+        with self._lock:
+            readings, self._pending = self._pending, []
+        if not readings:
+            return
+        try:
+            self.store.append(readings)
+        except sqlite3.Error as error:
+            log.error('Could not write solar log: %s', error)
+            with self._lock:
+                self._pending = readings + self._pending
+            return
+        self._update_stored_range()
+
+    def _update_stored_range(self):
+        since = self.clock.now() - timedelta(hours=24)
+        stored_range = self.store.battery_range(since)
+        with self._lock:
+            self._stored_range = stored_range
+
+    def _next_delay(self):
+        if not self.failures:
+            return self.interval
+        return min(self.interval * 2 ** (self.failures - 1),
+                   self.max_backoff)
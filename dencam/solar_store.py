@@ -0,0 +1,595 @@
+"""Durable storage of SunSaver readings
+
+Readings are kept in an SQLite database (``solar.db`` in SOLAR_DIR)
+in write-ahead-log mode. Each batch of readings is one small
+transaction that either lands whole or not at all, so a power cut
+cannot leave a half-written record the way it could in the old
+append-only ``solar.csv``. Readings are keyed by their Unix time so
+time-range queries are an index lookup rather than a scan of the whole
+history.
+
+Hourly and daily summaries (battery voltage minimum, maximum and
+mean, amp-hours charged and drawn, and counts of alarms and read
+errors) are kept in rollup tables that are updated in the same
+transaction as each batch of readings. Trends such as "lowest battery
+voltage over the last day" are then read from a handful of summary
+rows instead of the raw readings.
+
+The CSV format remains available for field staff:
+
+    python -m dencam.solar_store export SOLAR_DIR [-o solar.csv]
+        [--start 2024-03-01] [--end 2024-04-01]
+
+"""
+import argparse
+import csv
+import logging
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from dencam import mppt
+
+log = logging.getLogger(__name__)
+
+DB_NAME = 'solar.db'
+LEGACY_CSV_NAME = 'solar.csv'
+
+# reading keys and the columns they are stored in
+COLUMNS = (('Battery_Voltage', 'battery_voltage'),
+           ('Array_Voltage', 'array_voltage'),
+           ('Load_Voltage', 'load_voltage'),
+           ('Charge_Current', 'charge_current'),
+           ('Load_Current', 'load_current'),
+           ('Ambient_Temp', 'ambient_temp'),
+           ('RTS_Temp', 'rts_temp'),
+           ('Charge_State', 'charge_state'),
+           ('Ah_Charge', 'ah_charge'),
+           ('Ah_Load', 'ah_load'),
+           ('Alarm', 'alarm'),
+           ('MPPT_Error', 'error'))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS samples (
+    ts INTEGER PRIMARY KEY,
+    battery_voltage REAL,
+    array_voltage REAL,
+    load_voltage REAL,
+    charge_current REAL,
+    load_current REAL,
+    ambient_temp REAL,
+    rts_temp REAL,
+    charge_state INTEGER,
+    ah_charge REAL,
+    ah_load REAL,
+    alarm INTEGER,
+    error TEXT
+)
+'''
+
+# one table per rollup period, keyed by the local start time of the
+# hour or day. battery_sum / battery_count gives the mean voltage. The
+# SunSaver's amp-hour registers are daily running totals, so the
+# largest value seen in a period is the charge (or load) for the day
+# up to the end of that period.
+ROLLUP_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS {table} (
+    start INTEGER PRIMARY KEY,
+    samples INTEGER NOT NULL,
+    battery_count INTEGER NOT NULL,
+    battery_min REAL,
+    battery_max REAL,
+    battery_sum REAL NOT NULL,
+    ah_charge REAL,
+    ah_load REAL,
+    alarms INTEGER NOT NULL,
+    errors INTEGER NOT NULL
+)
+'''
+
+ROLLUP_UPSERT = '''
+INSERT INTO {table} VALUES (?, 1, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (start) DO UPDATE SET
+    samples = samples + 1,
+    battery_count = battery_count + excluded.battery_count,
+    battery_min = min(coalesce(battery_min, excluded.battery_min),
+                      coalesce(excluded.battery_min, battery_min)),
+    battery_max = max(coalesce(battery_max, excluded.battery_max),
+                      coalesce(excluded.battery_max, battery_max)),
+    battery_sum = battery_sum + excluded.battery_sum,
+    ah_charge = max(coalesce(ah_charge, excluded.ah_charge),
+                    coalesce(excluded.ah_charge, ah_charge)),
+    ah_load = max(coalesce(ah_load, excluded.ah_load),
+                  coalesce(excluded.ah_load, ah_load)),
+    alarms = alarms + excluded.alarms,
+    errors = errors + excluded.errors
+'''
+
+ROLLUP_TABLES = {'hourly': 'rollup_hourly', 'daily': 'rollup_daily'}
+
+ROLLUP_FIELDS = ('start', 'samples', 'battery_count', 'battery_min',
+                 'battery_max', 'battery_sum', 'ah_charge', 'ah_load',
+                 'alarms', 'errors')
+
+# rows copied per query when salvaging a damaged database; probes for
+# readable rows in an unreadable region go no finer than SALVAGE_SKIP
+# seconds apart and stop after SALVAGE_PROBES
+SALVAGE_CHUNK = 1000
+SALVAGE_SKIP = 60
+SALVAGE_PROBES = 1 << 16
+SALVAGE_FORWARD = ('SELECT * FROM samples WHERE ts >= ? AND ts <= ? '
+                   'ORDER BY ts LIMIT ?')
+SALVAGE_BACKWARD = ('SELECT * FROM samples WHERE ts >= ? AND ts < ? '
+                    'ORDER BY ts DESC LIMIT ?')
+
+
+def open_store(path):
+    """Open the solar log store in given directory
+
+    If the store does not exist yet but an old ``solar.csv`` does, the
+    CSV's readings are imported into the new store (the CSV itself is
+    left in place).
+
+    """
+    filename = os.path.join(path, DB_NAME)
+    legacy = os.path.join(path, LEGACY_CSV_NAME)
+    is_new = not os.path.exists(filename)
+    store = SolarStore(filename)
+    if is_new and os.path.exists(legacy):
+        imported, skipped = store.import_csv(legacy)
+        log.info('Imported %d readings from %s (%d damaged rows skipped)',
+                 imported, legacy, skipped)
+    return store
+
+
+def read_latest(path):
+    """Most recent reading in the store in given directory
+
+    A lightweight read for the display: the database is opened read
+    only, with no schema setup, health check or CSV import, and is not
+    created if missing.
+
+    Returns:
+        dict: the reading, or None if there is no store or it is empty
+        or unreadable
+
+    """
+    filename = os.path.join(path, DB_NAME)
+    if not os.path.exists(filename):
+        return None
+    try:
+        conn = sqlite3.connect(f'file:{filename}?mode=ro', uri=True)
+        try:
+            row = conn.execute(
+                'SELECT * FROM samples ORDER BY ts DESC LIMIT 1').fetchone()
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as error:
+        log.warning('Could not read solar log %s: %s', filename, error)
+        return None
+    return None if row is None else SolarStore._from_row(row)
+
+
+class SolarStore:
+    """SQLite-backed log of SunSaver readings
+
+    Readings are dicts as returned by mppt.take_reading(): a 'Time'
+    datetime plus numeric values keyed by solar log field name.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the database file
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.conn = None
+        try:
+            self.conn = self._connect()
+            healthy = self._healthy()
+        except sqlite3.DatabaseError as error:
+            log.error('Solar log %s is damaged: %s', filename, error)
+            healthy = False
+        if not healthy:
+            self._salvage()
+        if self._rollups_missing():
+            self.rebuild_rollups()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.filename, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # in WAL mode NORMAL only risks losing the last transactions on
+        # power loss, never corrupting the database, and saves an fsync
+        # per commit
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(SCHEMA)
+        for table in ROLLUP_TABLES.values():
+            conn.execute(ROLLUP_SCHEMA.format(table=table))
+        conn.commit()
+        return conn
+
+    def close(self):
+        """Close the database, folding the WAL back into it"""
+        self.conn.close()
+
+    def append(self, readings):
+        """Add readings to the log in a single transaction
+
+        The hourly and daily rollups are updated in the same
+        transaction. A reading with the same time (to the second) as
+        one already stored is ignored.
+
+        """
+        names = ', '.join(['ts'] + [column for _, column in COLUMNS])
+        marks = ', '.join('?' * (len(COLUMNS) + 1))
+        insert = f'INSERT OR IGNORE INTO samples ({names}) VALUES ({marks})'
+        with self.conn:
+            for reading in readings:
+                cursor = self.conn.execute(insert, self._to_row(reading))
+                if cursor.rowcount:
+                    self._add_to_rollups(reading)
+
+    def rollups(self, period, start=None, end=None):
+        """Iterate over hourly or daily summaries
+
+        Args:
+            period (str): 'hourly' or 'daily'
+            start (datetime): earliest period start to include, or None
+            end (datetime): period start to stop before, or None
+
+        Yields:
+            dict: 'start' of the period as a datetime, number of
+            'samples', battery voltage 'battery_min', 'battery_max'
+            and 'battery_mean' (None if no good readings), daily
+            amp-hour totals 'ah_charge' and 'ah_load' at the end of the
+            period, and counts of 'alarms' and read 'errors'
+
+        """
+        low = -2**63 if start is None else int(start.timestamp())
+        high = 2**63 - 1 if end is None else int(end.timestamp())
+        cursor = self.conn.execute(
+            f'SELECT * FROM {ROLLUP_TABLES[period]} '
+            'WHERE start >= ? AND start < ? ORDER BY start', (low, high))
+        for row in cursor:
+            summary = dict(zip(ROLLUP_FIELDS, row))
+            summary['start'] = datetime.fromtimestamp(summary['start'])
+            count = summary.pop('battery_count')
+            total = summary.pop('battery_sum')
+            summary['battery_mean'] = total / count if count else None
+            yield summary
+
+    def battery_range(self, since):
+        """Lowest and highest battery voltage logged since given time
+
+        Uses the hourly rollups, so the answer covers whole hours: the
+        hour containing ``since`` is included in full.
+
+        Returns:
+            tuple: (minimum, maximum), each None if there are no good
+            readings in the range
+
+        """
+        hour = since.replace(minute=0, second=0, microsecond=0)
+        return self.conn.execute(
+            'SELECT min(battery_min), max(battery_max) FROM rollup_hourly '
+            'WHERE start >= ?', (int(hour.timestamp()),)).fetchone()
+
+    def rebuild_rollups(self):
+        """Recompute the rollup tables from the stored readings"""
+        log.info('Building solar log rollups from stored readings')
+        with self.conn:
+            for table in ROLLUP_TABLES.values():
+                self.conn.execute(f'DELETE FROM {table}')
+            for row in self.conn.execute(
+                    'SELECT * FROM samples ORDER BY ts').fetchall():
+                self._add_to_rollups(self._from_row(row))
+
+    def latest(self):
+        """Most recent reading, or None if the log is empty"""
+        cursor = self.conn.execute(
+            'SELECT * FROM samples ORDER BY ts DESC LIMIT 1')
+        row = cursor.fetchone()
+        return None if row is None else self._from_row(row)
+
+    def between(self, start=None, end=None):
+        """Iterate over readings with start <= time < end
+
+        Args:
+            start (datetime): earliest time to include, or None
+            end (datetime): time to stop before, or None
+
+        """
+        low = -2**63 if start is None else int(start.timestamp())
+        high = 2**63 - 1 if end is None else int(end.timestamp())
+        cursor = self.conn.execute(
+            'SELECT * FROM samples WHERE ts >= ? AND ts < ? ORDER BY ts',
+            (low, high))
+        for row in cursor:
+            yield self._from_row(row)
+
+    def count(self):
+        """Number of readings in the log"""
+        return self.conn.execute('SELECT COUNT(*) FROM samples').fetchone()[0]
+
+    def export_csv(self, csv_file, start=None, end=None):
+        """Write readings in the solar.csv format
+
+        Args:
+            csv_file: text file object opened with newline=''
+            start (datetime): earliest time to include, or None
+            end (datetime): time to stop before, or None
+
+        """
+        rows = (mppt.reading_to_row(reading)
+                for reading in self.between(start, end))
+        mppt.append_solar_rows(rows, csv_file)
+
+    def import_csv(self, filename):
+        """Import readings from a solar.csv file
+
+        Rows damaged by power loss (NUL padding, truncated lines,
+        unparseable values) are skipped rather than aborting the
+        import.
+
+        Returns:
+            tuple: number of rows imported and number skipped
+
+        """
+        readings = []
+        skipped = 0
+        with open(filename, newline='', encoding='utf8',
+                  errors='replace') as csv_file:
+            for row in csv.DictReader(csv_file):
+                reading = _reading_from_csv_row(row)
+                if reading is None:
+                    skipped += 1
+                else:
+                    readings.append(reading)
+        self.append(readings)
+        return len(readings), skipped
+
+    def _add_to_rollups(self, reading):
+        voltage = reading['Battery_Voltage']
+        alarm = reading['Alarm']
+        values = (1 if voltage is not None else 0,
+                  voltage,
+                  voltage,
+                  voltage or 0.0,
+                  reading['Ah_Charge'],
+                  reading['Ah_Load'],
+                  1 if alarm else 0,
+                  0 if reading['MPPT_Error'] == 'N/A' else 1)
+        hour = reading['Time'].replace(minute=0, second=0, microsecond=0)
+        day = hour.replace(hour=0)
+        for table, start in ((ROLLUP_TABLES['hourly'], hour),
+                             (ROLLUP_TABLES['daily'], day)):
+            self.conn.execute(ROLLUP_UPSERT.format(table=table),
+                              (int(start.timestamp()),) + values)
+
+    def _rollups_missing(self):
+        has_samples = self.conn.execute(
+            'SELECT 1 FROM samples LIMIT 1').fetchone()
+        has_rollups = self.conn.execute(
+            'SELECT 1 FROM rollup_daily LIMIT 1').fetchone()
+        return has_samples is not None and has_rollups is None
+
+    def _healthy(self):
+        try:
+            result = self.conn.execute(
+                'PRAGMA quick_check(1)').fetchone()[0]
+        except sqlite3.DatabaseError as error:
+            result = str(error)
+        if result != 'ok':
+            log.error('Solar log %s is damaged: %s', self.filename, result)
+            return False
+        return True
+
+    def _salvage(self):
+        """Move damaged database aside and copy readable rows out
+
+        Rows are read back in key order a chunk at a time, halving the
+        chunk when a read fails so every row before a damaged page is
+        kept. The keys the scan could not reach make a gap, bounded by
+        the first and last keys (or hourly rollups) of the log, in
+        which a readable key is looked for by bisection. Rows are then
+        read down from that key and on from it, leaving smaller gaps
+        either side of any further damage. So a damaged page only
+        loses the readings on it, wherever it is.
+
+        """
+        if self.conn is not None:
+            self.conn.close()
+        damaged = f'{self.filename}.damaged-{int(time.time())}'
+        os.replace(self.filename, damaged)
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(self.filename + suffix):
+                os.replace(self.filename + suffix, damaged + suffix)
+        self.conn = self._connect()
+
+        old = sqlite3.connect(damaged)
+        first, last = _salvage_bounds(old)
+        gaps = [(first, last)]
+        recovered = lost = 0
+        while gaps:
+            low, high = gaps.pop()
+            resume = _probe(old, low, high)
+            if resume is None:
+                lost += 1
+                continue
+            top = resume
+            while True:
+                rows = _read_rows(old, SALVAGE_BACKWARD, (low, top))
+                if rows is None:
+                    gaps.append((low, top - 1))
+                if not rows:
+                    break
+                recovered += self._copy_rows(rows)
+                top = rows[-1][0]
+            position = resume
+            while True:
+                rows = _read_rows(old, SALVAGE_FORWARD, (position, high))
+                if rows is None:
+                    gaps.append((position, high))
+                if not rows:
+                    break
+                recovered += self._copy_rows(rows)
+                position = rows[-1][0] + 1
+        old.close()
+        log.warning('Recovered %d readings from damaged solar log '
+                    '(%d unreadable regions skipped); original kept as %s',
+                    recovered, lost, damaged)
+
+    def _copy_rows(self, rows):
+        marks = ', '.join('?' * (len(COLUMNS) + 1))
+        with self.conn:
+            self.conn.executemany(
+                f'INSERT OR REPLACE INTO samples VALUES ({marks})', rows)
+        return len(rows)
+
+    @staticmethod
+    def _to_row(reading):
+        return ([int(reading['Time'].timestamp())]
+                + [reading[key] for key, _ in COLUMNS])
+
+    @staticmethod
+    def _from_row(row):
+        reading = {'Time': datetime.fromtimestamp(row[0])}
+        for (key, _), value in zip(COLUMNS, row[1:]):
+            reading[key] = value
+        return reading
+
+
+def _salvage_bounds(conn):
+    """First and last keys of a damaged database, as near as known
+
+    Taken from the readings if their first and last pages can be read,
+    else from the hourly rollups, else the widest plausible range.
+
+    """
+    def value(query):
+        try:
+            return conn.execute(query).fetchone()[0]
+        except sqlite3.DatabaseError:
+            return None
+
+    hourly = ROLLUP_TABLES['hourly']
+    first = value('SELECT min(ts) FROM samples')
+    if first is None:
+        first = value(f'SELECT min(start) FROM {hourly}') or 0
+    last = value('SELECT max(ts) FROM samples')
+    if last is None:
+        last = value(f'SELECT max(start) + 3599 FROM {hourly}')
+    if last is None:
+        last = int(time.time()) + 365 * 86400
+    return first, last
+
+
+def _read_rows(conn, query, params, limit=SALVAGE_CHUNK):
+    """Rows of a salvage query, None if not even one can be read
+
+    The query's last parameter is the row limit, which is halved on
+    each failed read, so a damaged page further on does not stop the
+    rows before it from being read.
+
+    """
+    while True:
+        try:
+            return conn.execute(query, params + (limit,)).fetchall()
+        except sqlite3.DatabaseError:
+            if limit == 1:
+                return None
+            limit //= 2
+
+
+def _probe(conn, low, high):
+    """A key in low to high from which reading works, None if none
+
+    Tries low, then points bisecting the range ever more finely, until
+    they are SALVAGE_SKIP seconds apart or SALVAGE_PROBES have been
+    tried.
+
+    """
+    def readable(key):
+        return _read_rows(conn, SALVAGE_FORWARD, (key, high), 1) is not None
+
+    if low > high:
+        return None
+    if readable(low):
+        return low
+    parts = 2
+    while (high - low) >= SALVAGE_SKIP * parts and parts <= SALVAGE_PROBES:
+        for part in range(1, parts, 2):
+            key = low + (high - low) * part // parts
+            if readable(key):
+                return key
+        parts *= 2
+    return None
+
+
+def _reading_from_csv_row(row):
+    """Convert a row of the legacy CSV to a reading, None if damaged"""
+    if None in row or any(value is None or '\x00' in value
+                          for value in row.values()):
+        return None
+    try:
+        reading = {'Time': datetime.strptime(row['Date'] + row['Time'],
+                                             '%Y-%m-%d%Hh%Mm%Ss')}
+        for key, _ in COLUMNS[:-2]:
+            value = row[key]
+            reading[key] = None if value == 'N/A' else float(value)
+        alarm = row['Alarm']
+        reading['Alarm'] = (None if alarm == 'N/A'
+                            else mppt.alarm_list.index(alarm))
+    except (KeyError, ValueError):
+        return None
+    reading['MPPT_Error'] = row['MPPT_Error']
+    return reading
+
+
+def _parse_date(text):
+    return datetime.fromisoformat(text)
+
+
+def main():
+    """Command line access to the solar log store"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export = subparsers.add_parser('export', help='write readings as CSV')
+    export.add_argument('solar_dir', help='directory holding solar.db')
+    export.add_argument('-o', '--output',
+                        help='CSV file to write (default: stdout)')
+    export.add_argument('--start', type=_parse_date,
+                        help='first date/time to include (ISO format)')
+    export.add_argument('--end', type=_parse_date,
+                        help='date/time to stop before (ISO format)')
+
+    importer = subparsers.add_parser('import',
+                                     help='add readings from a solar.csv')
+    importer.add_argument('solar_dir', help='directory holding solar.db')
+    importer.add_argument('csv_file', help='solar.csv file to import')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    store = open_store(args.solar_dir)
+    try:
+        if args.command == 'export':
+            if args.output:
+                with open(args.output, 'w', newline='',
+                          encoding='utf8') as csv_file:
+                    store.export_csv(csv_file, args.start, args.end)
+            else:
+                store.export_csv(sys.stdout, args.start, args.end)
+        else:
+            imported, skipped = store.import_csv(args.csv_file)
+            print(f"Imported {imported} readings, skipped {skipped}")
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
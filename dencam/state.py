@@ -0,0 +1,114 @@
+"""Thread-safe state shared between DenCam's threads
+
+State that several threads read and change (whether the recorder is
+recording, which UI page is showing, and so on) lives in a StateStore.
+Reads and writes take a lock, read-modify-write changes such as
+toggles are atomic with update(), and code that needs to react to a
+change subscribes to it instead of polling. Subscribers are called on
+the thread that made the change, after the lock is released, so they
+should be quick (e.g. put something on a queue or set an Event).
+
+"""
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class StateStore:
+    """Named values with change notification
+
+    Parameters
+    ----------
+    **initial
+        Initial values
+
+    """
+
+    def __init__(self, **initial):
+        self._values = dict(initial)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._subscribers = []
+
+    def get(self, key):
+        """Current value of key"""
+        with self._lock:
+            return self._values[key]
+
+    def snapshot(self):
+        """Copy of all values"""
+        with self._lock:
+            return dict(self._values)
+
+    def set(self, key, value):
+        """Set key to value, notifying subscribers if it changed
+
+        Returns:
+            bool: whether the value changed
+
+        """
+        return self.update(key, lambda _: value)[1]
+
+    def update(self, key, function):
+        """Atomically replace the value of key with function(value)
+
+        Returns:
+            tuple: (new value, whether it changed)
+
+        """
+        with self._lock:
+            old = self._values.get(key)
+            new = function(old)
+            changed = new != old
+            if changed:
+                self._values[key] = new
+                self._changed.notify_all()
+            subscribers = list(self._subscribers) if changed else []
+        for subscribed_key, callback in subscribers:
+            if subscribed_key is None or subscribed_key == key:
+                try:
+                    callback(key, old, new)
+                except Exception:  # pylint: disable=broad-except
+                    log.exception('State subscriber for %s failed', key)
+        return new, changed
+
+    def subscribe(self, callback, key=None):
+        """Call callback(key, old, new) when key (or any key) changes
+
+        Returns:
+            callable: cancels the subscription
+
+        """
+        entry = (key, callback)
+        with self._lock:
+            self._subscribers.append(entry)
+
+        def unsubscribe():
+            with self._lock:
+                if entry in self._subscribers:
+                    self._subscribers.remove(entry)
+        return unsubscribe
+
+    def wait_for(self, predicate, timeout=None):
+        """Block until predicate(values) is true
+
+        Returns:
+            bool: the predicate's last result, False on timeout
+
+        """
+        with self._changed:
+            return self._changed.wait_for(
+                lambda: predicate(self._values), timeout)
+
+
+def stored(key, doc=None):
+    """Property kept in the instance's StateStore, self.store"""
+
+    def getter(self):
+        return self.store.get(key)
+
+    def setter(self, value):
+        self.store.set(key, value)
+
+    return property(getter, setter, doc=doc)
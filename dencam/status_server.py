@@ -0,0 +1,252 @@
+"""HTTP status endpoint for DenCam
+
+An optional, small HTTP server run in the DenCam process so a laptop on
+the unit's network can see what the unit is doing without looking at
+the PiTFT screen:
+
+    curl http://<dencam>:8080/status
+
+The server runs an asyncio event loop on its own thread, or on the
+asyncio runtime's loop (see runtime.py) through serve(). A status
+request only reads attributes already held in memory by the recorder,
+controller and solar poller; free space on the drives is refreshed by
+a background task every DRIVE_REFRESH seconds rather than per request,
+so requests never touch the camera or the disk.
+
+Other modules can add endpoints with StatusServer.add_route().
+
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from threading import Event, Thread
+
+from dencam import __version__
+from dencam.segments import media_drives
+
+log = logging.getLogger(__name__)
+
+DRIVE_REFRESH = 30  # seconds
+REQUEST_TIMEOUT = 5  # seconds
+MAX_HEADER_LINES = 50
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 503: 'Service Unavailable'}
+
+
+def free_space(paths):
+    """Free gigabytes on each path, None where it cannot be read"""
+    space = {}
+    for path in paths:
+        try:
+            statvfs = os.statvfs(path)
+            space[path] = round(statvfs.f_frsize * statvfs.f_bavail / 1e9, 3)
+        except OSError:
+            space[path] = None
+    return space
+
+
+class StatusServer(Thread):
+    """Serves a JSON snapshot of DenCam's state over HTTP
+
+    Parameters
+    ----------
+    configs : dict
+        DenCam configuration. Uses STATUS_PORT and the optional
+        STATUS_HOST (default all interfaces), MEDIA_DIR and HOME_DIR.
+    recorder : Recorder
+        Recorder whose state is reported
+    controller : Controller
+        Optional; source of loop timings and the recording profile
+    solar_poller : SolarPoller
+        Optional; source of the last SunSaver reading
+    button_handler : ButtonHandler
+        Optional; source of button latency
+
+    Attributes
+    ----------
+    requests : int
+        Number of requests served
+    address : tuple
+        (host, port) the server is listening on, once ready is set
+
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, configs, recorder, controller=None,
+                 solar_poller=None, button_handler=None):
+        super().__init__(name='StatusServer', daemon=True)
+        self.host = configs.get('STATUS_HOST', '0.0.0.0')
+        self.port = configs['STATUS_PORT']
+        self.media_dirs = (configs.get('MEDIA_DIR'), configs.get('HOME_DIR'))
+        self.recorder = recorder
+        self.controller = controller
+        self.solar_poller = solar_poller
+        self.button_handler = button_handler
+        self.drives = {}
+        self.drives_updated = None
+        self.requests = 0
+        self.started = time.time()
+        self.address = None
+        self.loop = None
+        self.ready = Event()
+        self._stopping = None
+        self._routes = {'/': self.handle_status,
+                        '/status': self.handle_status}
+
+    def add_route(self, path, handler):
+        """Serve GET requests for path with coroutine handler
+
+        The handler is called as ``await handler(reader, writer)`` once
+        the request headers have been read, runs on the server's event
+        loop and is responsible for writing the whole response.
+
+        """
+        self._routes[path] = handler
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self._serve())
+        except OSError as error:
+            log.error('Status server could not start on port %s: %s',
+                      self.port, error)
+        finally:
+            self.loop.close()
+
+    async def serve(self, refresh_drives=True):
+        """Serve on the running event loop until cancelled
+
+        Used instead of starting the thread. With refresh_drives False
+        the caller keeps drives and drives_updated up to date.
+
+        """
+        self.loop = asyncio.get_running_loop()
+        await self._serve(refresh_drives)
+
+    def stop(self):
+        """Stop serving; safe to call from any thread"""
+        if self.ready.is_set() and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self._stopping.set)
+
+    async def _serve(self, refresh_drives=True):
+        self._stopping = asyncio.Event()
+        server = await asyncio.start_server(self._handle, self.host,
+                                            self.port)
+        self.address = server.sockets[0].getsockname()[:2]
+        log.info('Status server listening on %s:%s', *self.address)
+        refresher = None
+        if refresh_drives:
+            refresher = asyncio.ensure_future(self._refresh_drives())
+        self.ready.set()
+        try:
+            async with server:
+                await self._stopping.wait()
+        finally:
+            if refresher is not None:
+                refresher.cancel()
+
+    async def _refresh_drives(self):
+        while True:
+            drives = await self.loop.run_in_executor(
+                None, lambda: free_space(media_drives(*self.media_dirs)))
+            self.drives = drives
+            self.drives_updated = time.time()
+            await asyncio.sleep(DRIVE_REFRESH)
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(),
+                                             REQUEST_TIMEOUT)
+            for _ in range(MAX_HEADER_LINES):
+                line = await asyncio.wait_for(reader.readline(),
+                                              REQUEST_TIMEOUT)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            parts = request.decode('latin-1').split()
+            if len(parts) != 3:
+                await self.respond(writer, 400, {'error': 'bad request'})
+                return
+            method, target, _ = parts
+            path = target.split('?', 1)[0]
+            handler = self._routes.get(path)
+            if handler is None:
+                await self.respond(writer, 404, {'error': 'not found'})
+            elif method != 'GET':
+                await self.respond(writer, 405, {'error': 'GET only'})
+            else:
+                self.requests += 1
+                await handler(reader, writer)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Status server request failed')
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer, status, body,
+                      content_type='application/json'):
+        """Write a complete HTTP response
+
+        Args:
+            writer (asyncio.StreamWriter): connection to respond on
+            status (int): HTTP status code
+            body: bytes, or an object to send as JSON
+            content_type (str): Content-Type of a bytes body
+
+        """
+        if not isinstance(body, bytes):
+            body = json.dumps(body, default=str, indent=1).encode()
+            content_type = 'application/json'
+        head = (f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                'Cache-Control: no-store\r\n'
+                'Connection: close\r\n\r\n')
+        writer.write(head.encode() + body)
+        await writer.drain()
+
+    async def handle_status(self, reader, writer):
+        """Respond with the JSON status snapshot"""
+        # pylint: disable=unused-argument
+        await self.respond(writer, 200, self.snapshot())
+
+    def snapshot(self):
+        """Current status as a dict, built from in-memory state only"""
+        now = time.time()
+        recorder = self.recorder
+        status = {
+            'version': __version__,
+            'time': round(now, 1),
+            'uptime': round(now - self.started, 1),
+            'recorder': {
+                'recording': recorder.recording,
+                'initial_pause_complete': recorder.initial_pause_complete,
+                'segments': getattr(recorder, 'vid_count', None),
+                'path': recorder.video_path,
+                'file': getattr(recorder, 'filename', None),
+                'segment_elapsed': (round(now - recorder.record_start_time,
+                                          1)
+                                    if recorder.recording else None),
+            },
+            'drives': self.drives,
+            'drives_updated': self.drives_updated,
+            'solar': None,
+            'loop': None,
+            'requests': self.requests,
+        }
+        if self.controller is not None:
+            status['loop'] = getattr(self.controller, 'loop_stats', None)
+            profile = getattr(self.controller, 'profile', None)
+            status['recorder']['profile'] = (profile['name']
+                                             if profile else None)
+        if self.button_handler is not None:
+            status['button_latency'] = self.button_handler.last_latency
+        if self.solar_poller is not None:
+            reading = self.solar_poller.latest
+            if reading is not None:
+                status['solar'] = dict(reading)
+        return status
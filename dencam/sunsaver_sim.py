@@ -0,0 +1,166 @@
+"""Simulated SunSaver charge controller
+
+Serves Modbus RTU register reads on a pseudo-terminal so that the
+SunSaver client code can be exercised, and its timing measured,
+without the charge controller or a USB serial adapter attached. The
+simulator paces its replies as they would be paced on the wire at the
+SunSaver's 9600 baud, 8 data bits, 2 stop bits.
+
+Run on its own it prints the port to point DenCam at:
+
+    python -m dencam.sunsaver_sim
+
+"""
+import logging
+import os
+import select
+import struct
+import threading
+import time
+import tty
+
+log = logging.getLogger(__name__)
+
+# start bit + 8 data bits + 2 stop bits
+BITS_PER_CHAR = 11
+
+# register values representing a healthy system in daytime: 12.8 V
+# battery, 17.5 V array, 2.5 A charging, 0.4 A load
+DEFAULT_REGISTERS = {8: 4194, 9: 5734, 10: 4190, 11: 1035, 12: 166,
+                     13: 0, 14: 0, 15: 21, 16: 19, 17: 5,
+                     45: 128, 46: 47, 47: 0, 48: 0, 49: 0, 50: 0}
+
+
+def crc16(data):
+    """Modbus RTU CRC of given bytes"""
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+    return struct.pack('<H', crc)
+
+
+class SunSaverSimulator:
+    """Modbus RTU slave answering register reads on a pty
+
+    Parameters
+    ----------
+    registers : dict
+        Register address to 16 bit value. Unlisted registers read 0.
+    slave_address : int
+        Modbus address to answer to
+    baudrate : int
+        Line rate used to pace requests and replies. None disables
+        pacing.
+    turnaround : float
+        Seconds the simulated device takes to start replying
+
+    Attributes
+    ----------
+    port : str
+        Device path to open as the SunSaver's serial port
+    transactions : int
+        Number of requests answered so far
+    responding : bool
+        Set False to simulate the SunSaver being switched off
+
+    """
+
+    def __init__(self, registers=None, slave_address=1, baudrate=9600,
+                 turnaround=0.005):
+        self.registers = dict(DEFAULT_REGISTERS)
+        if registers:
+            self.registers.update(registers)
+        self.slave_address = slave_address
+        self.baudrate = baudrate
+        self.turnaround = turnaround
+        self.transactions = 0
+        self.responding = True
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start answering requests on a background thread"""
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop answering and close the pty"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _char_time(self, count):
+        if not self.baudrate:
+            return 0
+        return count * BITS_PER_CHAR / self.baudrate
+
+    def _serve(self):
+        buffer = b''
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._master], [], [], 0.1)
+            if not ready:
+                # an inter-frame silence ends any partial frame
+                buffer = b''
+                continue
+            buffer += os.read(self._master, 256)
+            while len(buffer) >= 8:
+                frame, buffer = buffer[:8], buffer[8:]
+                reply = self._respond(frame)
+                if reply is not None:
+                    time.sleep(self._char_time(len(frame))
+                               + self.turnaround
+                               + self._char_time(len(reply)))
+                    os.write(self._master, reply)
+
+    def _respond(self, frame):
+        if frame[-2:] != crc16(frame[:-2]):
+            log.debug('Dropping frame with bad CRC: %s', frame.hex())
+            return None
+        address, function, first, count = struct.unpack('>BBHH', frame[:6])
+        if address != self.slave_address or not self.responding:
+            return None
+        self.transactions += 1
+        if function not in (3, 4):
+            body = struct.pack('>BBB', address, function | 0x80, 1)
+        elif not 1 <= count <= 125:
+            body = struct.pack('>BBB', address, function | 0x80, 3)
+        else:
+            values = [self.registers.get(first + offset, 0) & 0xFFFF
+                      for offset in range(count)]
+            body = struct.pack(f'>BBB{count}H', address, function,
+                               2 * count, *values)
+        return body + crc16(body)
+
+
+def main():
+    """Run a simulator until interrupted"""
+    logging.basicConfig(level=logging.DEBUG)
+    with SunSaverSimulator() as simulator:
+        print(f"Simulated SunSaver on {simulator.port}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Rate limiting of disk and network transfers
+
+Offloading copies and catalog checksumming read recorded segments while
+DenCam may still be recording to the same drive. Both pass every block
+they move through a Throttle, so a cap on the rate keeps them from
+starving the recording.
+
+"""
+import threading
+import time
+
+
+class Throttle:
+    """Token bucket shared by all threads of a transfer to cap its rate
+
+    Parameters
+    ----------
+    rate : float
+        Bytes per second, or None for no limit
+
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._allowance = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, size):
+        """Block until size bytes may be transferred"""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            # at most one second's worth of burst
+            self._allowance = min(self.rate, self._allowance
+                                  + (now - self._last) * self.rate)
+            self._last = now
+            self._allowance -= size
+            wait = -self._allowance / self.rate
+        if wait > 0:
+            time.sleep(wait)
@@ -0,0 +1,257 @@
+"""Keyframe thumbnails and daily contact sheets of recorded segments
+
+Rather than decoding whole segments, this seeks to a few evenly spaced
+points in each .h264 file, reads forward to the next keyframe (IDR
+access unit, see h264.py) and has ffmpeg decode only those frames, so
+a five minute segment costs a handful of frame decodes and a few
+megabytes of reading. Each segment gets a row of thumbnails, and each
+day a contact sheet of all its segments' rows labelled with their
+start times. Segments already done are recorded in a manifest
+(thumbnails-manifest.jsonl), so rerunning on an archive that has
+grown only processes the new files and redraws the sheets of the
+days they belong to. Needs ffmpeg and Pillow.
+
+Usage:
+    dencam-thumbnails /media/pi/A /media/pi/B
+    dencam-thumbnails /data/unit3/A /data/unit3/B --output-dir /data/unit3/review
+
+"""
+import argparse
+import os
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image, ImageDraw
+
+from dencam import h264
+from dencam.segments import group_by_output, Manifest
+
+MANIFEST_NAME = 'thumbnails-manifest.jsonl'
+THUMBNAIL_DIR = 'thumbnails'
+LABEL_WIDTH = 90
+
+
+def read_ppm_frames(data):
+    """Split the output of ffmpeg's ppm image2pipe into PIL images"""
+    images = []
+    position = 0
+    while position < len(data):
+        fields = []
+        while len(fields) < 4:
+            while data[position:position + 1].isspace():
+                position += 1
+            end = position
+            while end < len(data) and not data[end:end + 1].isspace():
+                end += 1
+                if end - position > 10:
+                    raise OSError('unexpected output from ffmpeg')
+            fields.append(data[position:end])
+            position = end
+        position += 1  # single whitespace before the pixels
+        try:
+            width, height = int(fields[1]), int(fields[2])
+        except ValueError as error:
+            raise OSError('unexpected output from ffmpeg') from error
+        size = width * height * 3
+        if fields[0] != b'P6' or position + size > len(data):
+            raise OSError('unexpected output from ffmpeg')
+        images.append(Image.frombytes('RGB', (width, height),
+                                      data[position:position + size]))
+        position += size
+    return images
+
+
+def decode_keyframes(header, frames, video_filter):
+    """Decode keyframes read with h264.keyframe_after() with ffmpeg
+
+    Args:
+        header (bytes): the stream's parameter sets, from
+            h264.parameter_sets()
+        frames (list): bytes of each keyframe's access unit
+        video_filter (str): ffmpeg -vf filter graph, e.g. for scaling
+
+    Returns:
+        list: PIL images, in order
+
+    """
+    result = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error',
+         '-f', 'h264', '-i', 'pipe:0', '-vsync', '0',
+         '-vf', video_filter, '-f', 'image2pipe', '-c:v', 'ppm', 'pipe:1'],
+        input=header + b''.join(frames), stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, check=False)
+    if result.returncode != 0:
+        message = result.stderr.decode(errors='replace').strip()
+        raise OSError(message.splitlines()[-1] if message
+                      else f'ffmpeg exited with {result.returncode}')
+    return read_ppm_frames(result.stdout)
+
+
+def segment_thumbnails(path, count, width):
+    """Decode up to count evenly spaced keyframes of a segment
+
+    Returns:
+        list: PIL images, in order
+    """
+    size = os.path.getsize(path)
+    frames = {}
+    with open(path, 'rb') as video:
+        header = h264.parameter_sets(video)
+        for number in range(count):
+            found = h264.keyframe_after(video, size * number // count)
+            if found is not None:
+                frames[found[0]] = found[1]
+    if not frames:
+        return []
+    return decode_keyframes(header,
+                            [frames[offset] for offset in sorted(frames)],
+                            f'scale={width}:-2')
+
+
+def make_thumbnails(path, directory, stem, count, width):
+    """Write a segment's thumbnails as <directory>/<stem>_<n>.jpg
+
+    Runs in a worker process.
+
+    Returns:
+        list: file names written
+    """
+    os.makedirs(directory, exist_ok=True)
+    names = []
+    for number, image in enumerate(segment_thumbnails(path, count, width)):
+        name = f'{stem}_{number}.jpg'
+        image.save(os.path.join(directory, name), quality=80)
+        names.append(name)
+    return names
+
+
+def contact_sheet(rows, width, count):
+    """Draw a contact sheet
+
+    Args:
+        rows (list): (label, list of thumbnail paths) for each segment
+        width (int): thumbnail width
+        count (int): thumbnails per row
+
+    Returns:
+        PIL.Image.Image
+    """
+    height = 0
+    for _, paths in rows:
+        if paths:
+            with Image.open(paths[0]) as first:
+                height = first.height
+            break
+    height = height or width * 9 // 16
+    sheet = Image.new('RGB', (LABEL_WIDTH + width * count,
+                              height * len(rows)), 'black')
+    draw = ImageDraw.Draw(sheet)
+    for row, (label, paths) in enumerate(rows):
+        top = row * height
+        draw.text((4, top + 4), label, fill='white')
+        for column, path in enumerate(paths):
+            with Image.open(path) as thumbnail:
+                sheet.paste(thumbnail, (LABEL_WIDTH + column * width, top))
+    return sheet
+
+
+def build(roots, output_dir=None, count=4, width=240, workers=None,
+          min_age=60, force=False):
+    """Make thumbnails for new segments, then redraw their days' sheets
+
+    Contact sheets are written as <top>/contact-<date>.jpg, where top
+    is the directory the manifest is in.
+
+    Returns:
+        tuple: (segments done, segments failed)
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    done = failed = 0
+    started = time.monotonic()
+    with ProcessPoolExecutor(workers) as pool:
+        groups = group_by_output(roots, THUMBNAIL_DIR, output_dir, min_age)
+        for top, items in groups.items():
+            os.makedirs(top, exist_ok=True)
+            manifest = Manifest(os.path.join(top, MANIFEST_NAME))
+            futures = {}
+            for segment, relpath in items:
+                key = os.path.join(relpath, segment.name)
+                if not force and manifest.done(key, segment.size,
+                                               segment.mtime):
+                    continue
+                stem = os.path.splitext(segment.name)[0]
+                future = pool.submit(make_thumbnails, segment.path,
+                                     os.path.join(top, relpath), stem,
+                                     count, width)
+                futures[future] = (segment, relpath, key)
+            changed_days = set()
+            for future in as_completed(futures):
+                segment, relpath, key = futures[future]
+                try:
+                    names = future.result()
+                except OSError as error:
+                    failed += 1
+                    print(f'FAILED {segment.path}: {error}')
+                    continue
+                done += 1
+                manifest.add(key, segment.size, segment.mtime,
+                             thumbnails=[os.path.join(relpath, name)
+                                         for name in names],
+                             start=segment.start_time.isoformat())
+                changed_days.add(segment.date)
+                print(f'[{done + failed}/{len(futures)}] {segment.path}: '
+                      f'{len(names)} thumbnails')
+            for day in sorted(changed_days):
+                write_sheet(top, manifest, day, count, width)
+    elapsed = time.monotonic() - started
+    print(f'{done} segments done, {failed} failed in {elapsed:.1f} s')
+    return done, failed
+
+
+def write_sheet(top, manifest, day, count, width):
+    """Redraw the contact sheet of one day from the manifest"""
+    entries = sorted((entry for entry in manifest.entries.values()
+                      if entry.get('start', '').startswith(day)),
+                     key=lambda entry: entry['start'])
+    rows = [(entry['start'][11:19],
+             [os.path.join(top, path) for path in entry['thumbnails']
+              if os.path.exists(os.path.join(top, path))])
+            for entry in entries]
+    sheet = contact_sheet(rows, width, count)
+    path = os.path.join(top, f'contact-{day}.jpg')
+    sheet.save(path, quality=85)
+    print(f'Wrote {path} ({len(rows)} segments)')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Make keyframe thumbnails and daily contact sheets '
+        'of DenCam recordings.')
+    parser.add_argument('roots', nargs='+',
+                        help='drives or date directories')
+    parser.add_argument('--output-dir',
+                        help='write thumbnails and sheets here instead of '
+                        f'in {THUMBNAIL_DIR}/ on each drive')
+    parser.add_argument('--count', type=int, default=4,
+                        help='thumbnails per segment (default: 4)')
+    parser.add_argument('--width', type=int, default=240,
+                        help='thumbnail width in pixels (default: 240)')
+    parser.add_argument('--jobs', type=int,
+                        help='segments processed at once '
+                        '(default: one per core)')
+    parser.add_argument('--min-age', type=float, default=60,
+                        help='skip segments modified in the last this many '
+                        'seconds (default: 60)')
+    parser.add_argument('--force', action='store_true',
+                        help='redo segments already in the manifest')
+    args = parser.parse_args()
+
+    _, failed = build(args.roots, args.output_dir, args.count, args.width,
+                      args.jobs, args.min_age, args.force)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""Time-lapse of a whole deployment from keyframes
+
+Takes one frame every --interval minutes of real time across all the
+segments found, placing each segment on the timeline by the start time
+in its file name. For each sample time it picks the segment recording
+at that moment, estimates the byte offset of that moment from the
+segment's length, and decodes only the next keyframe after it (see
+h264.keyframe_after()), so months of footage reduce to a few thousand
+single-frame decodes. Times with no footage are shown as a card giving
+the length of the gap. Each frame is stamped with its date and time.
+
+Reading keyframes, decoding them (one ffmpeg per core) and encoding the
+result run as a pipeline: a reader thread feeds a bounded queue of
+decodes in progress, and the main thread takes finished frames from it
+in order and streams them to a single x264 encoder.
+
+Usage:
+    dencam-timelapse /media/pi/A /media/pi/B -o deployment.mp4 --interval 10
+    dencam-timelapse /data/unit3/A --start 2024-03-01 --end 2024-04-01 -o march.mp4
+
+"""
+import argparse
+import bisect
+import math
+import os
+import queue
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from PIL import Image, ImageDraw
+
+from dencam import h264
+from dencam.segments import find_segments, segment_end
+from dencam.thumbnails import decode_keyframes
+
+# frames the card marking a gap in the footage is shown for
+GAP_FRAMES = 12
+
+
+class Timeline:
+    """Segments from any number of drives placed on one time axis
+
+    Parameters
+    ----------
+    segments : iterable
+        Segments, in any order
+
+    """
+
+    def __init__(self, segments):
+        by_drive = {}
+        for segment in segments:
+            by_drive.setdefault(segment.drive, []).append(segment)
+        spans = []
+        for drive_segments in by_drive.values():
+            drive_segments.sort(key=lambda segment: segment.start_time)
+            for segment, later in zip(drive_segments,
+                                      drive_segments[1:] + [None]):
+                following = (later.start_time.timestamp()
+                             if later is not None else None)
+                spans.append((segment.start_time.timestamp(),
+                              segment_end(segment, following), segment))
+        spans.sort(key=lambda span: span[0])
+        known = sorted(end - start for start, end, _ in spans
+                       if end is not None)
+        # length assumed for segments whose end cannot be estimated
+        typical = known[len(known) // 2] if known else 300
+        self.spans = [(start, end if end is not None else start + typical,
+                       segment) for start, end, segment in spans]
+        self.starts = [span[0] for span in self.spans]
+
+    @property
+    def first(self):
+        """Start of the first segment"""
+        return self.starts[0] if self.starts else None
+
+    @property
+    def last(self):
+        """End of the last segment"""
+        return max(end for _, end, _ in self.spans) if self.spans else None
+
+    def at(self, moment):
+        """Segment being recorded at a time, with the byte offset of it
+
+        Returns:
+            tuple: (Segment, offset), or None if nothing was recording
+
+        """
+        index = bisect.bisect_right(self.starts, moment) - 1
+        # segments can overlap when several drives are given
+        for start, end, segment in reversed(self.spans[max(0, index - 3):
+                                                       index + 1]):
+            if start <= moment < end:
+                fraction = (moment - start) / (end - start)
+                return segment, int(segment.size * fraction)
+        return None
+
+
+def read_keyframe(segment, offset, headers):
+    """Keyframe of a segment at or after offset, with parameter sets
+
+    headers caches each segment's parameter sets by path.
+
+    Returns:
+        tuple: (parameter sets, keyframe bytes), or None
+
+    """
+    with open(segment.path, 'rb') as video:
+        if segment.path not in headers:
+            headers.clear()
+            headers[segment.path] = h264.parameter_sets(video)
+        found = h264.keyframe_after(video, offset)
+        if found is None and offset:
+            # too near the end for another keyframe; take the last one
+            # before it instead
+            found = h264.keyframe_before(video, offset)
+    if found is None:
+        return None
+    return headers[segment.path], found[1]
+
+
+def produce(timeline, times, pool, video_filter, work):
+    """Queue a decode, or a gap, for each sample time; runs in a thread
+
+    Puts (time, future) for frames, ('gap', (from, to)) for each run
+    of times with no footage, and None at the end.
+
+    """
+    headers = {}
+    gap_start = None
+    try:
+        for moment in times:
+            found = timeline.at(moment)
+            keyframe = None
+            if found is not None:
+                try:
+                    keyframe = read_keyframe(*found, headers)
+                except OSError:
+                    keyframe = None
+            if keyframe is None:
+                if gap_start is None:
+                    gap_start = moment
+                continue
+            if gap_start is not None:
+                work.put(('gap', (gap_start, moment)))
+                gap_start = None
+            header, frame = keyframe
+            work.put((moment, pool.submit(decode_keyframes, header, [frame],
+                                          video_filter)))
+        if gap_start is not None:
+            work.put(('gap', (gap_start, times[-1])))
+    finally:
+        work.put(None)
+
+
+def stamp(image, text):
+    """Write text in the top left corner of an image"""
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 8 + 7 * len(text), 20), fill='black')
+    draw.text((4, 4), text, fill='white')
+    return image
+
+
+def gap_card(size, start, end):
+    """Black frame saying there is no footage between two times"""
+    card = Image.new('RGB', size, 'black')
+    hours = (end - start) / 3600
+    text = (f'no footage {datetime.fromtimestamp(start):%Y-%m-%d %H:%M} '
+            f'to {datetime.fromtimestamp(end):%Y-%m-%d %H:%M} '
+            f'({hours:.1f} h)')
+    ImageDraw.Draw(card).text((size[0] // 2 - 3 * len(text), size[1] // 2),
+                              text, fill='white')
+    return card
+
+
+def make_timelapse(roots, output, interval=10, fps=24, size=(1280, 720),
+                   start=None, end=None, workers=None):
+    """Write a time-lapse of the segments under roots
+
+    Args:
+        roots (list): drives or date directories
+        output (str): .mp4 file to write
+        interval (float): minutes of real time between frames
+        fps (float): frame rate of the time-lapse
+        size (tuple): width and height of the time-lapse
+        start, end (float): Unix times to limit it to
+        workers (int): keyframes decoded at once; default one per core
+
+    Returns:
+        tuple: (frames from footage, gaps)
+
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    timeline = Timeline(find_segments(roots, 0))
+    if timeline.first is None:
+        raise ValueError('no segments found')
+    start = max(start or timeline.first, timeline.first)
+    end = min(end or timeline.last, timeline.last)
+    step = interval * 60
+    times = [start + number * step
+             for number in range(math.ceil((end - start) / step))]
+    width, height = size
+    video_filter = (f'scale={width}:{height}:force_original_aspect_ratio='
+                    f'decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2')
+    encoder = subprocess.Popen(
+        ['ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+         '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}',
+         '-r', str(fps), '-i', 'pipe:0', '-c:v', 'libx264',
+         '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p',
+         '-movflags', '+faststart', output],
+        stdin=subprocess.PIPE)
+    workers = workers or os.cpu_count() or 1
+    work = queue.Queue(maxsize=2 * workers)
+    frames = gaps = failed = 0
+    started = time.monotonic()
+    print(f'{len(times)} samples from {datetime.fromtimestamp(start)} to '
+          f'{datetime.fromtimestamp(end)}')
+    with ThreadPoolExecutor(workers) as pool:
+        producer = threading.Thread(
+            target=produce, args=(timeline, times, pool, video_filter, work),
+            daemon=True)
+        producer.start()
+        try:
+            for item in iter(work.get, None):
+                moment, result = item
+                if moment == 'gap':
+                    gaps += 1
+                    encoder.stdin.write(gap_card(size, *result).tobytes()
+                                        * GAP_FRAMES)
+                    continue
+                try:
+                    image = result.result()[0]
+                except (OSError, IndexError):
+                    failed += 1
+                    continue
+                label = f'{datetime.fromtimestamp(moment):%Y-%m-%d %H:%M}'
+                encoder.stdin.write(stamp(image, label).tobytes())
+                frames += 1
+                if frames % 100 == 0:
+                    elapsed = time.monotonic() - started
+                    print(f'{frames} frames, {frames / elapsed:.1f} per s')
+        finally:
+            encoder.stdin.close()
+            encoder.wait()
+    if encoder.returncode != 0:
+        raise OSError(f'ffmpeg exited with {encoder.returncode}')
+    print(f'Wrote {output}: {frames} frames, {gaps} gaps, {failed} '
+          f'unreadable, in {time.monotonic() - started:.0f} s')
+    return frames, gaps
+
+
+def _parse_date(text):
+    return datetime.fromisoformat(text).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Make a time-lapse of a DenCam deployment from '
+        'keyframes.')
+    parser.add_argument('roots', nargs='+',
+                        help='drives or date directories')
+    parser.add_argument('-o', '--output', required=True,
+                        help='.mp4 file to write')
+    parser.add_argument('--interval', type=float, default=10,
+                        help='minutes between frames (default: 10)')
+    parser.add_argument('--fps', type=float, default=24,
+                        help='frame rate of the time-lapse (default: 24)')
+    parser.add_argument('--size', default='1280x720',
+                        help='WIDTHxHEIGHT of the time-lapse '
+                        '(default: 1280x720)')
+    parser.add_argument('--start', type=_parse_date,
+                        help='e.g. 2024-03-01 or "2024-03-01 06:00"')
+    parser.add_argument('--end', type=_parse_date)
+    parser.add_argument('--jobs', type=int,
+                        help='keyframes decoded at once '
+                        '(default: one per core)')
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.size.split('x'))
+    try:
+        make_timelapse(args.roots, args.output, args.interval, args.fps,
+                       (width - width % 2, height - height % 2), args.start,
+                       args.end, args.jobs)
+    except (OSError, ValueError) as error:
+        raise SystemExit(f'Failed: {error}') from error
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+"""Batch conversion of recorded segments from raw H.264 to MP4
+
+Converts every segment under the given drives or date directories with
+ffmpeg, several at once (one job per CPU core by default). By default
+the H.264 stream is copied into the MP4 unchanged with timestamps from
+the frame rate or the segment's .pts file (remux), which is many times
+faster than re-encoding and loses no quality; --mode encode re-encodes
+with x264 instead. --verify compares frame counts of source and
+output with ffprobe before accepting an output. Each output
+is written under a temporary name and renamed into place only when
+ffmpeg succeeds, so an interrupted run never leaves a truncated .mp4
+that looks finished. Finished jobs are recorded in a manifest
+(transcode-manifest.jsonl at the top of each drive, or of the output
+directory) which is what a rerun uses to decide what is left to do.
+
+Usage:
+    dencam-transcode /media/pi/A /media/pi/B --fps 25
+    dencam-transcode /media/pi/A/2024-03-01 --output-dir /data/unit3
+    dencam-transcode /media/pi/A/2024-03-01/2024-03-01_10h00m00s.h264
+
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import yaml
+
+from dencam.segments import find_segments, segment_from_path, Manifest
+
+MANIFEST_NAME = 'transcode-manifest.jsonl'
+PART_SUFFIX = '.part'
+
+
+class Job:
+    """Conversion of one segment
+
+    Parameters
+    ----------
+    segment : Segment
+        Source segment
+    output : str
+        Path of the .mp4 to write
+    manifest : Manifest
+        Manifest the job is recorded in when done
+    relpath : str
+        Key of the job in its manifest
+
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, segment, output, manifest, relpath):
+        self.segment = segment
+        self.output = output
+        self.manifest = manifest
+        self.relpath = relpath
+
+    def done(self):
+        """Whether this exact source was already converted"""
+        return (self.manifest.done(self.relpath, self.segment.size,
+                                   self.segment.mtime)
+                and os.path.exists(self.output))
+
+
+def encode_command(segment, output, fps, options):
+    """ffmpeg command re-encoding a segment with libx264
+
+    Returns:
+        tuple: (list of commands to run in turn, list of intermediate
+        files to delete afterwards)
+
+    """
+    return [['ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error',
+             '-y', '-r', str(fps), '-i', segment.path,
+             '-c:v', 'libx264', '-preset', options['preset'],
+             '-crf', str(options['crf']),
+             '-threads', str(options['threads']),
+             '-an', '-map_metadata', '0', '-movflags', '+faststart',
+             '-f', 'mp4', output]], []
+
+
+def remux_command(segment, output, fps, options):
+    """Commands copying a segment's H.264 stream into MP4 unchanged
+
+    Frames are given timestamps from the segment's .pts file where there
+    is one (via mkvmerge, which reads that format), and otherwise at a
+    constant fps: the average rate in the .pts file if there is one
+    but no mkvmerge, else the recorded frame rate.
+
+    """
+    copy = ['ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error',
+            '-y']
+    tail = ['-c:v', 'copy', '-an', '-movflags', '+faststart', '-f', 'mp4',
+            output]
+    pts = [path for path in segment.sidecars() if path.endswith('.pts')]
+    if pts and options.get('mkvmerge'):
+        timed = output + '.mkv.tmp'
+        return [['mkvmerge', '--quiet', '-o', timed,
+                 '--timestamps', f'0:{pts[0]}', segment.path],
+                copy + ['-i', timed] + tail], [timed]
+    if pts:
+        fps = pts_frame_rate(pts[0]) or fps
+    return [copy + ['-fflags', '+genpts', '-r', str(fps),
+                    '-i', segment.path] + tail], []
+
+
+COMMANDS = {'remux': remux_command, 'encode': encode_command}
+
+
+def pts_frame_rate(path):
+    """Average frame rate of a picamera2 .pts file, None if unusable"""
+    first = last = None
+    count = 0
+    with open(path, encoding='utf8') as pts_file:
+        for line in pts_file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                stamp = float(line)
+            except ValueError:
+                continue
+            first = stamp if first is None else first
+            last = stamp
+            count += 1
+    if count < 2 or last <= first:
+        return None
+    return round(1000 * (count - 1) / (last - first), 3)
+
+
+def count_frames(path):
+    """Number of video frames in a file according to ffprobe"""
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+         '-count_packets', '-show_entries', 'stream=nb_read_packets',
+         '-of', 'csv=p=0', path],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False)
+    try:
+        return int(result.stdout.decode().strip().rstrip(','))
+    except ValueError:
+        return None
+
+
+def run_job(source, output, commands, temporaries=(), verify=False):
+    """Run commands that write output + PART_SUFFIX from source
+
+    Runs in a worker process. On success (and, if verify is set, when
+    the output has as many frames as the source) the temporary file is
+    renamed to output and given the source's modification time. A
+    command that cannot be run at all (e.g. ffmpeg is not installed)
+    fails the job like one that exits with an error.
+
+    Returns:
+        tuple: (error message or None, seconds taken)
+
+    """
+    started = time.monotonic()
+    part = output + PART_SUFFIX
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    error = None
+    try:
+        for command in commands:
+            result = subprocess.run(command, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.PIPE, check=False)
+            if result.returncode != 0:
+                message = result.stderr.decode(errors='replace').strip()
+                error = (message.splitlines()[-1] if message else
+                         f'{command[0]} exited with {result.returncode}')
+                break
+        if error is None and verify:
+            expected, actual = count_frames(source), count_frames(part)
+            if expected is None or expected != actual:
+                error = (f'frame count mismatch: {expected} in source, '
+                         f'{actual} in output')
+    except OSError as exc:
+        error = f'cannot run {exc.filename or "command"}: {exc.strerror}'
+    finally:
+        for path in temporaries:
+            if os.path.exists(path):
+                os.remove(path)
+    elapsed = time.monotonic() - started
+    if error is not None:
+        if os.path.exists(part):
+            os.remove(part)
+        return error, elapsed
+    stat = os.stat(source)
+    os.utime(part, (stat.st_atime, stat.st_mtime))
+    os.replace(part, output)
+    return None, elapsed
+
+
+def plan(paths, output_dir=None, min_age=60):
+    """Make jobs for all segments in paths
+
+    Args:
+        paths (list): drives, date directories or .h264 files
+        output_dir (str): write outputs under this directory, as
+            <drive name>/<date>/<name>.mp4; default is beside the source
+        min_age (float): skip segments modified this recently
+
+    Returns:
+        list: Job for every segment found
+
+    """
+    files = [path for path in paths if path.endswith('.h264')]
+    roots = [path for path in paths if not path.endswith('.h264')]
+    segments = list(find_segments(roots, min_age)) if roots else []
+    segments += [segment for segment in map(segment_from_path, files)
+                 if segment is not None]
+
+    manifests = {}
+    jobs = []
+    for segment in segments:
+        stem = os.path.splitext(segment.name)[0]
+        drive_name = os.path.basename(segment.drive.rstrip(os.sep))
+        if output_dir:
+            top = output_dir
+            relpath = os.path.join(drive_name, segment.date, stem + '.mp4')
+        else:
+            top = segment.drive
+            relpath = os.path.join(segment.date, stem + '.mp4')
+        if top not in manifests:
+            manifests[top] = Manifest(os.path.join(top, MANIFEST_NAME))
+        jobs.append(Job(segment, os.path.join(top, relpath),
+                        manifests[top], relpath))
+    return jobs
+
+
+def transcode(jobs, fps, workers=None, command=remux_command,
+              options=None, verify=False):
+    """Run jobs in a process pool, printing throughput and ETA
+
+    Args:
+        jobs (list): Jobs to run
+        fps (float): frame rate the segments were recorded at
+        workers (int): parallel jobs; default one per core
+        command (callable): builds the commands for a job as
+            command(segment, output, fps, options), see encode_command
+        options (dict): passed to command
+        verify (bool): check the output has as many frames as the source
+
+    Returns:
+        tuple: (jobs done, jobs failed)
+
+    """
+    workers = workers or os.cpu_count() or 1
+    total = sum(job.segment.size for job in jobs)
+    done_bytes = 0
+    done = failed = 0
+    started = time.monotonic()
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {}
+        for job in jobs:
+            commands, temporaries = command(job.segment,
+                                            job.output + PART_SUFFIX,
+                                            fps, options or {})
+            futures[pool.submit(run_job, job.segment.path, job.output,
+                                commands, temporaries, verify)] = job
+        for future in as_completed(futures):
+            job = futures[future]
+            error, elapsed = future.result()
+            done_bytes += job.segment.size
+            if error is None:
+                done += 1
+                job.manifest.add(job.relpath, job.segment.size,
+                                 job.segment.mtime,
+                                 output=os.path.basename(job.output),
+                                 seconds=round(elapsed, 2))
+                status = 'done'
+            else:
+                failed += 1
+                status = f'FAILED ({error})'
+            wall = time.monotonic() - started
+            rate = done_bytes / wall if wall else 0
+            eta = (total - done_bytes) / rate if rate else 0
+            print(f'[{done + failed}/{len(jobs)}] {job.segment.name} '
+                  f'{status} in {elapsed:.1f} s | '
+                  f'{rate / 1e6:.1f} MB/s, ETA {eta / 60:.1f} min')
+    return done, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert DenCam .h264 segments to .mp4.')
+    parser.add_argument('paths', nargs='+',
+                        help='drives, date directories or .h264 files')
+    parser.add_argument('--output-dir',
+                        help='write .mp4 files here instead of beside '
+                        'the originals')
+    parser.add_argument('--fps', type=float,
+                        help='frame rate the videos were recorded at '
+                        '(default: FRAME_RATE from --config, else 25)')
+    parser.add_argument('--config', help='DenCam config file')
+    parser.add_argument('--jobs', type=int,
+                        help='parallel conversions (default: one per core)')
+    parser.add_argument('--mode', choices=list(COMMANDS), default='remux',
+                        help='remux: copy the video stream into MP4 '
+                        'unchanged (fast, lossless); encode: re-encode '
+                        'with x264 (default: remux)')
+    parser.add_argument('--verify', action='store_true',
+                        help='check each output has as many frames as its '
+                        'source (needs ffprobe)')
+    parser.add_argument('--preset', default='veryfast',
+                        help='x264 preset for --mode encode '
+                        '(default: veryfast)')
+    parser.add_argument('--crf', type=int, default=23,
+                        help='x264 quality for --mode encode, lower is '
+                        'better (default: 23)')
+    parser.add_argument('--min-age', type=float, default=60,
+                        help='skip segments modified in the last this many '
+                        'seconds (default: 60)')
+    parser.add_argument('--force', action='store_true',
+                        help='redo segments already in the manifest')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='list what would be converted and stop')
+    args = parser.parse_args()
+
+    fps = args.fps
+    if fps is None and args.config:
+        with open(args.config, encoding='utf8') as config_file:
+            fps = yaml.load(config_file,
+                            Loader=yaml.SafeLoader).get('FRAME_RATE')
+    fps = fps or 25
+
+    jobs = plan(args.paths, args.output_dir, args.min_age)
+    todo = [job for job in jobs if args.force or not job.done()]
+    size = sum(job.segment.size for job in todo)
+    print(f'{len(jobs)} segments found, {len(todo)} to {args.mode} '
+          f'({size / 1e9:.2f} GB) at {fps} fps')
+    if args.dry_run:
+        for job in todo:
+            print(f'{job.segment.path} -> {job.output}')
+        return
+
+    workers = args.jobs or os.cpu_count() or 1
+    options = {'preset': args.preset, 'crf': args.crf,
+               'threads': max(1, (os.cpu_count() or 1) // workers),
+               'mkvmerge': shutil.which('mkvmerge')}
+    done, failed = transcode(todo, fps, workers, COMMANDS[args.mode],
+                             options, args.verify)
+    print(f'Converted {done} segments, {failed} failed')
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -19,11 +19,18 @@ import yaml
 
 # pylint: disable=import-self
 from dencam import __version__
+from dencam import metrics
 from dencam.logs import setup_logger
+from dencam.actions import ActionExecutor
 from dencam.buttons import ButtonHandler
 from dencam.recorder_picamera2 import Picamera2Recorder
 from dencam.gui import ErrorScreen, Controller, State
 from dencam.networking import AirplaneMode
+from dencam.solar_poller import SolarPoller
+from dencam.governor import PowerGovernor
+from dencam.status_server import StatusServer
+from dencam.runtime import Runtime
+from dencam.live_preview import LivePreview
 
 log = setup_logger(logging.INFO)
 
@@ -44,6 +51,8 @@ def main():
     with open(args.config_file, 'r', encoding='utf8') as config_file:
         configs = yaml.load(config_file, Loader=yaml.SafeLoader)
     log.info('Ingested configuration settings')
+    metrics.start(configs)
+    metrics.emit('startup', version=__version__)
 
     flags = {'stop_buttons_flag': False}
     state_list = ['OffPage',
@@ -51,6 +60,7 @@ def main():
                   'RecordingPage',
                   "SolarPage",
                   "BlankPage"]
+    solar_poller = None
 
     try:
         checking_camera = True
@@ -61,6 +71,7 @@ def main():
                 checking_camera = False
             except IndexError as cam_error:
                 log.warning(cam_error)
+                metrics.emit('camera_error', error=str(cam_error))
                 if error_screen is None:
                     error_screen = ErrorScreen()
                 time.sleep(.5)
@@ -70,26 +81,49 @@ def main():
         number_of_states = len(state_list)
         state = State(number_of_states)
         airplane_mode = AirplaneMode(configs)
+        executor = ActionExecutor()
+
+        if configs.get('SOLAR_POLL_INTERVAL'):
+            solar_poller = SolarPoller(configs)
+
         button_handler = ButtonHandler(recorder,
                                        state,
                                        state_list,
                                        airplane_mode,
-                                       lambda: flags['stop_buttons_flag'])
-        button_handler.daemon = True
-        button_handler.start()
+                                       lambda: flags['stop_buttons_flag'],
+                                       executor=executor,
+                                       solar_poller=solar_poller)
+
+        governor = None
+        if configs.get('POWER_GOVERNOR'):
+            governor = PowerGovernor(configs)
 
         controller = Controller(configs, recorder, state_list,
-                                state, airplane_mode)
+                                state, airplane_mode, solar_poller,
+                                governor)
+        executor.add_listener(controller.action_completed)
         controller.daemon = True
-        controller.start()
 
-        while True:
-            time.sleep(.1)
+        status_server = None
+        if configs.get('STATUS_PORT'):
+            status_server = StatusServer(configs, recorder, controller,
+                                         solar_poller, button_handler)
+            if configs.get('LIVE_PREVIEW'):
+                LivePreview(configs,
+                            recorder.camera.capture_lores).register(
+                                status_server)
+
+        # buttons, segment scheduling, solar polling and the status
+        # server run on the runtime's event loop until SIGINT or SIGTERM
+        runtime = Runtime(configs, recorder, controller, button_handler,
+                          solar_poller, status_server)
+        controller.start()
+        runtime.run()
 
     except KeyboardInterrupt:
         log.info('Keyboard interrupt received.')
-        flags['stop_buttons_flag'] = True
-        time.sleep(.1)
+    finally:
+        metrics.stop()
 
 
 if __name__ == "__main__":
@@ -53,5 +53,14 @@ setuptools.setup(
         'Operating System :: POSIX :: Linux',
         'Topic :: Scientific/Engineering',
     ],
-    entry_points={"console_scripts": ["dencam=dencam.__main__:main"]},
+    entry_points={"console_scripts": [
+        "dencam=dencam.__main__:main",
+        "dencam-offload=dencam.offload:main",
+        "dencam-transcode=dencam.transcode:main",
+        "dencam-check=dencam.h264:main",
+        "dencam-thumbnails=dencam.thumbnails:main",
+        "dencam-activity=dencam.activity:main",
+        "dencam-reclaim=dencam.reclaim:main",
+        "dencam-timelapse=dencam.timelapse:main",
+    ]},
 )
@@ -0,0 +1,65 @@
+"""Plot a deployment's activity as a date by time-of-day heatmap.
+
+Reads the per-second motion timelines written by dencam-activity and
+averages them into bins of a few minutes, one row per day, so that
+periods of activity stand out and can be looked up in the footage.
+Times with no footage are left blank.
+
+Usage:
+    python utilities/activity_heatmap.py /media/pi/A/activity /media/pi/B/activity
+    python utilities/activity_heatmap.py /data/unit3/review --bin 5 -o activity.png
+
+"""
+import argparse
+
+import matplotlib
+import numpy as np
+
+from dencam.activity import heatmap
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Plot DenCam activity by date and time of day.')
+    parser.add_argument('directories', nargs='+',
+                        help='directories holding activity-manifest.jsonl')
+    parser.add_argument('--bin', type=int, default=10,
+                        help='minutes per column (default: 10)')
+    parser.add_argument('--log', action='store_true',
+                        help='log colour scale, to show faint activity')
+    parser.add_argument('-o', '--output',
+                        help='save to this file instead of showing')
+    args = parser.parse_args()
+
+    if args.output:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+
+    dates, matrix = heatmap(args.directories, args.bin)
+    if not dates:
+        raise SystemExit('No activity timelines found')
+    if args.log:
+        matrix = np.log10(matrix + 1e-3)
+
+    fig, axis = plt.subplots(figsize=(12, max(3, len(dates) * 0.12 + 1.5)))
+    image = axis.imshow(np.ma.masked_invalid(matrix), aspect='auto',
+                        interpolation='nearest', cmap='magma',
+                        extent=(0, 24, len(dates), 0))
+    axis.set_xticks(range(0, 25, 2))
+    axis.set_xlabel('Time of day (hours)')
+    step = max(1, len(dates) // 20)
+    axis.set_yticks([row + 0.5 for row in range(0, len(dates), step)])
+    axis.set_yticklabels([dates[row].isoformat()
+                          for row in range(0, len(dates), step)])
+    fig.colorbar(image, ax=axis,
+                 label='log10 motion energy' if args.log else 'motion energy')
+    axis.set_title(f'Activity, {dates[0]} to {dates[-1]}')
+    fig.tight_layout()
+    if args.output:
+        fig.savefig(args.output, dpi=120)
+    else:
+        plt.show()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Exercise the status server against localhost.
+
+Starts a StatusServer on a free local port, backed by a stand-in
+recorder rather than the camera, checks that /status returns the
+expected JSON and then times a burst of concurrent requests. Reports
+request latency and how much the process's memory grew, to show the
+server's footprint is small enough to leave enabled.
+
+Usage:
+    python utilities/bench_status_server.py [--requests N] [--clients N]
+
+"""
+import argparse
+import json
+import resource
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from dencam.status_server import StatusServer
+
+
+def fetch(url):
+    """GET url, returning (seconds taken, decoded JSON body)"""
+    started = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=5) as response:
+        body = json.loads(response.read())
+    return time.perf_counter() - started, body
+
+
+def max_rss_kb():
+    """Peak resident memory of this process in kilobytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=8)
+    args = parser.parse_args()
+
+    recorder = SimpleNamespace(recording=True, initial_pause_complete=True,
+                               vid_count=42, video_path='/media/pi/A',
+                               filename='/media/pi/A/2024-03-01/x.h264',
+                               record_start_time=time.time() - 60)
+    controller = SimpleNamespace(loop_stats={'mean': 0.002, 'max': 0.03,
+                                             'ticks': 600},
+                                 profile={'name': 'full'})
+
+    rss_before = max_rss_kb()
+    server = StatusServer({'STATUS_PORT': 0, 'STATUS_HOST': '127.0.0.1'},
+                          recorder, controller=controller)
+    # port 0 lets the OS pick a free port
+    server.start()
+    server.ready.wait(5)
+    port = server.address[1]
+    url = f'http://127.0.0.1:{port}/status'
+
+    _, body = fetch(url)
+    assert body['recorder']['segments'] == 42, body
+    assert body['loop']['ticks'] == 600, body
+    print('Status snapshot:')
+    print(json.dumps(body, indent=1))
+
+    with ThreadPoolExecutor(args.clients) as pool:
+        started = time.perf_counter()
+        times = [elapsed for elapsed, _ in
+                 pool.map(fetch, [url] * args.requests)]
+        total = time.perf_counter() - started
+
+    times.sort()
+    print(f'{args.requests} requests from {args.clients} clients '
+          f'in {total:.2f} s ({args.requests / total:.0f} req/s)')
+    print(f'latency median {1000 * statistics.median(times):.2f} ms, '
+          f'p99 {1000 * times[int(0.99 * len(times))]:.2f} ms')
+    print(f'peak memory (server and test clients) grew '
+          f'{max_rss_kb() - rss_before} kB')
+    server.stop()
+    server.join(5)
+
+
+if __name__ == '__main__':
+    main()
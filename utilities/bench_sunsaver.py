@@ -0,0 +1,62 @@
+"""Time SunSaver reads against the simulated charge controller.
+
+Compares the old access pattern (open the port, one Modbus transaction
+per register, close the port) with SunSaverClient's persistent
+connection and block reads, both paced at the SunSaver's 9600 baud.
+
+Usage:
+    python utilities/bench_sunsaver.py [--reads N]
+
+"""
+import argparse
+import time
+
+import minimalmodbus
+
+from dencam.mppt import SunSaverClient
+from dencam.sunsaver_sim import SunSaverSimulator
+
+LOGGED_REGISTERS = (8, 9, 10, 11, 12, 15, 16, 17, 45, 46, 50)
+
+
+def read_per_register(port):
+    """Read the logged registers the way mppt originally did"""
+    sunsaver = minimalmodbus.Instrument(port, 1)
+    sunsaver.serial.baudrate = 9600
+    sunsaver.serial.stopbits = 2
+    values = [sunsaver.read_register(register)
+              for register in LOGGED_REGISTERS]
+    sunsaver.serial.close()
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reads', type=int, default=5,
+                        help='number of full readings per method')
+    args = parser.parse_args()
+
+    with SunSaverSimulator() as simulator:
+        start = time.monotonic()
+        for _ in range(args.reads):
+            read_per_register(simulator.port)
+        per_register = (time.monotonic() - start) / args.reads
+        transactions = simulator.transactions
+
+        client = SunSaverClient(port=simulator.port)
+        start = time.monotonic()
+        for _ in range(args.reads):
+            client.read()
+        bulk = (time.monotonic() - start) / args.reads
+        client.close()
+        transactions = (transactions,
+                        simulator.transactions - transactions)
+
+    print(f"Per-register: {1000 * per_register:.1f} ms/reading "
+          f"({transactions[0] // args.reads} transactions)")
+    print(f"Block reads:  {1000 * bulk:.1f} ms/reading "
+          f"({transactions[1] // args.reads} transactions)")
+
+
+if __name__ == '__main__':
+    main()
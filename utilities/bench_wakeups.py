@@ -0,0 +1,242 @@
+"""Count how often DenCam's background work wakes the CPU.
+
+Runs button handling, segment scheduling and the status server for a
+while with nothing to do but a few button taps, once as separate
+threads (each started on its own, the segment scheduling done in a
+stand-in for the Tk update loop) and once on the asyncio runtime, and
+reports the voluntary context switches of each thread, grouped by
+component. A stand-in for the Tk update loop runs in both, since Tk
+keeps its own thread either way: every UPDATE_PERIOD on its own, and
+every REDRAW_PERIOD plus on each change of state under the runtime.
+Uses FakeGPIO and a stand-in recorder, so no camera or Pi is needed.
+
+Usage:
+    python utilities/bench_wakeups.py [--seconds N] [--record-length N]
+
+"""
+import argparse
+import os
+import re
+import threading
+import time
+
+from dencam import fake_gpio
+from dencam.buttons import ButtonHandler, SCREEN_BUTTON, FUNCTION_BUTTON
+from dencam.gui import State, REDRAW_PERIOD, UPDATE_PERIOD
+from dencam.runtime import Runtime
+from dencam.state import StateStore, stored
+from dencam.status_server import StatusServer
+
+STATE_LIST = ['OffPage', 'NetworkPage', 'RecordingPage',
+              'SolarPage', 'BlankPage']
+
+
+class StubRecorder:
+    """Recorder stand-in keeping the state others read, without a camera"""
+    recording = stored('recording')
+    initial_pause_complete = stored('initial_pause_complete')
+    preview_on = stored('preview_on')
+    zoom_on = stored('zoom_on')
+
+    def __init__(self):
+        self.store = StateStore(recording=False, initial_pause_complete=True,
+                                preview_on=False, zoom_on=False)
+        self.lock = threading.RLock()
+        self.record_start_time = time.time()
+        self.video_path = os.getcwd()
+        self.media_dir = os.getcwd()
+        self.home_dir = os.getcwd()
+        self.vid_count = 0
+
+    def start_recording(self):
+        with self.lock:
+            self.recording = True
+            self.record_start_time = time.time()
+            self.vid_count += 1
+
+    def stop_recording(self):
+        self.recording = False
+
+    def toggle_recording(self):
+        with self.lock:
+            if self.recording:
+                self.stop_recording()
+            else:
+                self.start_recording()
+
+    def toggle_zoom(self):
+        self.zoom_on = not self.zoom_on
+
+    def start_preview(self):
+        self.preview_on = True
+
+    def stop_preview(self):
+        self.preview_on = False
+
+    def get_free_space(self):
+        statvfs = os.statvfs(self.video_path)
+        return statvfs.f_frsize * statvfs.f_bavail / 1e9
+
+
+class StubAirplaneMode:
+    """Airplane mode stand-in that does not touch rfkill"""
+    def __init__(self):
+        self.enabled = False
+
+    def toggle(self):
+        self.enabled = not self.enabled
+
+
+class StubController:
+    """Segment rotation as done by gui.Controller, without Tk"""
+
+    def __init__(self, recorder, record_length):
+        self.recorder = recorder
+        self.record_length = record_length
+        self.standalone = True
+
+    def schedule_segments(self):
+        with self.recorder.lock:
+            elapsed = time.time() - self.recorder.record_start_time
+            if not self.recorder.recording:
+                self.recorder.start_recording()
+            elif elapsed > self.record_length:
+                self.recorder.stop_recording()
+                self.recorder.start_recording()
+
+    def next_deadline(self):
+        if not self.recorder.recording:
+            return None
+        return self.recorder.record_start_time + self.record_length
+
+    def ui_tick(self):
+        """What the Tk loop does every UPDATE_PERIOD apart from drawing"""
+        if self.standalone:
+            self.schedule_segments()
+        self.recorder.get_free_space()
+
+
+def context_switches():
+    """Voluntary context switches of each of this process's threads"""
+    switches = {}
+    for tid in os.listdir('/proc/self/task'):
+        path = f'/proc/self/task/{tid}/status'
+        try:
+            with open(path, encoding='ascii') as status:
+                for line in status:
+                    if line.startswith('voluntary_ctxt_switches'):
+                        switches[int(tid)] = int(line.split()[1])
+        except FileNotFoundError:
+            pass  # thread exited
+    return switches
+
+
+def component(name, mode):
+    """Component a thread belongs to, from its name"""
+    if name == 'MainThread':
+        return 'event loop' if mode == 'runtime' else 'main (idle)'
+    return re.sub(r'[-_]\d+$', '', name)
+
+
+def exercise(gpio, seconds, mode, results):
+    """Tap buttons for a while, counting context switches meanwhile"""
+    time.sleep(1)
+    results['threads'] = threading.active_count()
+    before = context_switches()
+    for count in range(4):
+        time.sleep(seconds / 5)
+        gpio.tap(SCREEN_BUTTON if count % 2 else FUNCTION_BUTTON)
+    time.sleep(seconds / 5)
+    after = context_switches()
+    names = {thread.native_id: thread.name
+             for thread in threading.enumerate()}
+    components = {}
+    for tid, count in after.items():
+        name = component(names.get(tid, 'other'), mode)
+        components[name] = (components.get(name, 0)
+                            + count - before.get(tid, 0))
+    results['components'] = components
+
+
+def run(mode, seconds, record_length):
+    """Run one arrangement
+
+    Returns:
+        dict: context switches by component, the number of threads and,
+        for the runtime, the runtime's own count of event loop wakeups
+
+    """
+    gpio = fake_gpio.FakeGPIO()
+    recorder = StubRecorder()
+    controller = StubController(recorder, record_length)
+    state = State(len(STATE_LIST))
+    handler = ButtonHandler(recorder, state, STATE_LIST, StubAirplaneMode(),
+                            lambda: False, gpio=gpio)
+    server = StatusServer({'STATUS_PORT': 0, 'STATUS_HOST': '127.0.0.1'},
+                          recorder, controller)
+    handler.name = 'ButtonHandler'
+    server.name = 'StatusServer'
+    done = threading.Event()
+    results = {}
+
+    def ui_loop():
+        while not done.is_set():
+            if controller.standalone:
+                time.sleep(UPDATE_PERIOD / 1000)
+            else:
+                redraw.wait(REDRAW_PERIOD / 1000)
+                redraw.clear()
+            controller.ui_tick()
+
+    redraw = threading.Event()
+    state.subscribe(lambda *_: redraw.set())
+    recorder.store.subscribe(lambda *_: redraw.set())
+
+    if mode == 'runtime':
+        runtime = Runtime({}, recorder, controller, handler,
+                          status_server=server)
+    threading.Thread(target=ui_loop, name='Tk stand-in', daemon=True).start()
+    driver = threading.Thread(target=exercise, name='driver (this bench)',
+                              args=(gpio, seconds, mode, results))
+    driver.start()
+    if mode == 'runtime':
+        threading.Thread(target=lambda: (driver.join(), runtime.stop()),
+                         name='stopper (this bench)',
+                         daemon=True).start()
+        runtime.run()
+        results['loop_wakeups'] = runtime.wakeups
+    else:
+        handler.start()
+        server.start()
+        driver.join()
+        handler.stop()
+        handler.join()
+        server.stop()
+        server.join(5)
+    done.set()
+    handler.executor.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=60,
+                        help='length of each run')
+    parser.add_argument('--record-length', type=float, default=20,
+                        help='segment length in seconds')
+    args = parser.parse_args()
+
+    for mode in ('threads', 'runtime'):
+        results = run(mode, args.seconds, args.record_length)
+        components = results['components']
+        total = sum(components.values())
+        print(f"{mode}: {results['threads']} threads, "
+              f"{total / args.seconds:.2f} wakeups/s")
+        for name, count in sorted(components.items()):
+            print(f"  {name:24s} {count / args.seconds:6.2f}/s")
+        if 'loop_wakeups' in results:
+            print(f"  event loop woke {results['loop_wakeups']} times")
+
+
+if __name__ == '__main__':
+    main()
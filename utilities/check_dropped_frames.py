@@ -0,0 +1,105 @@
+"""Check recorded H.264 segments for dropped frames.
+
+Counts the frames in each raw H.264 file written by DenCam and, where
+a .pts timestamp file was written alongside it (WRITE_PTS: True),
+looks for gaps between consecutive frame timestamps longer than 1.5
+frame intervals, which is how frames the encoder never received show
+up. Exits with status 1 if any drops are found.
+
+To check that the live preview (LIVE_PREVIEW) does not affect
+recording, run lesehest with WRITE_PTS set, keep a browser open on
+/preview.mjpg for one segment and closed for the next, then run this
+on both segments and compare.
+
+Usage:
+    python utilities/check_dropped_frames.py /media/pi/A/2024-03-01/*.h264 \
+        [--fps 25]
+
+"""
+import argparse
+import os
+import statistics
+import sys
+
+from dencam.h264 import scan
+
+
+def count_frames(path):
+    """Count complete coded pictures in a raw (Annex B) H.264 file"""
+    return scan(path).frames
+
+
+def read_pts(path):
+    """Frame timestamps in milliseconds from a picamera2 .pts file"""
+    stamps = []
+    with open(path, encoding='utf8') as pts_file:
+        for line in pts_file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                stamps.append(float(line))
+    return stamps
+
+
+def find_gaps(stamps, fps=None):
+    """Find runs of missing frames in a list of timestamps
+
+    Returns:
+        tuple: (frame interval in ms, list of (timestamp, frames
+        missing) for each gap)
+
+    """
+    deltas = [later - earlier for earlier, later in zip(stamps, stamps[1:])]
+    if not deltas:
+        return None, []
+    interval = 1000 / fps if fps else statistics.median(deltas)
+    gaps = []
+    for stamp, delta in zip(stamps, deltas):
+        if delta > 1.5 * interval:
+            gaps.append((stamp, round(delta / interval) - 1))
+    return interval, gaps
+
+
+def check(path, fps=None):
+    """Print a report for one segment; return number of frames dropped"""
+    frames = count_frames(path)
+    pts_path = os.path.splitext(path)[0] + '.pts'
+    if not os.path.exists(pts_path):
+        print(f'{path}: {frames} frames (no .pts file, cannot check '
+              'for drops)')
+        return 0
+
+    stamps = read_pts(pts_path)
+    interval, gaps = find_gaps(stamps, fps)
+    dropped = sum(missing for _, missing in gaps)
+    duration = (stamps[-1] - stamps[0]) / 1000 if stamps else 0
+    print(f'{path}: {frames} frames, {len(stamps)} timestamps over '
+          f'{duration:.1f} s, {dropped} dropped')
+    if frames != len(stamps):
+        print(f'    frame count and timestamp count differ by '
+              f'{abs(frames - len(stamps))}')
+    if interval:
+        print(f'    frame interval {interval:.2f} ms '
+              f'({1000 / interval:.2f} fps)')
+    for stamp, missing in gaps[:20]:
+        print(f'    {missing} frame(s) missing after {stamp / 1000:.3f} s')
+    if len(gaps) > 20:
+        print(f'    ... and {len(gaps) - 20} more gaps')
+    return dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check DenCam H.264 segments for dropped frames.')
+    parser.add_argument('videos', nargs='+', help='.h264 files')
+    parser.add_argument('--fps', type=float,
+                        help='expected frame rate (default: taken from '
+                        'the median timestamp interval)')
+    args = parser.parse_args()
+
+    dropped = sum(check(path, args.fps) for path in args.videos)
+    print(f'Total dropped frames: {dropped}')
+    sys.exit(1 if dropped else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Check that a damaged solar log loses only the readings on bad pages.
+
+Builds a solar log of made-up readings, overwrites one leaf page of
+the readings table with garbage (the first in key order, one in the
+middle and the last, each in a fresh log), opens the log so that
+SolarStore salvages it, and checks that every reading not on the
+damaged page was recovered. Exits with status 1 if any were lost.
+
+Needs an SQLite built with the dbstat table, which Python's usually
+is, to find the pages.
+
+Usage:
+    python utilities/check_solar_salvage.py [--readings 20000]
+
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+
+from dencam import solar_store
+
+START = 1700000000
+INTERVAL = 300
+
+
+def make_log(path, count):
+    """Write count readings, INTERVAL seconds apart, to a new log"""
+    store = solar_store.open_store(path)
+    readings = []
+    for index in range(count):
+        reading = {key: 12.0 + index % 10 / 10
+                   for key, _ in solar_store.COLUMNS}
+        reading['Time'] = datetime.fromtimestamp(START + index * INTERVAL)
+        reading['MPPT_Error'] = 'N/A'
+        readings.append(reading)
+    store.append(readings)
+    store.close()
+
+
+def leaf_pages(filename):
+    """(page number, rows) of the readings table's leaves in key order"""
+    conn = sqlite3.connect(filename)
+    try:
+        return conn.execute(
+            "SELECT pageno, ncell FROM dbstat WHERE name = 'samples' "
+            "AND pagetype = 'leaf' ORDER BY path").fetchall()
+    finally:
+        conn.close()
+
+
+def damage(filename, page):
+    """Overwrite a page of a database file with garbage"""
+    conn = sqlite3.connect(filename)
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    conn.close()
+    with open(filename, 'r+b') as db_file:
+        db_file.seek((page - 1) * page_size)
+        db_file.write(b'\xff' * page_size)
+
+
+def check(count, which):
+    """Damage one leaf and salvage; returns readings lost needlessly"""
+    with tempfile.TemporaryDirectory() as path:
+        make_log(path, count)
+        filename = os.path.join(path, solar_store.DB_NAME)
+        leaves = leaf_pages(filename)
+        page, rows = leaves[{'first': 0, 'middle': len(leaves) // 2,
+                             'last': -1}[which]]
+        damage(filename, page)
+        store = solar_store.open_store(path)
+        recovered = store.count()
+        store.close()
+    expected = count - rows
+    print(f'{which} leaf (page {page}, {rows} readings) damaged: '
+          f'{recovered} of {expected} other readings recovered')
+    return expected - recovered
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--readings', type=int, default=20000,
+                        help='readings in the log')
+    args = parser.parse_args()
+
+    lost = sum(check(args.readings, which)
+               for which in ('first', 'middle', 'last'))
+    sys.exit(1 if lost else 0)
+
+
+if __name__ == '__main__':
+    main()
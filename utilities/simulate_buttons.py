@@ -0,0 +1,96 @@
+"""Exercise DenCam button handling without a Raspberry Pi.
+
+Drives a ButtonHandler with the scriptable FakeGPIO backend, replaying
+a sequence of presses (with contact chatter) and reporting how each
+press was handled and how long it took from edge to action.
+
+Usage:
+    python utilities/simulate_buttons.py [--presses N] [--chatter N]
+
+"""
+import argparse
+import statistics
+import time
+
+from dencam import fake_gpio
+from dencam.buttons import ButtonHandler, SCREEN_BUTTON, FUNCTION_BUTTON
+from dencam.gui import State
+
+
+class StubRecorder:
+    """Recorder stand-in that only keeps the state buttons touch"""
+    def __init__(self):
+        self.initial_pause_complete = True
+        self.recording = False
+        self.preview_on = False
+        self.zoom_on = False
+
+    def toggle_recording(self):
+        self.recording = not self.recording
+
+    def toggle_zoom(self):
+        self.zoom_on = not self.zoom_on
+
+    def start_preview(self):
+        self.preview_on = True
+
+    def stop_preview(self):
+        self.preview_on = False
+
+
+class StubAirplaneMode:
+    """Airplane mode stand-in that does not touch rfkill"""
+    def __init__(self):
+        self.enabled = False
+
+    def toggle(self):
+        self.enabled = not self.enabled
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--presses', type=int, default=20,
+                        help='number of button presses to replay')
+    parser.add_argument('--chatter', type=int, default=3,
+                        help='contact bounces per press')
+    args = parser.parse_args()
+
+    state_list = ['OffPage', 'NetworkPage', 'RecordingPage',
+                  'SolarPage', 'BlankPage']
+    gpio = fake_gpio.FakeGPIO()
+    recorder = StubRecorder()
+    stop = {'flag': False}
+    state = State(len(state_list))
+    handler = ButtonHandler(recorder, state, state_list,
+                            StubAirplaneMode(), lambda: stop['flag'],
+                            gpio=gpio)
+    handler.start()
+
+    latencies = []
+    for count in range(args.presses):
+        # the solar page's function would talk to the charge controller
+        on_solar_page = state.value == state_list.index('SolarPage')
+        pin = SCREEN_BUTTON if count % 2 or on_solar_page else FUNCTION_BUTTON
+        handler.last_latency = None
+        gpio.tap(pin, hold=0.05, chatter=args.chatter)
+        # presses closer together than the bounce time are discarded
+        time.sleep(0.25)
+        if handler.last_latency is not None:
+            latencies.append(handler.last_latency)
+
+    stop['flag'] = True
+    handler.stop()
+    handler.join()
+    handler.executor.shutdown()
+
+    print(f"Presses: {args.presses}  handled: {len(latencies)}")
+    if latencies:
+        print(f"Latency ms: median {1000 * statistics.median(latencies):.3f}"
+              f"  max {1000 * max(latencies):.3f}")
+    for name, samples in handler.executor.latencies.items():
+        print(f"{name}: {len(samples)} run(s), "
+              f"mean {1000 * statistics.mean(samples):.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+"""Soak test DenCam's recording over a simulated deployment.
+
+Runs the recorder (with the simulated camera), the controller's segment
+scheduling and the solar poller against a SimulatedClock, jumping the
+clock from one scheduling deadline to the next as the runtime sleeps
+between them, so that months of a deployment pass in minutes. The
+drives are scratch directories given a modelled capacity: the segment
+files are sparse (see recorder_simulated.py), so they fill the
+modelled drives but not the disk. The solar poller reads the SunSaver
+simulator, and DenCam's log goes to a rotating, size-capped log file
+as in the field.
+
+At the end it reports what the unit would hold on collection: files
+and bytes per drive, day directories, files named for another day than
+their directory, gaps between segments, each drive switch, when
+recording stopped for good (if it did), the size of the logs and the
+solar log, and how the memory of the process grew.
+
+Log rotation by age goes by the real time, so only rotation by size is
+exercised. Needs Linux (memory is read from /proc).
+
+Usage:
+    python utilities/simulate_deployment.py [--days N] [--drives N]
+        [--drive-size GB] [--home-size GB] [--solar-interval S]
+        [--config cfgs/example_config.yaml] [--keep DIR]
+
+"""
+import argparse
+import gc
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import yaml
+
+from dencam import logs
+from dencam import mppt
+from dencam.clock import SimulatedClock
+from dencam.gui import Controller, State
+from dencam.networking import SimulatedAirplaneMode
+from dencam.recorder_simulated import SimulatedRecorder
+from dencam.runtime import SCHEDULE_SLACK
+from dencam.segments import SEGMENT_NAME
+from dencam.solar_poller import SolarPoller
+from dencam.solar_store import DB_NAME
+from dencam.sunsaver_sim import SunSaverSimulator
+
+DAY = 24 * 60 * 60
+STATE_LIST = ['OffPage', 'NetworkPage', 'RecordingPage',
+              'SolarPage', 'BlankPage']
+# gaps between segments longer than this (seconds) are reported
+GAP_THRESHOLD = 1
+
+DEFAULT_CONFIGS = {'RECORD_LENGTH': 300,
+                   'PAUSE_BEFORE_RECORD': 90,
+                   'FILE_SIZE_SAFETY_FACTOR': 2,
+                   'PI_RESERVED_STORAGE': 2000,
+                   'AVG_VIDEO_FILE_SIZE': 1500,
+                   'DISPLAY_RESOLUTION': [640, 480],
+                   'CAMERA_RESOLUTION': [1920, 1080],
+                   'CAMERA_ROTATION': 180,
+                   'VIDEO_QUALITY': 20,
+                   'FRAME_RATE': 25,
+                   'AIRPLANE_MODE': True,
+                   'SOLAR_BATCH_SIZE': 12}
+
+
+class ModelledDrivesRecorder(SimulatedRecorder):
+    """SimulatedRecorder whose drives have a modelled capacity
+
+    The segment files are sparse, so the free space the filesystem
+    reports says nothing about them. Instead each drive's free space is
+    its capacity less the sizes of the segments recorded to it.
+
+    Parameters
+    ----------
+    configs : dict
+        DenCam configuration
+    clock : SimulatedClock
+        Clock to record by
+    capacities : dict
+        Bytes each drive (and the home directory) holds, by path
+
+    """
+
+    def __init__(self, configs, clock, capacities):
+        self.capacities = capacities
+        self.used = dict.fromkeys(capacities, 0)
+        super().__init__(configs, clock)
+
+    def get_free_space(self, media_path=None):
+        if media_path is None and self.video_path is not None:
+            media_path = self.video_path
+        elif media_path is None and self.video_path is None:
+            self.video_path = self.last_known_video_path
+            media_path = self.video_path
+        if media_path not in self.capacities:
+            return 0
+        return (self.capacities[media_path] - self.used[media_path]) / 1e9
+
+    def _stop_recording(self):
+        filename, drive = self.filename, self.video_path
+        super()._stop_recording()
+        if filename is not None:
+            self.used[drive] += os.path.getsize(filename)
+
+
+class SegmentTracker:
+    """Follows the recorder's state to time segments and drive switches"""
+
+    def __init__(self, recorder, clock):
+        self.recorder = recorder
+        self.clock = clock
+        self.segments = 0
+        self.last_stop = None
+        self.drive = None
+        self.switches = []
+        self.gaps = 0
+        self.gap_time = 0
+        self.longest_gap = (0, None)
+        recorder.store.subscribe(self._on_change, key='recording')
+
+    def _on_change(self, _key, _old, recording):
+        now = self.clock.time()
+        if not recording:
+            self.last_stop = now
+            return
+        self.segments += 1
+        if self.last_stop is not None:
+            gap = now - self.last_stop
+            if gap > GAP_THRESHOLD:
+                self.gaps += 1
+                self.gap_time += gap
+                if gap > self.longest_gap[0]:
+                    self.longest_gap = (gap, now)
+        drive = self.recorder.video_path
+        if drive != self.drive:
+            self.switches.append((now, self.drive, drive))
+            self.drive = drive
+
+
+def memory_use():
+    """Resident set size of this process in megabytes"""
+    with open('/proc/self/status', encoding='ascii') as status:
+        for line in status:
+            if line.startswith('VmRSS'):
+                return int(line.split()[1]) / 1000
+    return None
+
+
+def directory_size(path):
+    """Apparent size in bytes of the files under path"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def survey_drive(path):
+    """Segments, bytes and day directories on a drive
+
+    Returns:
+        dict: files, bytes, days and misfiled, the number of segments
+        whose name gives another day than the directory they are in
+
+    """
+    survey = {'files': 0, 'bytes': 0, 'days': 0, 'misfiled': 0}
+    for day in sorted(os.listdir(path)):
+        day_dir = os.path.join(path, day)
+        if not os.path.isdir(day_dir):
+            continue
+        survey['days'] += 1
+        for name in os.listdir(day_dir):
+            if not SEGMENT_NAME.match(name):
+                continue
+            survey['files'] += 1
+            survey['bytes'] += os.path.getsize(os.path.join(day_dir, name))
+            if not name.startswith(day + '_'):
+                survey['misfiled'] += 1
+    return survey
+
+
+def when(clock_start, stamp):
+    """Simulated time as day of the deployment and time of day"""
+    day = int((stamp - clock_start) // DAY)
+    local = time.strftime('%Y-%m-%d %H:%M', time.localtime(stamp))
+    return f"day {day:3d} {local}"
+
+
+def main():
+    # pylint: disable=too-many-locals,too-many-statements
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=float, default=90,
+                        help='length of the deployment')
+    parser.add_argument('--drives', type=int, default=4,
+                        help='number of drives')
+    parser.add_argument('--drive-size', type=float, default=512,
+                        help='capacity of each drive in GB')
+    parser.add_argument('--home-size', type=float, default=16,
+                        help='free space in the home directory in GB')
+    parser.add_argument('--solar-interval', type=float,
+                        help='seconds between SunSaver readings (0 for '
+                        'none); defaults to SOLAR_POLL_INTERVAL or 300')
+    parser.add_argument('--log-size', type=float,
+                        default=logs.MAX_TOTAL_BYTES / 1e6,
+                        help='cap on the log directory in MB')
+    parser.add_argument('--config',
+                        help='DenCam config file to take recording '
+                        'settings from')
+    parser.add_argument('--keep',
+                        help='directory to simulate in and leave behind; '
+                        'a temporary one is used and removed otherwise')
+    args = parser.parse_args()
+
+    configs = dict(DEFAULT_CONFIGS)
+    if args.config:
+        with open(args.config, encoding='utf8') as config_file:
+            configs.update(yaml.load(config_file, Loader=yaml.SafeLoader))
+    solar_interval = args.solar_interval
+    if solar_interval is None:
+        solar_interval = configs.get('SOLAR_POLL_INTERVAL') or 300
+
+    base = args.keep or tempfile.mkdtemp(prefix='dencam_soak_')
+    media_dir = os.path.join(base, 'media')
+    home_dir = os.path.join(base, 'home')
+    log_dir = os.path.join(base, 'logs')
+    drives = [os.path.join(media_dir, chr(ord('A') + index))
+              for index in range(args.drives)]
+    for path in drives + [home_dir, log_dir]:
+        os.makedirs(path, exist_ok=True)
+    capacities = dict.fromkeys(drives, int(args.drive_size * 1e9))
+    capacities[home_dir] = int(args.home_size * 1e9)
+    configs.update({'MEDIA_DIR': media_dir, 'HOME_DIR': home_dir,
+                    'SOLAR_DIR': home_dir, 'SOLAR_POLL_INTERVAL':
+                    solar_interval, 'SIMULATE': True,
+                    'CATALOG_FILE': None, 'METRICS_DIR': None})
+
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    log_handler = logs.CompressingRotatingFileHandler(
+        os.path.join(log_dir, 'soak_dencam.log'), logs.MAX_BYTES,
+        logs.BACKUP_COUNT, logs.MAX_AGE, int(args.log_size * 1e6))
+    log_handler.setFormatter(logging.Formatter(
+        '%(asctime)s | %(levelname)8s | %(name)18s | %(message)s'))
+    logger.addHandler(log_handler)
+
+    clock = SimulatedClock()
+    start = clock.time()
+    end = start + args.days * DAY
+    recorder = ModelledDrivesRecorder(configs, clock, capacities)
+    controller = Controller(configs, recorder, STATE_LIST,
+                            State(len(STATE_LIST)),
+                            SimulatedAirplaneMode(configs), clock=clock)
+    tracker = SegmentTracker(recorder, clock)
+
+    sunsaver = poller = None
+    if solar_interval:
+        sunsaver = SunSaverSimulator(baudrate=None, turnaround=0).start()
+        poller = SolarPoller(configs, mppt.SunSaverClient(sunsaver.port),
+                             clock)
+        poller.open()
+    solar_due = start
+
+    gc.collect()
+    memory = [(start, memory_use(), len(gc.get_objects()))]
+    memory_due = start + DAY
+    started = time.monotonic()
+    print(f"Simulating {args.days:g} days in {base}")
+    while clock.time() < end:
+        controller.schedule_segments()
+        deadline = controller.next_deadline()
+        wake = end
+        if deadline is not None:
+            wake = deadline + SCHEDULE_SLACK
+        if poller is not None:
+            wake = min(wake, solar_due)
+        clock.advance_to(min(wake, memory_due, end))
+
+        if poller is not None and clock.time() >= solar_due:
+            poller.sample()
+            solar_due += solar_interval
+        if clock.time() >= memory_due:
+            gc.collect()
+            memory.append((clock.time(), memory_use(),
+                           len(gc.get_objects())))
+            memory_due += DAY
+            if len(memory) % 30 == 1:
+                print(f"  {when(start, clock.time())}: "
+                      f"{tracker.segments} segments, "
+                      f"{memory[-1][1]:.1f} MB, "
+                      f"{time.monotonic() - started:.0f} s so far")
+
+    recorder.stop_recording()
+    solar_readings = None
+    if poller is not None:
+        poller.flush()
+        solar_readings = poller.store.count()
+        poller.close()
+        sunsaver.stop()
+    logger.removeHandler(log_handler)
+    log_handler.close()
+    elapsed = time.monotonic() - started
+
+    print()
+    print(f"Simulated {args.days:g} days in {elapsed:.0f} s "
+          f"({args.days * DAY / elapsed:,.0f}x real time)")
+    print(f"Segments recorded: {tracker.segments}")
+    misfiled = 0
+    for path in drives + [home_dir]:
+        survey = survey_drive(path)
+        misfiled += survey['misfiled']
+        print(f"  {os.path.relpath(path, base):8s} {survey['files']:6d} "
+              f"files {survey['bytes'] / 1e9:8.1f} GB of "
+              f"{capacities[path] / 1e9:.0f} in {survey['days']} day "
+              f"directories")
+        if recorder.used[path] > capacities[path]:
+            print(f"           overfilled by "
+                  f"{(recorder.used[path] - capacities[path]) / 1e9:.1f} "
+                  f"GB: the last segment would have been cut short")
+    print(f"Segments in another day's directory: {misfiled}")
+    print(f"Gaps over {GAP_THRESHOLD} s between segments: {tracker.gaps}, "
+          f"{tracker.gap_time / 60:.1f} min in all")
+    if tracker.gaps:
+        gap, at = tracker.longest_gap
+        print(f"  longest {gap / 60:.1f} min, ending {when(start, at)}")
+    print('Drive switches:')
+    for at, old, new in tracker.switches:
+        old = os.path.relpath(old, base) if old else '-'
+        new = os.path.relpath(new, base) if new else '-'
+        print(f"  {when(start, at)}  {old} -> {new}")
+    if not recorder.recording and tracker.last_stop is not None:
+        print(f"Recording stopped for good {when(start, tracker.last_stop)}")
+    print(f"Logs: {directory_size(log_dir) / 1e6:.1f} MB in "
+          f"{len(os.listdir(log_dir))} files")
+    if poller is not None:
+        solar_log = os.path.join(home_dir, DB_NAME)
+        print(f"Solar log: {os.path.getsize(solar_log) / 1e6:.1f} MB, "
+              f"{solar_readings} readings")
+    first, last = memory[0], memory[-1]
+    months = max((last[0] - first[0]) / (30 * DAY), 1 / 30)
+    print(f"Memory: {first[1]:.1f} MB at start, {last[1]:.1f} MB at end, "
+          f"{max(sample[1] for sample in memory):.1f} MB at most "
+          f"({(last[1] - first[1]) / months:+.2f} MB per month); "
+          f"{last[2] - first[2]:+d} Python objects")
+
+    if not args.keep:
+        shutil.rmtree(base)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Check power governor policy against a simulated battery.
+
+Runs the PowerGovernor over several simulated days, one decision per
+recording segment, with a simple model of the battery, the solar
+charge coming in and the load drawn by each recording profile. Prints
+each profile switch and a summary of time spent in each profile, the
+lowest state of charge reached, and how many switches happened within
+an hour of the previous one (which should be 0 if the hysteresis is
+doing its job).
+
+Usage:
+    python utilities/simulate_governor.py [--days N] [--dark-days N]
+        [--capacity AH] [--config cfgs/example_config.yaml]
+
+"""
+import argparse
+import math
+from collections import Counter
+
+import yaml
+
+from dencam.governor import PowerGovernor
+
+FULL_PIXEL_RATE = 1920 * 1080 * 25
+
+
+class SimulatedBattery:
+    """Lead-acid battery with a crude linear voltage model
+
+    Parameters
+    ----------
+    capacity : float
+        Capacity in amp-hours
+    charge : float
+        Initial state of charge, 0 to 1
+
+    """
+    def __init__(self, capacity, charge=0.8):
+        self.capacity = capacity
+        self.charge = charge
+        self.charging = False
+
+    def step(self, solar_current, load_current, hours):
+        """Apply net current for a period of time"""
+        net = solar_current - load_current
+        self.charging = net > 0
+        self.charge += net * hours / self.capacity
+        self.charge = min(1.0, max(0.0, self.charge))
+
+    @property
+    def voltage(self):
+        """Terminal voltage; reads high while being charged"""
+        resting = 11.6 + 1.6 * self.charge
+        return resting + (0.4 if self.charging else 0.0)
+
+    @property
+    def charge_state(self):
+        """SunSaver-style charge state code (5 bulk, 3 night)"""
+        return 5 if self.charging else 3
+
+
+def profile_current(profile):
+    """Modelled current draw in amps while using a profile"""
+    width, height = profile['resolution']
+    share = width * height * profile['frame_rate'] / FULL_PIXEL_RATE
+    return 0.25 + profile['duty_cycle'] * (0.15 + 0.25 * share)
+
+
+def solar_current(hour_of_day, peak, cloudiness):
+    """Modelled charge current from the panels at a time of day"""
+    if not 6 <= hour_of_day < 18:
+        return 0.0
+    return peak * (1 - cloudiness) * math.sin(math.pi
+                                              * (hour_of_day - 6) / 12)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=14,
+                        help='number of days to simulate')
+    parser.add_argument('--dark-days', type=int, default=5,
+                        help='consecutive heavily overcast days, '
+                        'starting on day 3')
+    parser.add_argument('--capacity', type=float, default=60,
+                        help='battery capacity in amp-hours')
+    parser.add_argument('--peak-solar', type=float, default=2.5,
+                        help='charge current at midday in amps')
+    parser.add_argument('--config',
+                        help='DenCam config file to take RECORD_LENGTH '
+                        'and POWER_* settings from')
+    args = parser.parse_args()
+
+    configs = {'RECORD_LENGTH': 300}
+    if args.config:
+        with open(args.config, encoding='utf8') as config_file:
+            configs.update(yaml.load(config_file, Loader=yaml.SafeLoader))
+
+    governor = PowerGovernor(configs)
+    battery = SimulatedBattery(args.capacity)
+    step_hours = configs['RECORD_LENGTH'] / 3600
+    steps = int(args.days * 24 / step_hours)
+
+    time_in_profile = Counter()
+    lowest_charge = battery.charge
+    last_switch_hour = None
+    rapid_switches = 0
+    profile = governor.profile
+    for step in range(steps):
+        hour = step * step_hours
+        day = int(hour // 24)
+        cloudiness = 0.9 if 2 <= day < 2 + args.dark_days else 0.2
+
+        new_profile = governor.select(battery.voltage, battery.charge_state)
+        if new_profile is not profile:
+            print(f"day {day:2d} {hour % 24:5.2f}h  "
+                  f"{battery.voltage:5.2f} V  "
+                  f"{profile['name']} -> {new_profile['name']}")
+            if last_switch_hour is not None and hour - last_switch_hour < 1:
+                rapid_switches += 1
+            last_switch_hour = hour
+            profile = new_profile
+
+        battery.step(solar_current(hour % 24, args.peak_solar, cloudiness),
+                     profile_current(profile), step_hours)
+        time_in_profile[profile['name']] += step_hours
+        lowest_charge = min(lowest_charge, battery.charge)
+
+    print()
+    for candidate in governor.profiles:
+        name = candidate['name']
+        print(f"{name:20s} {time_in_profile[name]:7.1f} h")
+    print(f"Lowest state of charge: {100 * lowest_charge:.0f}%")
+    print(f"Switches within an hour of the previous one: {rapid_switches}")
+
+
+if __name__ == '__main__':
+    main()
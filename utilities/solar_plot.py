@@ -1,37 +1,190 @@
-import sys
+"""Plot SunSaver data from the solar log.
 
-import matplotlib.pyplot as plt
+Reads a solar log CSV (as written by older DenCam versions or by
+`python -m dencam.solar_store export`) or a solar.db directly, in
+chunks so that a long deployment's worth of readings never has to be
+held as text in memory. Each requested field gets its own panel on a
+shared time axis. Long series are decimated before plotting so that a
+year of per-minute readings renders in seconds.
+
+Usage:
+    python utilities/solar_plot.py /home/pi/solar.csv Battery_Voltage
+    python utilities/solar_plot.py solar.db Battery_Voltage Array_Voltage \
+        --start 2024-03-01 --end 2024-04-01 -o march.png
+
+"""
+import argparse
+import sqlite3
+
+import matplotlib
+import numpy as np
 import pandas as pd
+from dateutil import tz
+
+CHUNK_SIZE = 100000
+
+# column names used in solar.db for the solar.csv field names
+DB_COLUMNS = {'Battery_Voltage': 'battery_voltage',
+              'Array_Voltage': 'array_voltage',
+              'Load_Voltage': 'load_voltage',
+              'Charge_Current': 'charge_current',
+              'Load_Current': 'load_current',
+              'Ambient_Temp': 'ambient_temp',
+              'RTS_Temp': 'rts_temp',
+              'Charge_State': 'charge_state',
+              'Ah_Charge': 'ah_charge',
+              'Ah_Load': 'ah_load'}
+
+
+def _csv_chunks(path, fields):
+    reader = pd.read_csv(path, usecols=['Date', 'Time'] + fields,
+                         dtype=str, chunksize=CHUNK_SIZE,
+                         encoding_errors='replace', on_bad_lines='skip')
+    for chunk in reader:
+        stamp = chunk['Date'].str.cat(chunk['Time'], sep=' ')
+        frame = pd.DataFrame(
+            {'time': pd.to_datetime(stamp, format='%Y-%m-%d %Hh%Mm%Ss',
+                                    errors='coerce')})
+        for field in fields:
+            frame[field] = pd.to_numeric(chunk[field], errors='coerce')
+        yield frame
+
+
+def _db_chunks(path, fields):
+    columns = ', '.join(f'{DB_COLUMNS[field]} AS {field}'
+                        for field in fields)
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        query = f'SELECT ts, {columns} FROM samples ORDER BY ts'
+        for chunk in pd.read_sql_query(query, conn, chunksize=CHUNK_SIZE):
+            stamps = pd.to_datetime(chunk.pop('ts'), unit='s', utc=True)
+            chunk['time'] = stamps.dt.tz_convert(tz.tzlocal()) \
+                                  .dt.tz_localize(None)
+            yield chunk
+    finally:
+        conn.close()
+
+
+def load(path, fields, start=None, end=None):
+    """Load the given fields from a solar log, limited to a time range
+
+    Returns:
+        pandas.DataFrame: 'time' column plus one column per field,
+        rows with unparseable times dropped
+
+    """
+    chunks = _db_chunks if path.endswith('.db') else _csv_chunks
+    frames = []
+    for frame in chunks(path, fields):
+        keep = frame['time'].notna()
+        if start is not None:
+            keep &= frame['time'] >= start
+        if end is not None:
+            keep &= frame['time'] < end
+        frames.append(frame[keep])
+    if not frames:
+        return pd.DataFrame(columns=['time'] + fields)
+    return pd.concat(frames, ignore_index=True).sort_values('time')
+
+
+def minmax_decimate(x, y, points):
+    """Keep the minimum and maximum of each of points/2 buckets"""
+    if len(y) <= points:
+        return x, y
+    size = -(-len(y) // max(1, points // 2))
+    buckets = -(-len(y) // size)
+    padded = np.full(buckets * size, np.nan)
+    padded[:len(y)] = y
+    grid = padded.reshape(buckets, size)
+    # only the final bucket can be short, and never entirely padding
+    offsets = np.arange(buckets) * size
+    low = offsets + np.nanargmin(grid, axis=1)
+    high = offsets + np.nanargmax(grid, axis=1)
+    keep = np.unique(np.concatenate([low, high]))
+    return x[keep], y[keep]
+
+
+def lttb_decimate(x, y, points):
+    """Largest-Triangle-Three-Buckets downsampling to given points
+
+    Picks from each bucket the point forming the largest triangle with
+    the point kept from the previous bucket and the mean of the next
+    bucket, which preserves the visual shape of the series.
 
+    """
+    length = len(y)
+    if length <= points or points < 3:
+        return x, y
+    xs = x.astype('int64').astype(float) if x.dtype.kind == 'M' else x
+    edges = np.linspace(1, length - 1, points - 1).astype(int)
+    keep = np.empty(points, dtype=int)
+    keep[0], keep[-1] = 0, length - 1
+    previous = 0
+    for bucket in range(points - 2):
+        first, last = edges[bucket], edges[bucket + 1]
+        next_last = edges[bucket + 2] if bucket + 2 < len(edges) else length
+        mean_x = xs[last:next_last].mean()
+        mean_y = y[last:next_last].mean()
+        area = np.abs((xs[previous] - mean_x) * (y[first:last] - y[previous])
+                      - (xs[previous] - xs[first:last])
+                      * (mean_y - y[previous]))
+        previous = first + int(np.argmax(area))
+        keep[bucket + 1] = previous
+    return x[keep], y[keep]
 
-def _get_x_axis_label(date, time):
-    date_time_label = []
-    for i in range(len(date)):
-        date_time_label.append(str(date[i])[5:] + ':' + time[i][:3])
-    return date_time_label
 
+DECIMATORS = {'minmax': minmax_decimate, 'lttb': lttb_decimate}
 
-def _get_argument():
-    return sys.argv[1]
 
+def main():
+    parser = argparse.ArgumentParser(
+        description='Plot fields of a DenCam solar log.')
+    parser.add_argument('solar_log', help='solar.csv or solar.db file')
+    parser.add_argument('fields', nargs='+', choices=list(DB_COLUMNS),
+                        metavar='field',
+                        help='field(s) to plot, e.g. Battery_Voltage')
+    parser.add_argument('--start', type=pd.Timestamp,
+                        help='first date/time to plot, e.g. 2024-03-01')
+    parser.add_argument('--end', type=pd.Timestamp,
+                        help='date/time to stop before')
+    parser.add_argument('--decimate', choices=['minmax', 'lttb', 'none'],
+                        default='minmax',
+                        help='how to thin long series (default: minmax)')
+    parser.add_argument('--points', type=int, default=4000,
+                        help='approximate points per field after '
+                        'decimation (default: 4000)')
+    parser.add_argument('-o', '--output',
+                        help='write plot to this file (.png, .svg, ...) '
+                        'instead of showing it')
+    args = parser.parse_args()
 
-file_path = "/home/pi/dencam/solar.csv"  # path to solar goes here
+    if args.output:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
 
+    data = load(args.solar_log, args.fields, args.start, args.end)
+    print(f"Loaded {len(data)} readings")
 
-plt.rcParams["figure.figsize"] = [800, 6]
-plt.rcParams["figure.autolayout"] = True
-plt.xticks(rotation=90)
-plt.rc('axes', labelsize=5)
+    fig, axes = plt.subplots(len(args.fields), 1, sharex=True, squeeze=False,
+                             figsize=(12, 2.5 * len(args.fields)),
+                             constrained_layout=True)
+    for axis, field in zip(axes[:, 0], args.fields):
+        series = data[['time', field]].dropna()
+        x = series['time'].to_numpy()
+        y = series[field].to_numpy(dtype=float)
+        if args.decimate != 'none':
+            x, y = DECIMATORS[args.decimate](x, y, args.points)
+        axis.plot(x, y, linewidth=0.7)
+        axis.set_ylabel(field.replace('_', ' '))
+        axis.grid(True, alpha=0.3)
+    fig.autofmt_xdate()
 
-data_frame = pd.read_csv(file_path)
-date_list = data_frame["Date"].tolist()
-time_list = data_frame["Time"].tolist()
-date_time_label = _get_x_axis_label(date_list, time_list)
+    if args.output:
+        fig.savefig(args.output, dpi=150)
+        print(f"Wrote {args.output}")
+    else:
+        plt.show()
 
-solar_data = str(_get_argument())
 
-plt.title(solar_data)
-plt.plot(date_time_label, data_frame[solar_data], 'g--', label=solar_data)
-plt.scatter(date_time_label, data_frame[solar_data], marker='o')
-plt.xticks(date_time_label[::5])
-plt.show()
+if __name__ == '__main__':
+    main()